@@ -0,0 +1,507 @@
+# blockio.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import socket
+import threading
+import queue
+import struct
+import time
+from concurrent.futures import Future
+from protocol import (Fragmenter, Reassembler, tune_socket, MAX_FRAGMENT, WIRE_MAGIC, HEADER,
+                      OP_WRITE, OP_READ, OP_ACK, OP_DATA, OP_ERROR, ERR_UNKNOWN_ID,
+                      encode_text_request, encode_binary_request, decode_read_reply)
+
+
+class BlockOp:
+    """One block read or write waiting to be sent to a disk"""
+    __slots__ = ('kind', 'dss_name', 'file_name', 'stripe', 'block_idx', 'block_type', 'data', 'future')
+
+    def __init__(self, kind, dss_name, file_name, stripe, block_idx, block_type=None, data=None):
+        self.kind = kind  # 'W' or 'R'
+        self.dss_name = dss_name
+        self.file_name = file_name
+        self.stripe = stripe
+        self.block_idx = block_idx
+        self.block_type = block_type
+        self.data = data
+        self.future = Future()
+
+    def batches_with(self, other):
+        """Whether other can share a batched message with this op"""
+        return (self.kind == other.kind and self.dss_name == other.dss_name
+                and self.file_name == other.file_name)
+
+
+class RttEstimator:
+    """Smoothed RTT and retransmit timeout as in TCP (RFC 6298)"""
+
+    def __init__(self, initial_rto=0.25, min_rto=0.02, max_rto=2.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def sample(self, rtt):
+        """Fold one round trip measurement into SRTT/RTTVAR"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        """Double the timeout after a retransmission"""
+        self.rto = min(self.max_rto, self.rto * 2)
+
+
+class PendingRequest:
+    """A message sent on a channel and still waiting for its ACK or reply"""
+    __slots__ = ('seq', 'ops', 'message', 'names', 'cost', 'sent_at', 'deadline', 'retries')
+
+    def __init__(self, seq, ops):
+        self.seq = seq
+        self.ops = ops
+        self.message = None
+        self.names = None  # (dss_id, file_id) when the message teaches the disk those names
+        self.cost = 0
+        self.sent_at = 0.0
+        self.deadline = 0.0
+        self.retries = 0
+
+
+class DiskChannel:
+    """A reliable, windowed request transport to one disk over UDP.
+
+    Requests use the binary wire format from protocol.py by default, with
+    DSS and file names interned as ids, or the text format (wrapped as
+    SEQ|seq|[message]) with wire='text'. Read replies carry the request's
+    sequence number and writes are acknowledged in batches (OP_ACK or
+    SACK|seq,seq,...), so each block retires individually and only
+    unacknowledged requests are ever resent. Retransmit timeouts follow a
+    TCP-style SRTT/RTTVAR estimate with exponential backoff capped at
+    max_rto, so a dead disk fails in about max_retries * max_rto; a request
+    overtaken by DUP_THRESHOLD later ACKs is resent without waiting for
+    the timer. A congestion window in bytes (slow start, additive increase,
+    halved on loss) paces how much is outstanding at once.
+
+    Block ops that queue up behind the window for the same DSS file are
+    packed into one WRITE_BLOCKS or READ_BLOCKS message, up to one
+    datagram's worth of payload, and share a single ACK or reply.
+    """
+
+    DUP_THRESHOLD = 3
+    MAX_OUTSTANDING = 4
+    BATCH_BUDGET = MAX_FRAGMENT
+    MAX_BATCH = 512
+    MIN_CWND = 64 * 1024
+    MAX_CWND = 64 * 1024 * 1024
+
+    def __init__(self, disk_name, disk_ip, disk_port, max_retries=6, wire='binary'):
+        self.disk_name = disk_name
+        self.addr = (disk_ip, disk_port)
+        self.max_retries = max_retries
+        self.wire = wire
+
+        # Interned names - ids are only used once the disk has ACKed a message teaching them
+        self.dss_ids = {}  # of the format {dss_name: id}
+        self.file_ids = {}  # of the format {file_name: id}
+        self.confirmed = set()  # of the format {(dss_id, file_id)}
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('', 0))
+        self.sock.settimeout(0.01)
+        tune_socket(self.sock)
+
+        # Large blocks travel as fragment trains in both directions
+        self.fragmenter = Fragmenter(cache_bytes=16 * 1024 * 1024)
+        self.reassembler = Reassembler()
+
+        self.pending = {}  # of the format {seq: PendingRequest}, in send order
+        self.next_seq = 1
+        self.highest_acked = 0
+        self.rtt = RttEstimator()
+        self.cwnd = 4 * self.MIN_CWND
+        self.ssthresh = self.MAX_CWND
+        self.in_flight = 0
+        self.last_loss = 0.0
+        self.read_reply_size = 4096  # Running per-block estimate used to charge reads to the window
+        self.carry = None  # An op taken off the queue that did not fit the last batch
+        self.retransmits = 0
+
+        self.lock = threading.Lock()
+        self.room = threading.Condition(self.lock)
+        self.closed = False
+
+        self.jobs = queue.Queue()
+        self.sender = threading.Thread(target=self.send_loop, daemon=True)
+        self.receiver = threading.Thread(target=self.receive_loop, daemon=True)
+        self.sender.start()
+        self.receiver.start()
+
+    def submit(self, op):
+        """Queue a BlockOp for this disk and return its Future.
+
+        Writes resolve to None once acknowledged; reads resolve to the block.
+        """
+        self.jobs.put(op)
+        return op.future
+
+    def op_cost(self, op):
+        """Bytes an op is charged against the congestion window"""
+        return len(op.data) if op.kind == 'W' else self.read_reply_size
+
+    def next_batch(self, first):
+        """Pack ops waiting in the queue behind first into one batch"""
+        ops = [first]
+        size = self.op_cost(first)
+        while len(ops) < self.MAX_BATCH:
+            op = self.carry
+            if op is None:
+                try:
+                    op = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+            self.carry = None
+            if op is None:
+                self.jobs.put(None)  # Shutting down - leave the sentinel for send_loop
+                break
+            if not first.batches_with(op) or size + self.op_cost(op) > self.BATCH_BUDGET:
+                self.carry = op
+                break
+            if op.future.set_running_or_notify_cancel():
+                ops.append(op)
+                size += self.op_cost(op)
+        return ops
+
+    def send_loop(self):
+        """Send queued ops as the congestion window allows"""
+        while True:
+            op = self.carry if self.carry is not None else self.jobs.get()
+            self.carry = None
+            if op is None:
+                break
+            if not op.future.set_running_or_notify_cancel():
+                continue
+
+            # Small ops also wait while a few messages are outstanding so that
+            # the ones queued behind them can be packed into one batch
+            batchable = self.op_cost(op) < self.BATCH_BUDGET
+            with self.lock:
+                # Waiting for room, but always letting one message through
+                while self.pending and not self.closed and (
+                        (batchable and len(self.pending) >= self.MAX_OUTSTANDING)
+                        or self.in_flight + self.op_cost(op) > self.cwnd):
+                    self.room.wait(0.1)
+
+            # Whatever queued up while waiting goes out in the same message
+            ops = self.next_batch(op)
+            with self.lock:
+                request = PendingRequest(self.next_seq, ops)
+                self.next_seq += 1
+                self.encode(request)
+                request.cost = sum(self.op_cost(o) for o in ops) + (
+                    len(request.message) if op.kind == 'R' else 0)
+                self.pending[request.seq] = request
+                self.in_flight += request.cost
+            self.transmit(request)
+
+    def intern(self, table, name):
+        """Return the id for a name, assigning the next one on first use"""
+        if name not in table:
+            table[name] = len(table) + 1
+        return table[name]
+
+    def encode(self, request):
+        """Build a request's message in this channel's wire format (caller holds the lock)"""
+        first = request.ops[0]
+        op = OP_WRITE if first.kind == 'W' else OP_READ
+        entries = [(o.stripe, o.block_idx, o.block_type, o.data) for o in request.ops]
+        if self.wire == 'text':
+            request.message = (f"SEQ|{request.seq}|".encode('utf-8')
+                               + encode_text_request(op, first.dss_name, first.file_name, entries))
+            return
+        ids = (self.intern(self.dss_ids, first.dss_name), self.intern(self.file_ids, first.file_name))
+        request.names = None if ids in self.confirmed else ids
+        names = (first.dss_name, first.file_name) if request.names else None
+        request.message = encode_binary_request(op, request.seq, ids[0], ids[1], entries, names)
+
+    def transmit(self, request):
+        """(Re)send one request and arm its retransmit timer"""
+        now = time.monotonic()
+        request.sent_at = now
+        # The shared RTO is already backed off per timeout (capped at max_rto)
+        request.deadline = now + self.rtt.rto
+        try:
+            self.fragmenter.send(self.sock, request.message, self.addr)
+        except OSError:
+            pass  # Treated like a lost datagram
+
+    def receive_loop(self):
+        """Complete requests from replies and SACKs, and drive retransmits"""
+        while not self.closed:
+            try:
+                data, _ = self.sock.recvfrom(65536)
+                if data.startswith(b'FRAG|'):
+                    data = self.reassembler.add(data, self.addr)
+                elif data.startswith(b'FRAG_NACK|'):
+                    self.fragmenter.handle_nack(self.sock, data, self.addr)
+                    data = None
+
+                if data and data[0] == WIRE_MAGIC:
+                    self.handle_binary(data)
+                elif data and data.startswith(b'SACK|'):
+                    for seq in data[5:].split(b','):
+                        self.complete(int(seq))
+                    self.fast_retransmit()
+                elif data and data.startswith(b'SEQ|'):
+                    seq_end = data.index(b'|', 4)
+                    self.complete(int(data[4:seq_end]), data[seq_end + 1:])
+            except socket.timeout:
+                pass
+            except OSError:
+                if self.closed:
+                    break
+
+            # Asking the disk for fragments missing from stalled replies
+            try:
+                for _, nack in self.reassembler.stale():
+                    self.sock.sendto(nack, self.addr)
+            except OSError:
+                pass
+
+            self.check_timers()
+
+    def handle_binary(self, data):
+        """Dispatch a binary ACK, read reply or error from the disk"""
+        _, _, op, _, seq, _, _, code, _, count, _ = HEADER.unpack_from(data, 0)
+        if op == OP_ACK:
+            for acked in struct.unpack_from(f'!{count}I', data, HEADER.size):
+                self.complete(acked)
+            self.fast_retransmit()
+        elif op == OP_DATA:
+            self.complete(seq, data)
+        elif op == OP_ERROR and code == ERR_UNKNOWN_ID:
+            # The disk lost its name tables (restarted) - teach it the names again
+            with self.lock:
+                self.confirmed.clear()
+                request = self.pending.get(seq)
+                if request is not None:
+                    self.encode(request)
+            if request is not None:
+                self.transmit(request)
+
+    def complete(self, seq, reply=None):
+        """Retire an acknowledged message and open the window"""
+        now = time.monotonic()
+        with self.lock:
+            request = self.pending.pop(seq, None)
+            if request is None:
+                return  # Duplicate ACK or reply to a message already given up on
+            self.highest_acked = max(self.highest_acked, seq)
+            self.in_flight -= request.cost
+            if request.names:
+                self.confirmed.add(request.names)
+
+            # Karn's rule - only first transmissions give RTT samples
+            if request.retries == 0:
+                self.rtt.sample(now - request.sent_at)
+            if reply is not None:
+                per_block = len(reply) // len(request.ops)
+                self.read_reply_size = int(0.875 * self.read_reply_size + 0.125 * per_block)
+
+            if self.cwnd < self.ssthresh:
+                self.cwnd += request.cost
+            else:
+                self.cwnd += max(1, MAX_FRAGMENT * request.cost // self.cwnd)
+            self.cwnd = min(self.cwnd, self.MAX_CWND)
+            self.room.notify()
+
+        if reply is None:
+            for op in request.ops:
+                op.future.set_result(None)
+            return
+        try:
+            blocks = decode_read_reply(reply)
+        except Exception as e:
+            for op in request.ops:
+                op.future.set_exception(e)
+            return
+        for op in request.ops:
+            block = blocks.get((op.stripe, op.block_idx))
+            if block is None:
+                op.future.set_exception(ValueError(f"block {op.stripe}:{op.block_idx} missing from reply"))
+            else:
+                op.future.set_result(block)
+
+    def on_loss(self, request, now):
+        """Shrink the window once per loss event (caller holds the lock)"""
+        if request.sent_at > self.last_loss:
+            self.ssthresh = max(self.MIN_CWND, self.in_flight // 2)
+            self.cwnd = self.ssthresh
+            self.last_loss = now
+
+    def fast_retransmit(self):
+        """Resend requests overtaken by later ACKs without waiting for the timer"""
+        now = time.monotonic()
+        resend = []
+        with self.lock:
+            for seq, request in self.pending.items():
+                if seq + self.DUP_THRESHOLD > self.highest_acked:
+                    break
+                if request.retries == 0:
+                    request.retries = 1
+                    self.on_loss(request, now)
+                    resend.append(request)
+        for request in resend:
+            self.retransmits += 1
+            self.transmit(request)
+
+    def check_timers(self):
+        """Retransmit timed-out requests and fail the ones out of retries"""
+        now = time.monotonic()
+        resend = []
+        failed = []
+        with self.lock:
+            for seq, request in list(self.pending.items()):
+                if request.deadline > now:
+                    continue
+                self.on_loss(request, now)
+                if request.retries >= self.max_retries:
+                    del self.pending[seq]
+                    self.in_flight -= request.cost
+                    failed.append(request)
+                else:
+                    request.retries += 1
+                    resend.append(request)
+            if resend:
+                self.rtt.backoff()
+            if failed:
+                self.room.notify()
+
+        for request in resend:
+            self.retransmits += 1
+            self.transmit(request)
+        for request in failed:
+            for op in request.ops:
+                op.future.set_exception(socket.timeout(f"no reply from {self.disk_name}"))
+
+    def close(self):
+        """Stop both threads and close the socket"""
+        self.jobs.put(None)
+        self.sender.join()
+        with self.lock:
+            self.closed = True
+            self.room.notify_all()
+        self.receiver.join()
+        self.sock.close()
+
+
+def staged(iterable, depth, func=None):
+    """Run iterable on its own thread and yield its items through a bounded queue.
+
+    With func set, each item is passed through func on that thread, so
+    chained calls give a pipeline of overlapping stages.
+    """
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    errors = []
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(func(item) if func else item)
+        except Exception as e:
+            errors.append(e)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            break
+        yield item
+    if errors:
+        raise errors[0]
+
+
+class StripeWindow:
+    """Bound the stripes in flight, retiring each once all its blocks complete"""
+
+    def __init__(self, size):
+        self.size = size
+        self.slots = threading.Semaphore(size)
+        self.lock = threading.Lock()
+        self.failed_blocks = 0
+
+    def submit(self, start, on_block=None):
+        """Wait for a free slot, then start one stripe and track its block futures.
+
+        start is called once the slot is held and returns the block futures
+        as a list or a {block_idx: future} dict; on_block(block_idx, future)
+        is called as each one completes.
+        """
+        self.slots.acquire()
+        futures = start()
+        if not futures:
+            self.slots.release()  # Nothing to wait for
+            return
+        remaining = [len(futures)]
+
+        def retire(block_idx, future):
+            if on_block:
+                on_block(block_idx, future)
+            with self.lock:
+                if future.exception() is not None:
+                    self.failed_blocks += 1
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self.slots.release()
+
+        for block_idx, future in (futures.items() if isinstance(futures, dict) else enumerate(futures)):
+            future.add_done_callback(lambda f, i=block_idx: retire(i, f))
+
+    def drain(self):
+        """Block until every submitted stripe has retired"""
+        for _ in range(self.size):
+            self.slots.acquire()
+        for _ in range(self.size):
+            self.slots.release()
+
+
+class BlockIOEngine:
+    """Block reads and writes submitted to one persistent channel per disk"""
+
+    def __init__(self, max_retries=6, wire='binary'):
+        self.max_retries = max_retries
+        self.wire = wire
+        self.channels = {}  # of the format {(disk_ip, disk_port): DiskChannel}
+        self.lock = threading.Lock()
+
+    def channel(self, disk_name, disk_ip, disk_port):
+        """Return the channel for a disk, starting it on first use"""
+        key = (disk_ip, disk_port)
+        with self.lock:
+            if key not in self.channels:
+                self.channels[key] = DiskChannel(disk_name, disk_ip, disk_port,
+                                                   self.max_retries, self.wire)
+            return self.channels[key]
+
+    def write_block(self, disk, dss_name, file_name, stripe, block_idx, block_data, block_type):
+        """Submit a block write; the Future resolves once the disk ACKs it"""
+        op = BlockOp('W', dss_name, file_name, stripe, block_idx, block_type, block_data)
+        return self.channel(*disk).submit(op)
+
+    def read_block(self, disk, dss_name, file_name, stripe, block_idx):
+        """Submit a block read; the Future resolves to (block bytes, crc32 the disk stored)"""
+        return self.channel(*disk).submit(BlockOp('R', dss_name, file_name, stripe, block_idx))
+
+    def close(self):
+        """Stop every channel"""
+        with self.lock:
+            channels = list(self.channels.values())
+            self.channels.clear()
+        for channel in channels:
+            channel.close()
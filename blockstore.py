@@ -0,0 +1,784 @@
+# blockstore.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import os
+import hashlib
+import mmap
+import struct
+import threading
+import time
+import zlib
+from array import array
+from collections import Counter, defaultdict
+
+
+class DictBlockStore:
+    """Blocks held in RAM as nested dicts, one bytes object per block (kept for benchmark)"""
+
+    def __init__(self):
+        # of the format {dss_name: {file_name: {stripe: {block_idx: block_data}}}}
+        self.storage = {}
+
+    def put(self, dss_name, file_name, stripe, block_idx, block_data):
+        """Store one block and return its crc32"""
+        stripes = self.storage.setdefault(dss_name, {}).setdefault(file_name, {})
+        stripes.setdefault(stripe, {})[block_idx] = bytes(block_data)
+        return zlib.crc32(block_data)
+
+    def get(self, dss_name, file_name, stripe, block_idx):
+        """Return one block, or b"" if absent"""
+        try:
+            return self.storage[dss_name][file_name][stripe][block_idx]
+        except KeyError:
+            return b""
+
+    def checksum(self, dss_name, file_name, stripe, block_idx):
+        """Return the crc32 of one block (computed on demand here)"""
+        return zlib.crc32(self.get(dss_name, file_name, stripe, block_idx))
+
+    def drop_dss(self, dss_name):
+        """Delete every block of a DSS"""
+        self.storage.pop(dss_name, None)
+
+    def blocks(self):
+        """Return (dss, file, stripe, block_idx, length) of every block held"""
+        return [(dss_name, file_name, stripe, block_idx, len(block))
+                for dss_name, files in self.storage.items() for file_name, stripes in files.items()
+                for stripe, blocks in stripes.items() for block_idx, block in blocks.items()]
+
+    def commit(self):
+        """Make writes so far durable (nothing to do in memory)"""
+
+    def compact(self):
+        """Reclaim space freed by deletes (nothing to do in memory)"""
+
+    def block_count(self):
+        """Return the number of blocks held"""
+        return sum(len(blocks) for files in self.storage.values()
+                   for stripes in files.values() for blocks in stripes.values())
+
+    def close(self):
+        """Release the store"""
+
+
+class BlockArena:
+    """The blocks one disk holds for one (dss, file, block_idx), packed by stripe.
+
+    Blocks are unit bytes each and stored back to back in a chain of
+    bytearray extents: the first holds a few KiB of stripes, each next one
+    twice as many, up to extent_bytes. A bitmap records which stripes are
+    present. get() returns a copy, so a reply still being sent (or cached
+    for FRAG_NACK resends) keeps its bytes when the slot is written over
+    later. A block whose size differs from the unit is kept in a side
+    dict. Each block's crc32 is kept in a packed array indexed by stripe.
+    """
+
+    def __init__(self, unit, extent_bytes, first_bytes=4096):
+        self.unit = unit
+        self.first = max(1, first_bytes // unit)  # Stripes in the first extent
+        self.largest = max(self.first, extent_bytes // unit)  # Stripes per extent at most
+        self.doublings = 0  # Extents that grow before they reach largest
+        while self.first << self.doublings < self.largest:
+            self.doublings += 1
+        self.ramp = self.first * ((1 << self.doublings) - 1)  # Stripes held by those extents
+        self.extents = []  # bytearrays, one per span of stripes
+        self.end = 0  # Stripes covered by the extents so far
+        self.last = (0, 0, None)  # of the format (first stripe, end stripe, extent) of the last extent located
+        self.present = bytearray()  # One bit per stripe
+        self.odd = {}  # of the format {stripe: block_data} for blocks that are not unit bytes
+        self.checksums = array('I')  # crc32 of each stripe's block
+
+    def locate(self, stripe):
+        """Return (extent, byte offset) of a stripe's slot, growing the arena to cover it"""
+        first, end, extent = self.last
+        if first <= stripe < end:
+            return extent, (stripe - first) * self.unit
+        while stripe >= self.end:
+            count = min(self.first << len(self.extents), self.largest)
+            self.extents.append(bytearray(count * self.unit))
+            self.end += count
+        # Extent sizes are fixed by their index, so the slot is found arithmetically
+        if stripe < self.ramp:
+            i = (stripe // self.first + 1).bit_length() - 1
+            start = self.first * ((1 << i) - 1)
+        else:
+            i, start = divmod(stripe - self.ramp, self.largest)
+            start = stripe - start
+            i += self.doublings
+        extent = self.extents[i]
+        self.last = (start, start + len(extent) // self.unit, extent)
+        return extent, (stripe - start) * self.unit
+
+    def put(self, stripe, block_data, checksum):
+        """Copy one block into its slot"""
+        byte = stripe >> 3
+        if byte >= len(self.present):
+            self.present.extend(bytes(byte + 1 - len(self.present)))
+        if stripe >= len(self.checksums):
+            self.checksums.frombytes(bytes(self.checksums.itemsize * (len(self.present) * 8 - len(self.checksums))))
+        self.checksums[stripe] = checksum
+        if len(block_data) != self.unit:
+            self.odd[stripe] = bytes(block_data)
+            self.present[byte] &= ~(1 << (stripe & 7)) & 0xFF
+            return
+        if self.odd:
+            self.odd.pop(stripe, None)
+        extent, offset = self.locate(stripe)
+        extent[offset:offset + self.unit] = block_data
+        self.present[byte] |= 1 << (stripe & 7)
+
+    def get(self, stripe):
+        """Return a copy of one block, or None if absent"""
+        byte = stripe >> 3
+        if byte < len(self.present) and self.present[byte] >> (stripe & 7) & 1:
+            extent, offset = self.locate(stripe)
+            return extent[offset:offset + self.unit]
+        return self.odd.get(stripe)
+
+    def checksum(self, stripe):
+        """Return the crc32 stored with a stripe's block"""
+        return self.checksums[stripe] if stripe < len(self.checksums) else 0
+
+    def block_count(self):
+        """Return the number of blocks held"""
+        return int.from_bytes(self.present, 'little').bit_count() + len(self.odd)
+
+    def stripes(self):
+        """Yield (stripe, length) of every block held"""
+        for stripe in range(len(self.present) * 8):
+            if self.present[stripe >> 3] >> (stripe & 7) & 1:
+                yield stripe, self.unit
+        for stripe, block in self.odd.items():
+            yield stripe, len(block)
+
+
+class MemoryBlockStore:
+    """Blocks held in RAM in one BlockArena per (dss, file, block_idx) (lost when the disk process exits)
+
+    A disk normally receives a single block_idx of each file, so a file costs
+    one arena rather than a dict and a bytes object per block. The striping
+    unit is taken from the first block written.
+    """
+
+    def __init__(self, extent_bytes=1024 * 1024):
+        self.extent_bytes = extent_bytes
+        self.arenas = {}  # of the format {dss_name: {(file_name, block_idx): BlockArena}}
+
+    def put(self, dss_name, file_name, stripe, block_idx, block_data):
+        """Store one block and return its crc32"""
+        files = self.arenas.setdefault(dss_name, {})
+        arena = files.get((file_name, block_idx))
+        if arena is None:
+            arena = files[(file_name, block_idx)] = BlockArena(max(1, len(block_data)), self.extent_bytes)
+        checksum = zlib.crc32(block_data)
+        arena.put(stripe, block_data, checksum)
+        return checksum
+
+    def get(self, dss_name, file_name, stripe, block_idx):
+        """Return a copy of one block, or b"" if absent"""
+        try:
+            block = self.arenas[dss_name][(file_name, block_idx)].get(stripe)
+        except KeyError:
+            return b""
+        return b"" if block is None else block
+
+    def checksum(self, dss_name, file_name, stripe, block_idx):
+        """Return the crc32 stored with one block (that of b"" if absent)"""
+        arena = self.arenas.get(dss_name, {}).get((file_name, block_idx))
+        return 0 if arena is None else arena.checksum(stripe)
+
+    def drop_dss(self, dss_name):
+        """Delete every block of a DSS"""
+        self.arenas.pop(dss_name, None)
+
+    def blocks(self):
+        """Return (dss, file, stripe, block_idx, length) of every block held"""
+        return [(dss_name, file_name, stripe, block_idx, length)
+                for dss_name, files in self.arenas.items()
+                for (file_name, block_idx), arena in files.items() for stripe, length in arena.stripes()]
+
+    def commit(self):
+        """Make writes so far durable (nothing to do in memory)"""
+
+    def compact(self):
+        """Reclaim space freed by deletes (nothing to do in memory)"""
+
+    def block_count(self):
+        """Return the number of blocks held"""
+        return sum(arena.block_count() for files in self.arenas.values() for arena in files.values())
+
+    def close(self):
+        """Release the store"""
+
+
+# Every record in a segment is RECORD followed by the DSS name, the file
+# name and (for PUT) the block data:
+# kind, dss name length, file name length, stripe, block_idx, length, crc32, seq
+RECORD = struct.Struct('!BxHHIHIIQ')
+PUT = 1
+DROP = 2  # Deletes every block of the DSS written before this record's seq
+
+# A sealed segment ends with a footer holding one FOOTER_ENTRY (plus the two
+# names) per record, then TRAILER, so the index is rebuilt without a scan:
+# kind, dss name length, file name length, stripe, block_idx, length, crc32, seq, data offset
+FOOTER_ENTRY = struct.Struct('!BxHHIHIIQQ')
+TRAILER = struct.Struct('!QI8s')  # footer offset, entry count, magic
+FOOTER_MAGIC = b'DSSFOOT2'  # DSSFOOT1 footers (no crc32) are rescanned and resealed
+
+FSYNC_POLICIES = ('always', 'batch', 'never')
+
+
+class LogBlockStore:
+    """A durable block store made of append-only segment files.
+
+    Writes are appended to the active segment as PUT records; deletes from
+    FAIL are DROP records. Every record carries a sequence number, so the
+    latest PUT for a block wins and a DROP removes older PUTs regardless
+    of which segment either lives in. An in-memory index maps each block
+    to (segment, offset, length, crc32). Reads from a sealed segment are
+    copied out of an mmap of the whole file; the active segment is still
+    growing, so it is read with pread. When it reaches segment_bytes it is sealed
+    with a footer listing its records, which is all a restart has to read
+    to rebuild the index; only the unsealed tail segment is scanned.
+
+    fsync policies: 'always' syncs on every commit() (once per request),
+    'batch' syncs once sync_bytes are unsynced or sync_interval has passed
+    (a background thread covers idle periods), and 'never' leaves flushing
+    to the OS.
+    """
+
+    def __init__(self, directory, fsync='batch', segment_bytes=64 * 1024 * 1024,
+                 sync_bytes=4 * 1024 * 1024, sync_interval=0.05, compact_ratio=0.5):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.directory = directory
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self.sync_bytes = sync_bytes
+        self.sync_interval = sync_interval
+        self.compact_ratio = compact_ratio
+        os.makedirs(directory, exist_ok=True)
+
+        self.index = {}  # of the format {dss_name: {file_name: {(stripe, block_idx): (seq, segment, offset, length, crc32)}}}
+        self.drops = {}  # of the format {dss_name: seq of the latest DROP}
+        self.segments = {}  # of the format {segment: {'size', 'live', 'records'}}
+        self.maps = {}  # of the format {segment: mmap} for sealed segments
+        self.next_seq = 1
+        self.lock = threading.RLock()
+        self.compacting = threading.Lock()  # Held by the one compaction allowed at a time
+
+        self.load()
+        self.active = max(self.segments, default=0) + 1
+        self.fd = os.open(self.path(self.active), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segments[self.active] = {'size': 0, 'live': 0, 'records': []}
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+        self.closed = False
+        if self.fsync == 'batch':
+            threading.Thread(target=self.sync_loop, daemon=True).start()
+
+    def path(self, segment):
+        """Return the file path of a segment"""
+        return os.path.join(self.directory, f"segment-{segment:06d}.log")
+
+    def load(self):
+        """Rebuild the index from the segment files on disk"""
+        records = []  # of the format [(kind, seq, dss, file, stripe, block_idx, segment, offset, length, crc32)]
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith('segment-') and name.endswith('.log')):
+                continue
+            segment = int(name[8:-4])
+            entries = self.read_footer(segment)
+            if entries is None:
+                # Unsealed tail - scanned, then sealed so it is never appended to again
+                entries = self.scan_segment(segment)
+                self.seal(segment, entries)
+            size = os.path.getsize(self.path(segment))
+            self.segments[segment] = {'size': size, 'live': 0, 'records': entries}
+            records.extend((kind, seq, dss, file, stripe, idx, segment, offset, length, crc)
+                           for kind, seq, dss, file, stripe, idx, offset, length, crc in entries)
+
+        for kind, seq, dss, _, _, _, _, _, _, _ in records:
+            if kind == DROP:
+                self.drops[dss] = max(self.drops.get(dss, 0), seq)
+        for kind, seq, dss, file, stripe, idx, segment, offset, length, crc in records:
+            self.next_seq = max(self.next_seq, seq + 1)
+            if kind != PUT or seq < self.drops.get(dss, 0):
+                continue
+            blocks = self.index.setdefault(dss, {}).setdefault(file, {})
+            current = blocks.get((stripe, idx))
+            if current is None or current[0] < seq:
+                if current is not None:
+                    self.segments[current[1]]['live'] -= current[3]
+                blocks[(stripe, idx)] = (seq, segment, offset, length, crc)
+                self.segments[segment]['live'] += length
+
+    def read_footer(self, segment):
+        """Return a sealed segment's entries from its footer, or None if unsealed"""
+        with open(self.path(segment), 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size < TRAILER.size:
+                return None
+            f.seek(size - TRAILER.size)
+            footer_offset, count, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != FOOTER_MAGIC or footer_offset > size:
+                return None
+            f.seek(footer_offset)
+            footer = f.read(size - TRAILER.size - footer_offset)
+
+        entries = []
+        pos = 0
+        for _ in range(count):
+            kind, dss_len, file_len, stripe, idx, length, crc, seq, offset = FOOTER_ENTRY.unpack_from(footer, pos)
+            pos += FOOTER_ENTRY.size
+            dss = footer[pos:pos + dss_len].decode('utf-8')
+            pos += dss_len
+            file = footer[pos:pos + file_len].decode('utf-8')
+            pos += file_len
+            entries.append((kind, seq, dss, file, stripe, idx, offset, length, crc))
+        return entries
+
+    def scan_segment(self, segment):
+        """Read every record of an unsealed segment, truncating a torn tail"""
+        entries = []
+        with open(self.path(segment), 'r+b') as f:
+            data = f.read()
+            pos = 0
+            while pos + RECORD.size <= len(data):
+                kind, dss_len, file_len, stripe, idx, length, crc, seq = RECORD.unpack_from(data, pos)
+                offset = pos + RECORD.size + dss_len + file_len
+                if kind not in (PUT, DROP) or offset + length > len(data) \
+                        or zlib.crc32(data[offset:offset + length]) != crc:
+                    break  # Torn or corrupt write - everything after it is discarded
+                names = data[pos + RECORD.size:offset]
+                entries.append((kind, seq, names[:dss_len].decode('utf-8'),
+                                names[dss_len:].decode('utf-8'), stripe, idx, offset, length, crc))
+                pos = offset + length
+            if pos < len(data):
+                f.truncate(pos)
+        return entries
+
+    def seal(self, segment, entries):
+        """Append the footer that lets the segment be loaded without a scan"""
+        parts = []
+        for kind, seq, dss, file, stripe, idx, offset, length, crc in entries:
+            dss_bytes, file_bytes = dss.encode('utf-8'), file.encode('utf-8')
+            parts += [FOOTER_ENTRY.pack(kind, len(dss_bytes), len(file_bytes), stripe, idx,
+                                        length, crc, seq, offset), dss_bytes, file_bytes]
+        fd = os.open(self.path(segment), os.O_RDWR | os.O_APPEND)
+        try:
+            footer_offset = os.fstat(fd).st_size
+            # One buffer - a footer has far more parts than writev takes (IOV_MAX)
+            os.write(fd, b"".join(parts) + TRAILER.pack(footer_offset, len(entries), FOOTER_MAGIC))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, kind, dss_name, file_name, stripe, block_idx, data, seq=None):
+        """Append one record to the active segment and return its entry (caller holds the lock)"""
+        if seq is None:
+            seq = self.next_seq
+            self.next_seq += 1
+        dss_bytes, file_bytes = dss_name.encode('utf-8'), file_name.encode('utf-8')
+        crc = zlib.crc32(data)
+        header = RECORD.pack(kind, len(dss_bytes), len(file_bytes), stripe, block_idx,
+                             len(data), crc, seq)
+        info = self.segments[self.active]
+        offset = info['size'] + len(header) + len(dss_bytes) + len(file_bytes)
+        written = os.writev(self.fd, [header, dss_bytes, file_bytes, data])
+        info['size'] += written
+        self.unsynced += written
+        entry = (kind, seq, dss_name, file_name, stripe, block_idx, offset, len(data), crc)
+        info['records'].append(entry)
+        return entry
+
+    def put(self, dss_name, file_name, stripe, block_idx, block_data):
+        """Append one block, point the index at it and return its crc32"""
+        with self.lock:
+            _, seq, _, _, _, _, offset, length, crc = self.append(PUT, dss_name, file_name, stripe,
+                                                                  block_idx, block_data)
+            blocks = self.index.setdefault(dss_name, {}).setdefault(file_name, {})
+            old = blocks.get((stripe, block_idx))
+            if old is not None:
+                self.segments[old[1]]['live'] -= old[3]
+            blocks[(stripe, block_idx)] = (seq, self.active, offset, length, crc)
+            self.segments[self.active]['live'] += length
+            if self.segments[self.active]['size'] >= self.segment_bytes:
+                self.roll()
+            return crc
+
+    def get(self, dss_name, file_name, stripe, block_idx):
+        """Return a copy of one block read from its segment, or b"" if absent"""
+        with self.lock:
+            try:
+                _, segment, offset, length, _ = self.index[dss_name][file_name][(stripe, block_idx)]
+            except KeyError:
+                return b""
+            if segment == self.active:
+                return os.pread(self.fd, length, offset)
+            return self.mapping(segment)[offset:offset + length]
+
+    def checksum(self, dss_name, file_name, stripe, block_idx):
+        """Return the crc32 stored with one block (that of b"" if absent)"""
+        with self.lock:
+            entry = self.index.get(dss_name, {}).get(file_name, {}).get((stripe, block_idx))
+            return 0 if entry is None else entry[4]
+
+    def mapping(self, segment):
+        """Return an mmap of a whole sealed segment, mapping it on first use (caller holds the lock)"""
+        mapped = self.maps.get(segment)
+        if mapped is None:
+            with open(self.path(segment), 'rb') as f:
+                mapped = self.maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def drop_dss(self, dss_name):
+        """Delete every block of a DSS (durably, via a DROP record)"""
+        with self.lock:
+            _, seq, _, _, _, _, _, _, _ = self.append(DROP, dss_name, '', 0, 0, b'')
+            self.drops[dss_name] = seq
+            for blocks in self.index.pop(dss_name, {}).values():
+                for _, segment, _, length, _ in blocks.values():
+                    self.segments[segment]['live'] -= length
+            self.sync()
+
+    def commit(self):
+        """Apply the fsync policy to writes appended so far"""
+        if self.fsync == 'always' or (self.fsync == 'batch' and self.unsynced >= self.sync_bytes):
+            with self.lock:
+                self.sync()
+
+    def sync(self):
+        """fsync the active segment (caller holds the lock)"""
+        if self.unsynced:
+            os.fsync(self.fd)
+            self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync_loop(self):
+        """Flush batched writes that sit unsynced for sync_interval"""
+        while not self.closed:
+            time.sleep(self.sync_interval)
+            with self.lock:
+                if not self.closed and self.unsynced and \
+                        time.monotonic() - self.last_sync >= self.sync_interval:
+                    self.sync()
+
+    def roll(self):
+        """Seal the active segment and start a new one (caller holds the lock)"""
+        self.sync()
+        os.close(self.fd)
+        self.seal(self.active, self.segments[self.active]['records'])
+        self.segments[self.active]['size'] = os.path.getsize(self.path(self.active))
+        self.active += 1
+        self.fd = os.open(self.path(self.active), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self.segments[self.active] = {'size': 0, 'live': 0, 'records': []}
+
+    def compact(self, batch=64):
+        """Rewrite the live blocks of mostly dead sealed segments and delete them.
+
+        Runs alongside reads and writes: the lock is held for one batch of
+        records at a time and block data is read from the sealed segment
+        outside it. A block written over or dropped meanwhile is not
+        copied. Returns the number of bytes reclaimed (0 if a compaction
+        is already running).
+        """
+        if not self.compacting.acquire(blocking=False):
+            return 0
+        try:
+            reclaimed = 0
+            with self.lock:
+                victims = sorted(segment for segment, info in self.segments.items()
+                                 if segment != self.active and info['live'] < info['size'] * self.compact_ratio)
+            for segment in victims:
+                with self.lock:
+                    info = self.segments[segment]
+                    older = any(s < segment for s in self.segments if s not in victims)
+                records = info['records']
+                # A sealed segment is never written again, so it is read without the lock
+                fd = os.open(self.path(segment), os.O_RDONLY)
+                try:
+                    for start in range(0, len(records), batch):
+                        with self.lock:
+                            live = [record for record in records[start:start + batch]
+                                    if record[0] == PUT and self.current(record, segment)]
+                        copies = [(record, os.pread(fd, record[7], record[6])) for record in live]
+                        with self.lock:
+                            if self.closed:
+                                return reclaimed
+                            for kind, seq, dss, _, _, _, _, _, _ in records[start:start + batch]:
+                                # Still needed while an older segment may hold the PUTs it deletes
+                                if kind == DROP and older and self.drops.get(dss) == seq:
+                                    self.append(DROP, dss, '', 0, 0, b'', seq)
+                            for record, data in copies:
+                                if not self.current(record, segment):
+                                    continue  # Overwritten or dropped since it was read
+                                _, seq, dss, file, stripe, idx, _, length, crc = record
+                                entry = self.append(PUT, dss, file, stripe, idx, data, seq)
+                                self.index[dss][file][(stripe, idx)] = (seq, self.active, entry[6], length, crc)
+                                self.segments[self.active]['live'] += length
+                                if self.segments[self.active]['size'] >= self.segment_bytes:
+                                    self.roll()
+                finally:
+                    os.close(fd)
+
+                with self.lock:
+                    # The copies must be durable before the originals go away
+                    self.sync()
+                    mapped = self.maps.pop(segment, None)
+                    if mapped is not None:
+                        mapped.close()
+                    reclaimed += info['size']
+                    del self.segments[segment]
+                    os.remove(self.path(segment))
+            return reclaimed
+        finally:
+            self.compacting.release()
+
+    def current(self, record, segment):
+        """Return whether the index still points at a PUT record of a segment (caller holds the lock)"""
+        _, seq, dss, file, stripe, idx, _, _, _ = record
+        entry = self.index.get(dss, {}).get(file, {}).get((stripe, idx))
+        return entry is not None and entry[0] == seq and entry[1] == segment
+
+    def block_count(self):
+        """Return the number of blocks held"""
+        with self.lock:
+            return sum(len(blocks) for files in self.index.values() for blocks in files.values())
+
+    def blocks(self):
+        """Return (dss, file, stripe, block_idx, length) of every block held"""
+        with self.lock:
+            return [(dss_name, file_name, stripe, block_idx, entry[3])
+                    for dss_name, files in self.index.items() for file_name, blocks in files.items()
+                    for (stripe, block_idx), entry in blocks.items()]
+
+    def close(self):
+        """Sync and close the active segment and every mapping"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.sync()
+            os.close(self.fd)
+            for mapped in self.maps.values():
+                mapped.close()
+            self.maps.clear()
+
+
+# Distinct block contents live under this DSS name, in file blocks-<size>, one stripe per slot
+SHARED_DSS = '#dedup'
+
+# A block that shares content is stored under its own key as a REF record:
+# magic, SHA-256 of the content, content size, slot, then the owner's name
+REF = struct.Struct('!8s32sII')
+REF_MAGIC = b'DSSREF02'  # DSSREF01 records (no owner) load as owned by nobody
+
+
+class DedupBlockStore:
+    """Content-addressed blocks with reference counts, layered over another store.
+
+    Every distinct block content (by SHA-256) is stored once, in a slot
+    under SHARED_DSS, and each block holding it is a REF record under its
+    own key naming the digest, slot and owner. link() lets a writer that
+    knows a block's digest skip sending content the disk already has, but
+    only content its own user has stored: a digest alone must not let
+    anyone read another user's block. Owners are the user names given in
+    DEDUP requests (see claim), taken on trust as the manager takes them.
+    Reference counts live in memory and are rebuilt from the REF records
+    when a durable store is reopened. Writing over a block or dropping its
+    DSS releases its reference; a slot nobody references any more is
+    reused for the next new content of its size, which is safe since the
+    stores below return copies from get().
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.shared = {}  # of the format {digest: [size, slot, refs, {owner: refs}]}
+        self.links = {}  # of the format {dss_name: {(file_name, stripe, block_idx): (digest, owner)}}
+        self.owners = {}  # of the format {dss_name: {file_name: owner}}
+        self.free = defaultdict(list)  # of the format {size: [unreferenced slots]}
+        self.slots = defaultdict(int)  # of the format {size: slots allocated}
+        self.logical = 0  # Bytes of every block referencing shared content
+        self.stored = 0  # Bytes of the distinct contents
+        self.load()
+
+    def load(self):
+        """Rebuild the reference counts and file owners from the REF records already in the store"""
+        for dss_name, file_name, stripe, block_idx, length in self.store.blocks():
+            if dss_name == SHARED_DSS:
+                size = int(file_name.split('-', 1)[1])
+                self.slots[size] = max(self.slots[size], stripe + 1)
+            elif length >= REF.size:
+                record = bytes(self.store.get(dss_name, file_name, stripe, block_idx))
+                magic, digest, size, slot = REF.unpack_from(record)
+                if magic not in (REF_MAGIC, b'DSSREF01'):
+                    continue
+                owner = record[REF.size:].decode('utf-8') or None
+                entry = self.shared.setdefault(digest, [size, slot, 0, Counter()])
+                entry[2] += 1
+                entry[3][owner] += 1
+                self.logical += size
+                self.links.setdefault(dss_name, {})[(file_name, stripe, block_idx)] = (digest, owner)
+                if owner is not None:
+                    self.owners.setdefault(dss_name, {})[file_name] = owner
+
+        in_use = {(size, slot) for size, slot, _, _ in self.shared.values()}
+        self.stored = sum(size for size, _, _, _ in self.shared.values())
+        for size, count in self.slots.items():
+            self.free[size] = [slot for slot in range(count) if (size, slot) not in in_use]
+
+    def claim(self, dss_name, file_name, owner):
+        """Record the user a file belongs to, so its blocks count as stored by them"""
+        self.owners.setdefault(dss_name, {})[file_name] = owner
+
+    def put(self, dss_name, file_name, stripe, block_idx, block_data):
+        """Store one block by content, sharing an identical one if held, and return its crc32"""
+        digest = hashlib.sha256(block_data).digest()
+        if digest not in self.shared:
+            size = len(block_data)
+            if self.free[size]:
+                slot = self.free[size].pop()
+            else:
+                slot = self.slots[size]
+                self.slots[size] += 1
+            self.store.put(SHARED_DSS, f"blocks-{size}", slot, 0, block_data)
+            self.shared[digest] = [size, slot, 0, Counter()]
+            self.stored += size
+        return self.refer(dss_name, file_name, stripe, block_idx, digest)
+
+    def link(self, dss_name, file_name, stripe, block_idx, digest):
+        """Point a block at content its owner has stored; return its crc32, or None if not held"""
+        entry = self.shared.get(digest)
+        owner = self.owners.get(dss_name, {}).get(file_name)
+        if entry is None or owner is None or not entry[3][owner]:
+            return None
+        return self.refer(dss_name, file_name, stripe, block_idx, digest)
+
+    def refer(self, dss_name, file_name, stripe, block_idx, digest):
+        """Write a block's REF record to held content and return the content's crc32"""
+        entry = self.shared[digest]
+        size, slot = entry[0], entry[1]
+        owner = self.owners.get(dss_name, {}).get(file_name)
+        entry[2] += 1
+        entry[3][owner] += 1
+        self.logical += size
+        links = self.links.setdefault(dss_name, {})
+        old = links.get((file_name, stripe, block_idx))
+        links[(file_name, stripe, block_idx)] = (digest, owner)
+        if old is not None:
+            self.release(*old)
+        record = REF.pack(REF_MAGIC, digest, size, slot) + (owner or '').encode('utf-8')
+        self.store.put(dss_name, file_name, stripe, block_idx, record)
+        return self.store.checksum(SHARED_DSS, f"blocks-{size}", slot, 0)
+
+    def release(self, digest, owner):
+        """Drop one reference to a content, freeing its slot with the last one"""
+        entry = self.shared[digest]
+        entry[2] -= 1
+        entry[3][owner] -= 1
+        if not entry[3][owner]:
+            del entry[3][owner]
+        self.logical -= entry[0]
+        if not entry[2]:
+            del self.shared[digest]
+            self.stored -= entry[0]
+            self.free[entry[0]].append(entry[1])
+
+    def get(self, dss_name, file_name, stripe, block_idx):
+        """Return one block (its shared content if it has any), or b"" if absent"""
+        link = self.links.get(dss_name, {}).get((file_name, stripe, block_idx))
+        if link is None:
+            return self.store.get(dss_name, file_name, stripe, block_idx)
+        size, slot = self.shared[link[0]][:2]
+        return self.store.get(SHARED_DSS, f"blocks-{size}", slot, 0)
+
+    def checksum(self, dss_name, file_name, stripe, block_idx):
+        """Return the crc32 stored with one block's content (that of b"" if absent)"""
+        link = self.links.get(dss_name, {}).get((file_name, stripe, block_idx))
+        if link is None:
+            return self.store.checksum(dss_name, file_name, stripe, block_idx)
+        size, slot = self.shared[link[0]][:2]
+        return self.store.checksum(SHARED_DSS, f"blocks-{size}", slot, 0)
+
+    def drop_dss(self, dss_name):
+        """Delete every block of a DSS, releasing the contents they referenced"""
+        for digest, owner in self.links.pop(dss_name, {}).values():
+            self.release(digest, owner)
+        self.owners.pop(dss_name, None)
+        self.store.drop_dss(dss_name)
+
+    def blocks(self):
+        """Return (dss, file, stripe, block_idx, length) of every block held, shared contents included"""
+        return self.store.blocks()
+
+    def commit(self):
+        """Make writes so far durable"""
+        self.store.commit()
+
+    def compact(self):
+        """Reclaim space freed by deletes (freed slots are reused rather than reclaimed)"""
+        return self.store.compact()
+
+    def block_count(self):
+        """Return the number of blocks held, shared contents included"""
+        return self.store.block_count()
+
+    def stats(self):
+        """Return {blocks, unique, logical, stored, ratio, saved} for the shared contents"""
+        return {
+            'blocks': sum(entry[2] for entry in self.shared.values()),
+            'unique': len(self.shared),
+            'logical': self.logical,
+            'stored': self.stored,
+            'ratio': self.logical / self.stored if self.stored else 1.0,
+            'saved': self.logical - self.stored,
+        }
+
+    def close(self):
+        """Release the store"""
+        self.store.close()
+
+
+def benchmark(unit=4096, blocks=20000, files=4):
+    """Print memory use and per-block write/read latency of the in-memory stores"""
+    import os
+    import tracemalloc
+    payload = os.urandom(unit)
+    per_file = blocks // files
+    print(f"{blocks} blocks of {unit} bytes over {files} files")
+    print(f"{'store':<18}{'memory MiB':>12}{'overhead B/block':>18}{'write ns':>10}{'read ns':>10}")
+
+    for name, make in (('nested dicts', DictBlockStore), ('arenas', MemoryBlockStore)):
+        # A received payload is a view of a pooled buffer, as on the c-port
+        view = memoryview(bytearray(payload))
+
+        tracemalloc.start()
+        store = make()
+        for f in range(files):
+            for stripe in range(per_file):
+                store.put('dss1', f'file{f}', stripe, 2, view)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        # Timed on a fresh store, without tracemalloc slowing allocations down
+        store = make()
+        start = time.perf_counter()
+        for f in range(files):
+            for stripe in range(per_file):
+                store.put('dss1', f'file{f}', stripe, 2, view)
+        write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for f in range(files):
+            for stripe in range(per_file):
+                store.get('dss1', f'file{f}', stripe, 2)
+        read = time.perf_counter() - start
+
+        stored = per_file * files
+        print(f"{name:<18}{memory / 2**20:>12.1f}{(memory - stored * unit) / stored:>18.0f}"
+              f"{write / stored * 1e9:>10.0f}{read / stored * 1e9:>10.0f}")
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 4096)
@@ -3,26 +3,69 @@
 import socket
 import sys
 import threading
-import struct
+import select
+from concurrent.futures import ThreadPoolExecutor
+from protocol import (Fragmenter, Reassembler, AckBatcher, BufferPool, tune_socket, WIRE_MAGIC,
+                      OP_WRITE, ERR_UNKNOWN_ID, UnknownIdError, decode_text_request,
+                      decode_binary_request, encode_binary_error, read_reply_parts)
+from blockstore import MemoryBlockStore, LogBlockStore, DedupBlockStore
+from blockio import BlockIOEngine
+from rebuild import DiskRebuild
 
 class DSSDisk:
-    def __init__(self, diskname, manager_ip, manager_port, m_port, c_port):
+    def __init__(self, diskname, manager_ip, manager_port, m_port, c_port, receivers=1, workers=0,
+                 data_dir=None, fsync='batch', dedup=False):
         self.diskname = diskname
         self.manager_ip = manager_ip
         self.manager_port = manager_port
         self.m_port = m_port
         self.c_port = c_port
 
-        # Storage: {dss_name: {file_name: {stripe: {block_idx: block_data}}}}
-        self.storage = {}
+        # Blocks live in segment files under data_dir if given, otherwise in memory
+        if data_dir:
+            self.store = LogBlockStore(data_dir, fsync)
+            print(f"[DISK {diskname}] Loaded {self.store.block_count()} blocks from {data_dir}")
+        else:
+            self.store = MemoryBlockStore()
+
+        # With dedup every distinct block content is stored once, reference counted
+        self.dedup = dedup
+        if dedup:
+            self.store = DedupBlockStore(self.store)
+            stats = self.store.stats()
+            if stats['blocks']:
+                print(f"[DISK {diskname}] Dedup: {stats['blocks']} blocks share {stats['unique']} contents")
         self.lock = threading.Lock()
 
         # Create sockets
         self.m_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.m_socket.bind(('', m_port))
 
-        self.c_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.c_socket.bind(('', c_port))
+        # Several receivers share the c-port through SO_REUSEPORT where available
+        if receivers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+            print(f"[DISK {diskname}] SO_REUSEPORT unavailable, using one c-port receiver")
+            receivers = 1
+        self.c_sockets = [self.open_c_socket(c_port, receivers > 1) for _ in range(receivers)]
+        self.c_socket = self.c_sockets[0]
+
+        # Requests are handled on the receiver threads, or on a worker pool if workers > 0
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.queued = 0  # Requests handed to the pool and not yet finished
+        self.queue_lock = threading.Lock()
+        self.closed = False
+
+        # Fragmentation for blocks too large for one datagram
+        self.fragmenter = Fragmenter()
+        self.reassembler = Reassembler()
+
+        # Datagrams are received into reused buffers instead of fresh bytes objects
+        self.buffers = BufferPool()
+
+        # Write ACKs are batched per sender until the socket goes idle (or for a few ms at most)
+        self.acks = AckBatcher()
+
+        # Names interned by binary senders - {addr: ({dss_id: dss_name}, {file_id: file_name})}
+        self.peer_names = {}
 
         print(f"[DISK {diskname}] Started on ports {m_port}, {c_port}")
 
@@ -32,23 +75,41 @@ class DSSDisk:
         # Start listener threads
         self.start_listeners()
 
+    def open_c_socket(self, c_port, reuse_port):
+        """Bind one c-port socket (shared with the other receivers if reuse_port)"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', c_port))
+        tune_socket(sock)
+        return sock
+
     def close(self):
         """Close sockets gracefully."""
+        self.closed = True
         try:
             self.m_socket.close()
         except Exception:
             pass
-        try:
-            self.c_socket.close()
-        except Exception:
-            pass
+        for sock in self.c_sockets:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+        with self.lock:
+            self.store.close()
 
-    def send_command(self, command: str) -> str:
+    def send_command(self, command: str, timeout=None) -> str:
         """Send a command to the manager and return the response text."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.sendto(command.encode('utf-8'), (self.manager_ip, self.manager_port))
-        response, _ = sock.recvfrom(1024)
-        sock.close()
+        sock.settimeout(timeout)
+        try:
+            sock.sendto(command.encode('utf-8'), (self.manager_ip, self.manager_port))
+            response, _ = sock.recvfrom(1024)
+        finally:
+            sock.close()
         resp_text = response.decode('utf-8')
         return resp_text
 
@@ -64,9 +125,10 @@ class DSSDisk:
     def start_listeners(self):
         """Start listener threads for both ports."""
         m_thread = threading.Thread(target=self.listen_m_port, daemon=True)
-        c_thread = threading.Thread(target=self.listen_c_port, daemon=True)
         m_thread.start()
-        c_thread.start()
+        for sock in self.c_sockets:
+            c_thread = threading.Thread(target=self.listen_c_port, args=(sock,), daemon=True)
+            c_thread.start()
 
     def listen_m_port(self):
         """Listen for management messages."""
@@ -79,115 +141,294 @@ class DSSDisk:
                 print(f"[DISK {self.diskname}] M-port error: {e}")
                 break
 
-    def listen_c_port(self):
-        """Listen for command messages (block transfers, etc.)"""
-        while True:
+    def listen_c_port(self, sock):
+        """Listen for command messages (block transfers, etc.) on one c-port socket"""
+        sock.settimeout(self.reassembler.gap_timeout)
+        while not self.closed:
+            buf = self.buffers.acquire()
             try:
-                data, addr = self.c_socket.recvfrom(65536)
-                
-                # Parse message header to determine type
-                try:
-                    header_end = data.index(b'|', data.index(b'|', data.index(b'|') + 1) + 1)
-                    header_end = data.index(b'|', header_end + 1)
-                    header_end = data.index(b'|', header_end + 1)
-                    header_end = data.index(b'|', header_end + 1)
-                    header_end = data.index(b'|', header_end + 1)
-                except:
-                    header_end = len(data)
-                
-                header = data[:header_end].decode('utf-8', errors='ignore')
-                body = data[header_end + 1:]
-                
-                parts = header.split('|')
-                msg_type = parts[0]
-                
-                if msg_type == "WRITE_BLOCK":
-                    # Format: WRITE_BLOCK|dss_name|file_name|stripe|block_idx|block_type|block_size
-                    dss_name, file_name, stripe, block_idx, block_type, block_size = parts[1:7]
-                    self.handle_write_block(dss_name, file_name, stripe, block_idx, 
-                                           block_type, int(block_size), body, addr)
-                
-                elif msg_type == "READ_BLOCK":
-                    # Format: READ_BLOCK|dss_name|file_name|stripe|block_idx
-                    dss_name, file_name, stripe, block_idx = parts[1:5]
-                    self.handle_read_block(dss_name, file_name, stripe, block_idx, addr)
-                
-                elif msg_type == "FAIL":
-                    # Format: FAIL|dss_name
-                    dss_name = parts[1]
-                    self.handle_fail(dss_name, addr)
-                
-                elif msg_type == "RECOVER":
-                    # Format: RECOVER|dss_name|source_disk_idx
-                    dss_name, source_idx = parts[1:3]
-                    self.handle_recover(dss_name, source_idx, addr)
-                
+                request = self.receive(sock, buf)
             except Exception as e:
+                self.buffers.release(buf)
+                if self.closed:
+                    break
                 print(f"[DISK {self.diskname}] C-port error: {e}")
-                break
+                continue
 
-    def handle_write_block(self, dss_name, file_name, stripe, block_idx, 
-                          block_type, block_size, block_data, addr):
-        """Store a block from user."""
-        stripe = int(stripe)
-        block_idx = int(block_idx)
-        
-        # Extract exact block size from body
-        actual_block = block_data[:block_size]
+            if request is None:
+                self.buffers.release(buf)
+            elif self.pool is None:
+                self.serve(sock, buf, *request)
+            else:
+                with self.queue_lock:
+                    self.queued += 1
+                self.pool.submit(self.serve, sock, buf, *request)
+
+            self.flush_acks(sock)
+
+    def receive(self, sock, buf):
+        """Receive one datagram into buf; return (data, addr, seq) once a request is complete"""
+        try:
+            nbytes, addr = sock.recvfrom_into(buf)
+            data = memoryview(buf)[:nbytes]
+        except socket.timeout:
+            data = None
+
+        # Asking senders for fragments missing from stalled messages
+        for nack_addr, nack in self.reassembler.stale():
+            sock.sendto(nack, nack_addr)
+        if data is None:
+            return None
+
+        # Reassembling fragmented messages before parsing them
+        if data[:5] == b'FRAG|':
+            data = self.reassembler.add(data, addr)
+            if data is None:
+                return None
+        elif data[:10] == b'FRAG_NACK|':
+            self.fragmenter.handle_nack(sock, data, addr)
+            return None
+
+        # Unwrapping the reliable transport envelope - SEQ|seq|[message]
+        seq = None
+        if data[:4] == b'SEQ|':
+            seq_end = bytes(data[:32]).index(b'|', 4)
+            seq = str(data[4:seq_end], 'utf-8')
+            data = data[seq_end + 1:]
+        return data, addr, seq
+
+    def serve(self, sock, buf, data, addr, seq):
+        """Handle one request, keeping the disk up if it fails"""
+        try:
+            self.handle_message(data, addr, seq)
+        except Exception as e:
+            print(f"[DISK {self.diskname}] Error handling request from {addr}: {e}")
+        finally:
+            # Handlers copy what they keep, so the buffer can be reused
+            data = None
+            self.buffers.release(buf)
+            if self.pool is not None:
+                with self.queue_lock:
+                    self.queued -= 1
+                self.flush_acks(sock)
+
+    def flush_acks(self, sock):
+        """Send batched ACKs once no more requests are waiting, or once the oldest is overdue"""
+        if not self.acks.pending:
+            return
+        try:
+            if self.acks.due() or (not self.queued and not select.select([sock], [], [], 0)[0]):
+                self.acks.flush(sock)
+        except (OSError, ValueError):
+            pass  # Socket closed while shutting down
+
+    def handle_message(self, data, addr, seq=None):
+        """Parse one c-port message and dispatch it to its handler"""
+        # Block requests come in either the binary or the text wire format
+        if data[:1] == bytes([WIRE_MAGIC]):
+            dss_names, file_names = self.peer_names.setdefault(addr, ({}, {}))
+            try:
+                msg = decode_binary_request(data, dss_names, file_names)
+            except UnknownIdError as e:
+                self.c_socket.sendto(encode_binary_error(e.seq, ERR_UNKNOWN_ID), addr)
+                return
+        else:
+            msg = decode_text_request(data)
+            if msg is not None:
+                msg.seq = seq
+        if msg is not None:
+            if msg.op == OP_WRITE:
+                self.handle_write_block(msg, addr)
+            else:
+                self.handle_read_block(msg, addr)
+            return
+
+        parts = str(data, 'utf-8', errors='ignore').split('|')
+        msg_type = parts[0]
+
+        if msg_type == "FAIL":
+            # Format: FAIL|dss_name
+            dss_name = parts[1]
+            self.handle_fail(dss_name, addr)
         
+        elif msg_type == "DEDUP":
+            # Format: DEDUP|dss_name|file_name|owner|stripe:block_idx:sha256,...
+            dss_name, file_name, owner = parts[1], parts[2], parts[3]
+            entries = [(int(stripe), int(block_idx), bytes.fromhex(digest)) for stripe, block_idx, digest in
+                       (entry.split(':') for entry in parts[4].split(',') if entry)]
+            self.handle_dedup(dss_name, file_name, owner, entries, addr)
+
+        elif msg_type == "RECOVER":
+            # Format: RECOVER|dss_name|n|striping_unit|failed_idx|rate|disk:ip:port,...|size:file/size:file...
+            dss_name, n, striping_unit, failed_idx, rate, disks, files = parts[1:8]
+            disk_triples = [(name, ip, int(port)) for name, ip, port in
+                            (disk.split(':') for disk in disks.split(','))]
+            files = [(name, int(size)) for size, name in
+                     (entry.split(':', 1) for entry in files.split('/') if entry)]
+            self.handle_recover(dss_name, int(n), int(striping_unit), int(failed_idx), float(rate),
+                                disk_triples, files, addr)
+
+    def handle_write_block(self, msg, addr):
+        """Store one block or a batch of blocks from user."""
+        size = 0
         with self.lock:
-            # Initialize storage structure if needed
-            if dss_name not in self.storage:
-                self.storage[dss_name] = {}
-            if file_name not in self.storage[dss_name]:
-                self.storage[dss_name][file_name] = {}
-            if stripe not in self.storage[dss_name][file_name]:
-                self.storage[dss_name][file_name][stripe] = {}
-            
-            # Store the block
-            self.storage[dss_name][file_name][stripe][block_idx] = actual_block
-        
-        print(f"[DISK {self.diskname}] Stored {dss_name}/{file_name}/stripe{stripe}/block{block_idx} ({len(actual_block)} bytes)")
-       
-        # Send ACK back to user
-        ack = f"WRITE_ACK|{dss_name}|{file_name}|{stripe}|{block_idx}"
-        self.c_socket.sendto(ack.encode('utf-8'), addr)
-
-    def handle_read_block(self, dss_name, file_name, stripe, block_idx, addr):
-        """Retrieve a block for user."""
-        stripe = int(stripe)
-        block_idx = int(block_idx)
-        
-        block_data = b""
+            for stripe, block_idx, _, payload in msg.entries:
+                self.store_block(msg.dss_name, msg.file_name, stripe, block_idx, payload)
+                size += len(payload)
+            # Durable (per the fsync policy) before the ACK goes out
+            self.store.commit()
+
+        if msg.batch:
+            print(f"[DISK {self.diskname}] Stored {len(msg.entries)} blocks of {msg.dss_name}/{msg.file_name} ({size} bytes)")
+        else:
+            stripe, block_idx = msg.entries[0][:2]
+            print(f"[DISK {self.diskname}] Stored {msg.dss_name}/{msg.file_name}/stripe{stripe}/block{block_idx} ({size} bytes)")
+
+        # Send ACK back to user (batched for sequenced requests)
+        if msg.seq is not None:
+            if self.acks.add(addr, msg.seq, msg.wire == 'binary'):
+                self.acks.flush(self.c_socket)
+        elif msg.batch:
+            stored = ",".join(f"{stripe}:{block_idx}" for stripe, block_idx, _, _ in msg.entries)
+            ack = f"WRITE_ACKS|{msg.dss_name}|{msg.file_name}|{stored}"
+            self.c_socket.sendto(ack.encode('utf-8'), addr)
+        else:
+            stripe, block_idx = msg.entries[0][:2]
+            ack = f"WRITE_ACK|{msg.dss_name}|{msg.file_name}|{stripe}|{block_idx}"
+            self.c_socket.sendto(ack.encode('utf-8'), addr)
+
+    def store_block(self, dss_name, file_name, stripe, block_idx, block_data):
+        """Put one block into storage with its crc32 (caller holds the lock)"""
+        return self.store.put(dss_name, file_name, stripe, block_idx, block_data)
+
+    def load_block(self, dss_name, file_name, stripe, block_idx):
+        """Get one block from storage, or b"" if absent (caller holds the lock)"""
+        return self.store.get(dss_name, file_name, stripe, block_idx)
+
+    def load_checksum(self, dss_name, file_name, stripe, block_idx):
+        """Get the crc32 stored with one block (caller holds the lock)"""
+        return self.store.checksum(dss_name, file_name, stripe, block_idx)
+
+    def handle_read_block(self, msg, addr):
+        """Retrieve one block or a batch of blocks for user in one reply."""
         with self.lock:
-            if (dss_name in self.storage and 
-                file_name in self.storage[dss_name] and
-                stripe in self.storage[dss_name][file_name] and
-                block_idx in self.storage[dss_name][file_name][stripe]):
-                block_data = self.storage[dss_name][file_name][stripe][block_idx]
-        
-        print(f"[DISK {self.diskname}] Read {dss_name}/{file_name}/stripe{stripe}/block{block_idx} ({len(block_data)} bytes)")
-        
-        # Send block back with size prefix (4-byte big-endian)
-        size_bytes = struct.pack('>I', len(block_data))
-        self.c_socket.sendto(size_bytes + block_data, addr)
+            blocks = [self.load_block(msg.dss_name, msg.file_name, stripe, block_idx)
+                      for stripe, block_idx, _, _ in msg.entries]
+            checksums = [self.load_checksum(msg.dss_name, msg.file_name, stripe, block_idx)
+                         for stripe, block_idx, _, _ in msg.entries]
+
+        if msg.batch:
+            print(f"[DISK {self.diskname}] Read {len(blocks)} blocks of {msg.dss_name}/{msg.file_name}")
+        else:
+            stripe, block_idx = msg.entries[0][:2]
+            print(f"[DISK {self.diskname}] Read {msg.dss_name}/{msg.file_name}/stripe{stripe}/block{block_idx} ({len(blocks[0])} bytes)")
+
+        # The reply carries each block's key, size and checksum in the request's wire format
+        self.fragmenter.send(self.c_socket, read_reply_parts(msg, blocks, checksums), addr)
+
+    def handle_dedup(self, dss_name, file_name, owner, entries, addr):
+        """Link the blocks whose content the owner already stored and tell the user which ones to send."""
+        needed = []
+        with self.lock:
+            if self.dedup:
+                self.store.claim(dss_name, file_name, owner)
+            for stripe, block_idx, digest in entries:
+                if not self.dedup or self.store.link(dss_name, file_name, stripe, block_idx, digest) is None:
+                    needed.append(f"{stripe}:{block_idx}")
+            self.store.commit()
+
+        print(f"[DISK {self.diskname}] Dedup {dss_name}/{file_name}: {len(entries) - len(needed)} of "
+              f"{len(entries)} blocks already held")
+
+        # Format: DEDUP_NEED|dss_name|file_name|stripe:block_idx,...
+        reply = f"DEDUP_NEED|{dss_name}|{file_name}|{','.join(needed)}"
+        self.fragmenter.send(self.c_socket, reply.encode('utf-8'), addr)
 
     def handle_fail(self, dss_name, addr):
         """Simulate disk failure by clearing data for this DSS."""
         with self.lock:
-            if dss_name in self.storage:
-                del self.storage[dss_name]
+            self.store.drop_dss(dss_name)
         
         print(f"[DISK {self.diskname}] Failed DSS {dss_name} - data cleared")
+        if self.dedup:
+            self.print_dedup_stats()
         
         # Send complete message back
         fail_complete = f"FAIL_COMPLETE|{dss_name}"
         self.c_socket.sendto(fail_complete.encode('utf-8'), addr)
 
-    def handle_recover(self, dss_name, source_idx, addr):
-        """Handle recovery request (simplified)."""
-        print(f"[DISK {self.diskname}] Recovery message received (stub)")
-        # Full implementation would read from source disk, XOR, and store
+        # Reclaiming the space the dropped blocks took up in the background, so block I/O
+        # and the RECOVER that follows are not held up behind it
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Reclaim space freed by dropped blocks (the store takes its own lock a batch at a time)"""
+        try:
+            reclaimed = self.store.compact()
+        except Exception as e:
+            print(f"[DISK {self.diskname}] Compaction failed: {e}")
+            return
+        if reclaimed:
+            print(f"[DISK {self.diskname}] Compaction reclaimed {reclaimed} bytes")
+
+    def handle_recover(self, dss_name, n, striping_unit, failed_idx, rate, disk_triples, files, addr):
+        """Start rebuilding this disk's blocks of a DSS from the other disks, in the background."""
+        print(f"[DISK {self.diskname}] Rebuilding block {failed_idx} of {len(files)} files of {dss_name}"
+              + (f" at up to {rate / 1e6:.1f} MB/s" if rate else ""))
+        threading.Thread(target=self.rebuild, daemon=True,
+                         args=(dss_name, n, striping_unit, failed_idx, rate, disk_triples, files)).start()
+        self.c_socket.sendto(f"RECOVER_STARTED|{dss_name}".encode('utf-8'), addr)
+
+    def rebuild(self, dss_name, n, striping_unit, failed_idx, rate, disk_triples, files):
+        """Run a DiskRebuild, reporting progress and then recovery-complete (or -failed) to the manager."""
+        def put(file_name, stripe, block):
+            with self.lock:
+                self.store_block(dss_name, file_name, stripe, failed_idx, block)
+
+        def report(job, file_name, stripe):
+            # Format: rebuild-progress|dss_name|disk_idx|file|stripe|done|total|bytes|rate
+            try:
+                self.send_command(f"rebuild-progress|{dss_name}|{failed_idx}|{file_name}|{stripe}|"
+                                  f"{job.stripes_done}|{total}|{job.bytes_rebuilt}|{job.throughput():.0f}",
+                                  timeout=1.0)
+            except OSError:
+                pass  # The next report tries again
+
+        io = BlockIOEngine()
+        job = DiskRebuild(dss_name, n, striping_unit, failed_idx, disk_triples, files, io, put,
+                          rate=rate, report=report)
+        total = job.total_stripes()
+        try:
+            stripes, size, seconds = job.run()
+            with self.lock:
+                self.store.commit()
+        except Exception as e:
+            print(f"[DISK {self.diskname}] Rebuild of {dss_name} failed: {e}")
+            outcome, summary = 'recovery-failed', f"rebuild failed: {e}".replace("|", "/")
+        else:
+            mb_per_s = size / seconds / 1e6 if seconds else 0.0
+            print(f"[DISK {self.diskname}] Rebuilt {stripes} stripes ({size} bytes) of {dss_name} "
+                  f"in {seconds:.2f}s - {mb_per_s:.1f} MB/s ({job.reread} blocks read again)")
+            outcome = 'recovery-complete'
+            summary = f"{self.diskname} rebuilt {stripes} stripes, {size} bytes in {seconds:.2f}s, {mb_per_s:.1f} MB/s"
+        finally:
+            io.close()
+
+        # Format: recovery-complete|dss_name|summary, or recovery-failed|dss_name|reason
+        for _ in range(3):
+            try:
+                self.send_command(f"{outcome}|{dss_name}|{summary}", timeout=2.0)
+                break
+            except OSError:
+                continue
+
+    def print_dedup_stats(self):
+        """Print the dedup ratio and the bytes it saves."""
+        with self.lock:
+            stats = self.store.stats()
+        print(f"[DISK {self.diskname}] Dedup: {stats['blocks']} blocks ({stats['logical']} bytes) stored as "
+              f"{stats['unique']} contents ({stats['stored']} bytes) - ratio {stats['ratio']:.2f}x, "
+              f"{stats['saved']} bytes saved")
 
     def run(self):
         """Interactive command loop for the disk process."""
@@ -210,8 +451,19 @@ class DSSDisk:
                         self.close()
                         sys.exit(0)
 
+                elif cmd == "stats":
+                    stats = self.buffers.stats()
+                    print(f"[DISK {self.diskname}] Receive buffers: {stats['allocated']} allocated, "
+                          f"{stats['reused']} reused ({stats['reuse_rate']:.1%}), "
+                          f"{stats['in_use']} in use, {stats['free']} free")
+                    with self.lock:
+                        blocks = self.store.block_count()
+                    print(f"[DISK {self.diskname}] Stored blocks: {blocks}")
+                    if self.dedup:
+                        self.print_dedup_stats()
+
                 else:
-                    print("Commands: deregister-disk, quit")
+                    print("Commands: deregister-disk, stats, quit")
 
         except KeyboardInterrupt:
             # Best-effort deregister on Ctrl+C
@@ -223,15 +475,22 @@ class DSSDisk:
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        print("Usage: python disk.py <diskname> <manager_ip> <manager_port> <m_port> <c_port>")
+    args = [arg for arg in sys.argv if arg != "--dedup"]
+    if len(args) not in (6, 7, 8, 9, 10):
+        print("Usage: python disk.py <diskname> <manager_ip> <manager_port> <m_port> <c_port> "
+              "[receivers] [workers] [data_dir] [always|batch|never] [--dedup]")
         sys.exit(1)
 
-    diskname = sys.argv[1]
-    manager_ip = sys.argv[2]
-    manager_port = int(sys.argv[3])
-    m_port = int(sys.argv[4])
-    c_port = int(sys.argv[5])
+    diskname = args[1]
+    manager_ip = args[2]
+    manager_port = int(args[3])
+    m_port = int(args[4])
+    c_port = int(args[5])
+    receivers = int(args[6]) if len(args) > 6 else 1
+    workers = int(args[7]) if len(args) > 7 else 0
+    data_dir = args[8] if len(args) > 8 else None
+    fsync = args[9] if len(args) > 9 else 'batch'
 
-    disk = DSSDisk(diskname, manager_ip, manager_port, m_port, c_port)
+    disk = DSSDisk(diskname, manager_ip, manager_port, m_port, c_port, receivers, workers,
+                   data_dir, fsync, dedup="--dedup" in sys.argv)
     disk.run()
\ No newline at end of file
@@ -0,0 +1,161 @@
+# journal.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import os
+import json
+import threading
+import zlib
+
+# One decoder shared by every log line (json.loads re-detects the encoding each call)
+decode_record = json.JSONDecoder().decode
+
+
+class Journal:
+    """The manager's metadata write-ahead log plus snapshots.
+
+    Every state change is appended as one line: the crc32 of a JSON array
+    [lsn, kind, args...] and the array itself. Appends are buffered, and
+    sync() makes everything appended so far durable with one fsync. A
+    caller that arrives while another fsync is running waits for it and
+    usually finds its records already covered, so concurrent requests
+    share fsyncs (group commit).
+
+    snapshot() writes the whole state to snapshot.json (atomically, in the
+    background) and starts a new log file, so startup loads the snapshot
+    and replays only the records after it. The log is split into files
+    named wal-<first lsn>.log, and files the snapshot covers are deleted.
+    """
+
+    def __init__(self, directory, fsync=True, snapshot_every=100000):
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every  # Records between automatic snapshots
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.Lock()  # Guards appends and the open log file
+        self.sync_lock = threading.Lock()  # One fsync (or rotation) at a time
+        self.lsn = 0  # Last record appended
+        self.durable = 0  # Last record known to be on disk
+        self.since_snapshot = 0
+        self.snapshotting = None  # Thread writing a snapshot
+        self.file = None
+
+    def path(self, name):
+        """Return the path of a file in the journal directory"""
+        return os.path.join(self.directory, name)
+
+    def recover(self):
+        """Return (snapshot state or None, records after it) and open the log for appends"""
+        state = None
+        if os.path.exists(self.path('snapshot.json')):
+            with open(self.path('snapshot.json'), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.lsn = state['lsn']
+
+        records = []
+        logs = sorted(name for name in os.listdir(self.directory)
+                      if name.startswith('wal-') and name.endswith('.log'))
+        for name in logs:
+            with open(self.path(name), 'r+b') as f:
+                pos = 0
+                for line in f:
+                    try:
+                        crc, payload = line.rstrip(b'\n').split(b' ', 1)
+                        if not line.endswith(b'\n') or int(crc, 16) != zlib.crc32(payload):
+                            raise ValueError
+                        record = decode_record(payload.decode('utf-8'))
+                    except ValueError:
+                        # Torn or corrupt write - everything after it is discarded
+                        f.truncate(pos)
+                        break
+                    pos += len(line)
+                    if record[0] > self.lsn:
+                        records.append(record[1:])
+                        self.lsn = record[0]
+                        self.since_snapshot += 1
+
+        self.durable = self.lsn
+        self.open_log()
+        return state, records
+
+    def open_log(self):
+        """Start appending to a log file named after the next lsn (caller holds the lock)"""
+        self.file = open(self.path(f"wal-{self.lsn + 1:012d}.log"), 'ab')
+
+    def append(self, record):
+        """Append one record (a list of JSON values), returning its lsn"""
+        with self.lock:
+            self.lsn += 1
+            payload = json.dumps([self.lsn] + record, separators=(',', ':')).encode('utf-8')
+            self.file.write(b'%08x %s\n' % (zlib.crc32(payload), payload))
+            self.since_snapshot += 1
+            return self.lsn
+
+    def sync(self):
+        """Make every record appended so far durable"""
+        with self.sync_lock:
+            with self.lock:
+                target = self.lsn
+                if self.durable >= target:
+                    return
+                self.file.flush()
+                fd = self.file.fileno()
+            if self.fsync:
+                os.fsync(fd)
+            self.durable = target
+
+    def snapshot_due(self):
+        """Return whether enough records were appended to warrant a snapshot"""
+        return self.since_snapshot >= self.snapshot_every and self.snapshotting is None
+
+    def snapshot(self, state, wait=False):
+        """Write state (as of the last appended record) as the new snapshot.
+
+        The caller must stop appending while this runs up to the log
+        rotation, which is what makes state match the lsn. The file itself
+        is written on a background thread unless wait is set.
+        """
+        with self.sync_lock:
+            with self.lock:
+                state['lsn'] = self.lsn
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+                self.durable = self.lsn
+                self.file.close()
+                self.open_log()
+                self.since_snapshot = 0
+
+        writer = threading.Thread(target=self.write_snapshot, args=(state,), daemon=True)
+        self.snapshotting = writer
+        writer.start()
+        if wait:
+            writer.join()
+
+    def write_snapshot(self, state):
+        """Write a snapshot file, then delete the log files it covers"""
+        try:
+            tmp = self.path('snapshot.json.tmp')
+            data = json.dumps(state, separators=(',', ':')).encode('utf-8')
+            with open(tmp, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp, self.path('snapshot.json'))
+
+            for name in os.listdir(self.directory):
+                if name.startswith('wal-') and name.endswith('.log') and int(name[4:-4]) <= state['lsn']:
+                    os.remove(self.path(name))
+        except OSError as e:
+            print(f"[MANAGER ERROR] Snapshot failed: {e}")
+        finally:
+            self.snapshotting = None
+
+    def close(self):
+        """Wait for a running snapshot, then sync and close the log"""
+        writer = self.snapshotting
+        if writer is not None:
+            writer.join()
+        self.sync()
+        with self.lock:
+            self.file.close()
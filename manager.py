@@ -2,28 +2,217 @@
 # Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
 import socket
 import sys
+import time
 # For DSS
 import threading
+import selectors
+import bisect
 import json
 import random
 from collections import defaultdict
+from placement import Placement, PLACEMENT_POLICIES
+from journal import Journal
+from metaindex import MetadataIndex
+
+# ls replies are cut into pages that fit the user's 4096 byte receive buffer
+LS_PAGE_BYTES = 4000
+
+class DSSLock:
+    """Leases held on one DSS, as a reader/writer lock with per-file granularity.
+
+    decommission holds the whole DSS exclusively. copy and write hold a
+    write lease on one file and read holds a read lease on one file; those
+    only conflict with each other on the same file. A disk rebuild after disk-failure
+    holds a rebuild lease, which keeps out copies and decommission but not
+    reads. Every lease carries an expiry time, so a client that crashes
+    mid-operation cannot wedge the DSS; a client still working renews its
+    lease (see renew) and the rebuilding disk's progress reports renew the
+    rebuild lease.
+    """
+
+    def __init__(self):
+        self.exclusive = None  # of the format (operation, expiry)
+        self.writers = {}  # of the format {file_name: (user_name, expiry)}
+        self.readers = defaultdict(dict)  # of the format {file_name: {user_name: [reads, expiry]}}
+        self.rebuild = None  # Expiry of the rebuild lease, renewed by progress reports
+
+    def expire(self, now):
+        """Drop every lease whose time is up, returning the dropped writers as (file, user)"""
+        if self.exclusive and self.exclusive[1] <= now:
+            self.exclusive = None
+        if self.rebuild is not None and self.rebuild <= now:
+            self.rebuild = None
+        expired = [(f, user) for f, (user, expiry) in self.writers.items() if expiry <= now]
+        for file_name, _ in expired:
+            del self.writers[file_name]
+        for file_name in list(self.readers):
+            users = self.readers[file_name]
+            for user_name in [u for u, (_, expiry) in users.items() if expiry <= now]:
+                del users[user_name]
+            if not users:
+                del self.readers[file_name]
+        return expired
+
+    def busy(self):
+        """Return whether any lease is held"""
+        return bool(self.exclusive or self.writers or self.readers or self.rebuild)
+
+    def try_write(self, file_name, user_name, expiry):
+        """Take the write lease on a file, returning whether it was free"""
+        if self.exclusive or self.rebuild or file_name in self.writers or self.readers.get(file_name):
+            return False
+        self.writers[file_name] = (user_name, expiry)
+        return True
+
+    def try_read(self, file_name, user_name, expiry):
+        """Take a read lease on a file, returning whether no writer holds it
+
+        A user reading the same file twice at once holds the lease twice.
+        """
+        if self.exclusive or file_name in self.writers:
+            return False
+        reads = self.readers[file_name].setdefault(user_name, [0, expiry])
+        reads[0] += 1
+        reads[1] = max(reads[1], expiry)
+        return True
+
+    def try_exclusive(self, operation, expiry):
+        """Take the whole DSS, returning whether no other lease is held"""
+        if self.busy():
+            return False
+        self.exclusive = (operation, expiry)
+        return True
+
+    def try_rebuild(self, expiry):
+        """Take the rebuild lease, returning whether no copy or DSS-wide operation is running"""
+        if self.exclusive or self.writers or self.rebuild:
+            return False
+        self.rebuild = expiry
+        return True
+
+    def renew(self, file_name, user_name, expiry):
+        """Push back the expiry of a user's write or read lease on a file, returning whether one is held"""
+        if self.holds_write(file_name, user_name):
+            self.writers[file_name] = (user_name, expiry)
+            return True
+        reads = self.readers.get(file_name, {}).get(user_name)
+        if reads is not None:
+            reads[1] = expiry
+            return True
+        return False
+
+    def holds_write(self, file_name, user_name):
+        """Return whether a user still holds the write lease on a file"""
+        return self.writers.get(file_name, (None,))[0] == user_name
+
+    def holds_exclusive(self, operation):
+        """Return whether an operation still holds the DSS"""
+        return self.exclusive is not None and self.exclusive[0] == operation
+
+    def release_write(self, file_name):
+        """Give up the write lease on a file"""
+        self.writers.pop(file_name, None)
+
+    def release_read(self, file_name, user_name):
+        """Give up one of a user's read leases on a file"""
+        users = self.readers.get(file_name, {})
+        reads = users.get(user_name)
+        if reads is None:
+            return
+        reads[0] -= 1
+        if not reads[0]:
+            del users[user_name]
+        if not users:
+            self.readers.pop(file_name, None)
+
+    def release_exclusive(self):
+        """Give up the whole-DSS lease"""
+        self.exclusive = None
+
+    def release_rebuild(self):
+        """Give up the rebuild lease"""
+        self.rebuild = None
+
 
 class DSSManager:
-    def __init__(self, port):
+    def __init__(self, port, verbose=False, lease_timeout=600, placement='least-loaded',
+                 data_dir=None, fsync=True, snapshot_every=100000):
         self.port = port
+        self.verbose = verbose  # Printing every received message
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.socket.bind(('', port))
+        self.socket.setblocking(False)
         
         # Adding state storage
         self.users = {}  # of the format {username: {ip, m_port, c_port}}
         self.disks = {}  # of the format {diskname: {ip, m_port, c_port, status}}
         self.dsss = {}   # of the format {dss_name: {disks, n, striping_unit, files}}
+        self.file_order = {}  # of the format {dss_name: [file names, sorted]} for ls cursors
+        self.index = MetadataIndex()  # Files by owner and by name, and per-DSS totals
         
-        self.lock = threading.Lock()
-        self.critical_section = None  # Tracking which DSS is in critical operation
-        self.read_operations = defaultdict(set)  # of the format {dss_name: {users reading}}
+        # Handlers run one at a time on the loop thread; this lock keeps close() and
+        # direct callers on other threads off the state while they do
+        self.lock = threading.RLock()
+        self.dss_locks = {}  # of the format {dss_name: DSSLock}
+        self.lease_timeout = lease_timeout  # Seconds a lease lasts unless renewed
         self.pending_copy = {}  # of the format {user_name: {dss_name, file_name, file_size, owner}}
-        self.pending_failure = {}  # of the format {user_name: dss_name}
+        self.pending_write = {}  # of the format {user_name: {dss_name, file_name, file_size}}
+        # of the format {dss_name: {disk_idx, file, stripe, done, total, bytes, started, rate[, failed]}}
+        self.rebuilds = {}  # Progress of background disk rebuilds, as last reported by the disk
+        self.placement = Placement(placement)  # Picks the DSS for each copy
+
+        # Dispatch table of the format {command: handler(params)}
+        self.handlers = {
+            'register-user': self.register_user,
+            'register-disk': self.register_disk,
+            'deregister-user': self.deregister_user,
+            'deregister-disk': self.deregister_disk,
+            'configure-dss': self.configure_dss,
+            'ls': self.handle_ls,
+            'copy': self.handle_copy_phase1,
+            'copy-complete': self.handle_copy_phase2,
+            'write': self.handle_write_phase1,
+            'write-complete': self.handle_write_phase2,
+            'write-abort': self.handle_write_abort,
+            'read': self.handle_read_phase1,
+            'read-complete': self.handle_read_complete,
+            'renew': self.handle_renew,
+            'disk-failure': self.handle_disk_failure_phase1,
+            'rebuild-progress': self.handle_rebuild_progress,
+            'rebuild-status': self.handle_rebuild_status,
+            'recovery-complete': self.handle_recovery_complete,
+            'recovery-failed': self.handle_recovery_failed,
+            'decommission-dss': self.handle_decommission_phase1,
+            'decommission-complete': self.handle_decommission_phase2,
+        }
+
+        # State changes of the format [kind, args...] - journaled, then applied by these
+        self.appliers = {
+            'register-user': self.apply_register_user,
+            'register-disk': self.apply_register_disk,
+            'deregister-user': self.apply_deregister_user,
+            'deregister-disk': self.apply_deregister_disk,
+            'configure-dss': self.apply_configure_dss,
+            'copy-complete': self.apply_copy_complete,
+            'write-complete': self.apply_write_complete,
+            'decommission': self.apply_decommission,
+        }
+
+        # With a data_dir, state survives restarts through a snapshot plus write-ahead log
+        self.journal = None
+        self.recovering = False  # Sorted names and placement are rebuilt once at the end
+        if data_dir:
+            self.journal = Journal(data_dir, fsync, snapshot_every)
+            self.recover()
+
+        # The loop sleeps in select() until a request arrives or close() wakes it
+        self.selector = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        self.closed = False
+        self.stopped = threading.Event()
 
         print(f"Manager started on port {port}")
 
@@ -32,66 +221,212 @@ class DSSManager:
         listener.start()
     
     def run(self):
-        """Main server loop"""
+        """Main server loop - one thread handling requests in arrival order.
+
+        Handlers are short in-memory work and run inline. The journal fsync,
+        the one step that blocks, is shared by every reply of a wakeup (see
+        receive_all).
+        """
+        try:
+            while not self.closed:
+                for key, _ in self.selector.select():
+                    if key.fileobj is self.wake_r:
+                        continue
+                    self.receive_all()
+        finally:
+            self.stopped.set()
+
+    def receive_all(self):
+        """Drain the socket, handling each datagram as a request"""
+        replies = []  # Responses, sent together after one journal sync
         while True:
             try:
                 data, addr = self.socket.recvfrom(2048)
-                message = data.decode('utf-8')
-                print(f"[MANAGER] Received: {message} from {addr}")
-                
-                response = self.process_message(message, addr)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if not self.closed:
+                    print(f"[MANAGER ERROR] {e}")
+                break
+            replies.append((self.handle(data, addr), addr))
+        self.send_replies(replies)
+
+    def handle(self, data, addr):
+        """Return the response to one request"""
+        try:
+            message = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return "FAILURE|Invalid message"
+        if self.verbose:
+            print(f"[MANAGER] Received: {message} from {addr}")
+        return self.process_message(message, addr)
+
+    def send_replies(self, replies):
+        """Send responses once the state changes behind them are durable"""
+        if not replies:
+            return
+        try:
+            if self.journal is not None:
+                self.journal.sync()
+            for response, addr in replies:
                 self.socket.sendto(response.encode('utf-8'), addr)
-                
-            except Exception as e:
-                print(f"[MANAGER ERROR] {e}")
+        except Exception as e:
+            print(f"[MANAGER ERROR] {e}")
+
+    def close(self):
+        """Stop the server loop after the request being handled and close the sockets"""
+        if self.closed:
+            return
+        self.closed = True
+        self.wake_w.send(b'\0')
+        self.stopped.wait()
+        if self.journal is not None:
+            # A final snapshot makes the next startup skip the log replay
+            with self.lock:
+                if self.journal.since_snapshot:
+                    self.journal.snapshot(self.snapshot_state(), wait=True)
+            self.journal.close()
+        self.selector.close()
+        for sock in (self.socket, self.wake_r, self.wake_w):
+            sock.close()
+        print("[MANAGER] Shut down")
     
     def process_message(self, message, addr):
-        """Process incoming messages and enforce critical sections"""
+        """Process incoming messages (handlers take the DSS leases they need)"""
         try:
             parts = message.split('|')
             command = parts[0]
             
-            critical_commands = ['copy', 'disk-failure', 'decommission-dss']
-            
-            # Checking if we're in criticla section for wrong DSS
-            if command in critical_commands and len(parts) > 1:
-                dss_name = parts[1]
-                with self.lock:
-                    if self.critical_section and self.critical_section != dss_name:
-                        return "FAILURE|DSS in critical operation"
-            
-            if command == "register-user":
-                return self.register_user(parts[1:])
-            elif command == "register-disk":
-                return self.register_disk(parts[1:])
-            elif command == "deregister-user":
-                return self.deregister_user(parts[1:])
-            elif command == "deregister-disk":
-                return self.deregister_disk(parts[1:])
-            elif command == "configure-dss":
-                return self.configure_dss(parts[1:])
-            elif command == "ls":
-                return self.handle_ls()
-            elif command == "copy":
-                return self.handle_copy_phase1(parts[1:])
-            elif command == "copy-complete":
-                return self.handle_copy_phase2(parts[1:])
-            elif command == "read":
-                return self.handle_read_phase1(parts[1:])
-            elif command == "read-complete":
-                return self.handle_read_complete(parts[1:])
-            elif command == "disk-failure":
-                return self.handle_disk_failure_phase1(parts[1:])
-            elif command == "recovery-complete":
-                return self.handle_recovery_complete(parts[1:])
-            elif command == "decommission-dss":
-                return self.handle_decommission_phase1(parts[1:])
-            elif command == "decommission-complete":
-                return self.handle_decommission_phase2(parts[1:])
-            else:
+            handler = self.handlers.get(command)
+            if handler is None:
                 return "FAILURE|Unknown command"
+            with self.lock:
+                response = handler(parts[1:])
+                if self.journal is not None and self.journal.snapshot_due():
+                    self.journal.snapshot(self.snapshot_state())
+                return response
         except Exception as e:
             return f"FAILURE|Error processing message: {str(e)}"
+
+    def commit(self, record):
+        """Journal a state change and apply it (caller holds the lock)"""
+        if self.journal is not None:
+            self.journal.append(record)
+        self.appliers[record[0]](*record[1:])
+
+    def recover(self):
+        """Load the last snapshot and replay the log after it"""
+        start = time.perf_counter()
+        state, records = self.journal.recover()
+        self.recovering = True
+        if state is not None:
+            self.users = state['users']
+            self.disks = state['disks']
+            for dss_name, dss in state['dsss'].items():
+                self.apply_configure_dss(dss_name, dss['n'], dss['striping_unit'], dss['disks'])
+                self.dsss[dss_name]['files'] = {file_name: {'size': size, 'owner': owner}
+                                                for file_name, size, owner in dss['files']}
+        for record in records:
+            self.appliers[record[0]](*record[1:])
+        self.recovering = False
+
+        for dss_name, dss in self.dsss.items():
+            self.file_order[dss_name] = sorted(dss['files'])
+            self.index.add_many(dss_name, dss['files'])
+            self.placement.resize(dss_name, self.index.totals[dss_name][0])
+        print(f"[MANAGER] Recovered {sum(len(dss['files']) for dss in self.dsss.values())} files "
+              f"in {len(self.dsss)} DSSs ({len(records)} log records) "
+              f"in {time.perf_counter() - start:.2f}s")
+
+    def snapshot_state(self):
+        """Return the state as compact JSON-ready data (caller holds the lock)"""
+        return {
+            'users': {name: dict(info) for name, info in self.users.items()},
+            'disks': {name: dict(info) for name, info in self.disks.items()},
+            'dsss': {name: {'disks': list(dss['disks']), 'n': dss['n'],
+                            'striping_unit': dss['striping_unit'],
+                            'files': [[file_name, info['size'], info['owner']]
+                                      for file_name, info in dss['files'].items()]}
+                     for name, dss in self.dsss.items()},
+        }
+
+    def apply_register_user(self, username, ip, m_port, c_port):
+        """Add a user"""
+        self.users[username] = {
+            'ip': ip,
+            'm_port': m_port,
+            'c_port': c_port
+        }
+
+    def apply_register_disk(self, diskname, ip, m_port, c_port):
+        """Add a free disk"""
+        self.disks[diskname] = {
+            'ip': ip,
+            'm_port': m_port,
+            'c_port': c_port,
+            'status': 'Free'
+        }
+
+    def apply_deregister_user(self, username):
+        """Remove a user"""
+        self.users.pop(username, None)
+
+    def apply_deregister_disk(self, diskname):
+        """Remove a disk"""
+        self.disks.pop(diskname, None)
+
+    def apply_configure_dss(self, dss_name, n, striping_unit, selected_disks):
+        """Add a DSS over the given disks"""
+        for disk_name in selected_disks:
+            self.disks[disk_name]['status'] = 'InDSS'
+        
+        self.dsss[dss_name] = {
+            'disks': selected_disks,
+            'n': n,
+            'striping_unit': striping_unit,
+            'files': {}
+        }
+        self.dss_locks[dss_name] = DSSLock()
+        self.file_order[dss_name] = []
+        self.index.add_dss(dss_name)
+        self.placement.add(dss_name, n)
+
+    def apply_copy_complete(self, dss_name, file_name, file_size, owner):
+        """Add a file to a DSS, replacing any file of the same name"""
+        entry = {
+            'size': file_size,
+            'owner': owner
+        }
+        if not self.recovering:
+            replaced = self.dsss[dss_name]['files'].get(file_name)
+            if replaced is None:
+                bisect.insort(self.file_order[dss_name], file_name)
+            self.index.add(dss_name, file_name, entry, replaced)
+            self.placement.resize(dss_name, file_size - (replaced['size'] if replaced else 0))
+        self.dsss[dss_name]['files'][file_name] = entry
+
+    def apply_write_complete(self, dss_name, file_name, file_size):
+        """Set the size of a file written in place"""
+        entry = self.dsss[dss_name]['files'][file_name]
+        if not self.recovering:
+            self.index.resize(dss_name, file_size - entry['size'])
+            self.placement.resize(dss_name, file_size - entry['size'])
+        entry['size'] = file_size
+
+    def apply_decommission(self, dss_name):
+        """Remove a DSS and free its disks"""
+        dss = self.dsss.pop(dss_name)
+        
+        # Releasing all the disks back to Free status
+        for disk_name in dss['disks']:
+            self.disks[disk_name]['status'] = 'Free'
+        
+        # Removing the DSS along with its leases
+        del self.dss_locks[dss_name]
+        self.rebuilds.pop(dss_name, None)
+        del self.file_order[dss_name]
+        self.index.drop_dss(dss_name, dss['files'])
+        self.placement.remove(dss_name)
     
     def register_user(self, params):
         """Handle register-user command"""
@@ -106,11 +441,7 @@ class DSSManager:
         
         
         # Storing the user info
-        self.users[username] = {
-            'ip': ip,
-            'm_port': int(m_port),
-            'c_port': int(c_port)
-        }
+        self.commit(['register-user', username, ip, int(m_port), int(c_port)])
         
         print(f"[MANAGER] User {username} registered")
         return "SUCCESS"
@@ -127,12 +458,7 @@ class DSSManager:
             return "FAILURE|Disk already registered"
         
         # Storing the disk info
-        self.disks[diskname] = {
-            'ip': ip,
-            'm_port': int(m_port),
-            'c_port': int(c_port),
-            'status': 'Free'
-        }
+        self.commit(['register-disk', diskname, ip, int(m_port), int(c_port)])
         
         print(f"[MANAGER] Disk {diskname} registered")
         return "SUCCESS"
@@ -167,39 +493,78 @@ class DSSManager:
         
         # Updating disk status
         with self.lock:
-            for disk_name in selected_disks:
-                self.disks[disk_name]['status'] = 'InDSS'
-            
-            self.dsss[dss_name] = {
-                'disks': selected_disks,
-                'n': n,
-                'striping_unit': striping_unit,
-                'files': {}
-            }
+            self.commit(['configure-dss', dss_name, n, striping_unit, selected_disks])
         
         print(f"[MANAGER] DSS {dss_name} configured with disks: {selected_disks}")
         return "SUCCESS"
     
-    def handle_ls(self):
-        """Handle ls command - list all files"""
+    def handle_ls(self, params):
+        """Handle ls command - list files one page at a time.
+
+        Format: ls|cursor|[dss=name]|[owner=name]|[prefix=text]. The cursor is
+        empty for the first page, then the one returned with the previous
+        page. Reply: SUCCESS|next_cursor|record|record... with records
+        D:n:striping_unit:disk,disk,...:dss_name and F:size:owner:file_name.
+        An empty next_cursor marks the last page.
+        """
         if not self.dsss:
             return "FAILURE|No DSSs configured"
-        
+
+        cursor = params[0] if params else ''
+        filters = dict(param.split('=', 1) for param in params[1:] if '=' in param)
+        dss_from, _, file_from = cursor.partition('/')
+        owner = filters.get('owner')
+        prefix = filters.get('prefix', '')
+
+        records = []
+        size = len(b"SUCCESS||")  # The reply's framing; each candidate adds its cursor
         with self.lock:
-            response = "SUCCESS"
-            for dss_name, dss_info in self.dsss.items():
-                response += f"|DSS:{dss_name}|n={dss_info['n']}"
-                response += f"|striping_unit={dss_info['striping_unit']}"
-                response += f"|disks={','.join(dss_info['disks'])}"
-                
-                if dss_info['files']:
-                    for file_name, file_info in dss_info['files'].items():
-                        response += f"|FILE:{file_name}|size={file_info['size']}"
-                        response += f"|owner={file_info['owner']}"
+            # Listing by owner visits only the DSSs holding the owner's files
+            owned = self.index.owned(owner) if owner is not None else None
+            if 'dss' in filters:
+                names = [filters['dss']] if filters['dss'] in self.dsss else []
+            else:
+                names = sorted(self.dsss if owned is None else owned)
+            if owned is not None:
+                names = [name for name in names if name in owned]
+
+            # Each candidate record is added with the cursor that would follow it,
+            # counted in encoded bytes since names need not be ASCII
+            def add(record, position):
+                nonlocal size
+                record_bytes = len(record.encode('utf-8')) + 1
+                if records and size + record_bytes + len(position.encode('utf-8')) > LS_PAGE_BYTES:
+                    return False
+                records.append(record)
+                size += record_bytes
+                return True
+
+            position = ''
+            for dss_name in names[bisect.bisect_left(names, dss_from) if cursor else 0:]:
+                dss = self.dsss[dss_name]
+                order = self.file_order[dss_name] if owned is None else owned[dss_name]
+                if cursor and dss_name == dss_from:
+                    start = bisect.bisect_right(order, file_from) if file_from else 0
                 else:
-                    response += "|FILES:none"
-        
-        return response
+                    header = f"D:{dss['n']}:{dss['striping_unit']}:{','.join(dss['disks'])}:{dss_name}"
+                    if not add(header, f"{dss_name}/"):
+                        return "|".join(["SUCCESS", position] + records)
+                    position = f"{dss_name}/"
+                    start = 0
+
+                # Names are sorted, so a prefix is one contiguous run
+                start = max(start, bisect.bisect_left(order, prefix))
+                for i in range(start, len(order)):
+                    file_name = order[i]
+                    if not file_name.startswith(prefix):
+                        break
+                    file_info = dss['files'][file_name]
+                    if not add(f"F:{file_info['size']}:{file_info['owner']}:{file_name}",
+                               f"{dss_name}/{file_name}"):
+                        return "|".join(["SUCCESS", position] + records)
+                    position = f"{dss_name}/{file_name}"
+
+        return "|".join(["SUCCESS", ""] + records)
     
     def handle_copy_phase1(self, params):
         """Phase 1: User requests to copy file - return DSS parameters"""
@@ -213,17 +578,19 @@ class DSSManager:
             return "FAILURE|No DSSs configured"
         
         with self.lock:
-            # Preventing operatinos during critical section
-            if self.critical_section:
-                return "FAILURE|Critical operation in progress"
-            
-            # Selecting a random DSS
-            dss_name = random.choice(list(self.dsss.keys()))
+            now = time.monotonic()
+            pending = self.pending_copy.get(owner)
+            if pending and self.lease(pending['dss_name'], now).holds_write(pending['file_name'], owner):
+                return "FAILURE|Copy already in progress for user"
+
+            # Placing the file on the best DSS (per the policy) where it can be written now
+            dss_name = self.placement.choose(
+                lambda name: self.lease(name, now).try_write(file_name, owner, now + self.lease_timeout))
+            if dss_name is None:
+                return "FAILURE|DSS in critical operation"
+            self.placement.begin(dss_name, file_size)
             dss = self.dsss[dss_name]
             
-            # Entering hte critical section for this DSS
-            self.critical_section = dss_name
-            
             # Tracking pending copy
             self.pending_copy[owner] = {
                 'dss_name': dss_name,
@@ -238,7 +605,8 @@ class DSSManager:
             disk = self.disks[disk_name]
             response += f"|{disk_name}|{disk['ip']}|{disk['c_port']}"
         
-        print(f"[MANAGER] Copy phase 1: {owner} -> {file_name} on {dss_name}")
+        print(f"[MANAGER] Copy phase 1: {owner} -> {file_name} on {dss_name} "
+              f"({self.placement.describe(dss_name)})")
         return response
     
     def handle_copy_phase2(self, params):
@@ -257,22 +625,147 @@ class DSSManager:
             
             if dss_name not in self.dsss:
                 return "FAILURE|DSS not found"
+
+            # A copy that outlived its lease may have been overtaken by another writer
+            lease = self.lease(dss_name, time.monotonic())
+            if user_name not in self.pending_copy:
+                return "FAILURE|Copy lease expired"
             
             # Updating the DSS file list
-            self.dsss[dss_name]['files'][copy_info['file_name']] = {
-                'size': copy_info['file_size'],
-                'owner': copy_info['owner']
-            }
+            self.placement.end(dss_name, copy_info['file_size'])
+            self.commit(['copy-complete', dss_name, copy_info['file_name'],
+                         copy_info['file_size'], copy_info['owner']])
             
-            # Cleaning up and exiting the critical section
+            # Cleaning up and releasing the file
             del self.pending_copy[user_name]
-            self.critical_section = None
+            lease.release_write(copy_info['file_name'])
         
         print(f"[MANAGER] Copy phase 2 complete: {copy_info['file_name']} stored")
         return "SUCCESS"
     
+    def handle_write_phase1(self, params):
+        """Phase 1: User requests to write a byte range of a file in place - return DSS params
+
+        Format: write|dss_name|file_name|offset|length|user_name. The reply
+        carries the file's current size; writing past it grows the file.
+        """
+        if len(params) != 5:
+            return "FAILURE|Invalid parameters"
+
+        dss_name, file_name, offset, length, user_name = params
+        offset, length = int(offset), int(length)
+        if offset < 0 or length < 0:
+            return "FAILURE|Invalid range"
+
+        if dss_name not in self.dsss:
+            return "FAILURE|DSS not found"
+
+        file_info = self.dsss[dss_name]['files'].get(file_name)
+        if file_info is None:
+            return "FAILURE|File not found"
+        if file_info['owner'] != user_name:
+            return "FAILURE|Not file owner"
+
+        with self.lock:
+            # Writing the file alone, like a copy of it
+            now = time.monotonic()
+            pending = self.pending_write.get(user_name)
+            if pending and self.lease(pending['dss_name'], now).holds_write(pending['file_name'], user_name):
+                return "FAILURE|Write already in progress for user"
+            if not self.lease(dss_name, now).try_write(file_name, user_name, now + self.lease_timeout):
+                return "FAILURE|DSS in critical operation"
+            self.pending_write[user_name] = {
+                'dss_name': dss_name,
+                'file_name': file_name,
+                'file_size': max(file_info['size'], offset + length)
+            }
+
+        # Building a response with the DSS parameters
+        dss = self.dsss[dss_name]
+        response = f"SUCCESS|{dss['n']}|{dss['striping_unit']}|{file_info['size']}"
+        for disk_name in dss['disks']:
+            disk = self.disks[disk_name]
+            response += f"|{disk_name}|{disk['ip']}|{disk['c_port']}"
+
+        print(f"[MANAGER] Write phase 1: {user_name} writing {length} bytes at {offset} "
+              f"of {file_name} on {dss_name}")
+        return response
+
+    def handle_write_phase2(self, params):
+        """Phase 2: User confirms the write is on the disks - commit the new size"""
+        if len(params) != 1:
+            return "FAILURE|Invalid parameters"
+
+        user_name = params[0]
+
+        with self.lock:
+            write_info = self.pending_write.get(user_name)
+            if write_info is None:
+                return "FAILURE|No pending write for user"
+            dss_name, file_name = write_info['dss_name'], write_info['file_name']
+
+            # A write that outlived its lease may have been overtaken by another writer
+            lease = self.lease(dss_name, time.monotonic())
+            if not lease.holds_write(file_name, user_name):
+                del self.pending_write[user_name]
+                return "FAILURE|Write lease expired"
+
+            self.commit(['write-complete', dss_name, file_name, write_info['file_size']])
+
+            # Cleaning up and releasing the file
+            del self.pending_write[user_name]
+            lease.release_write(file_name)
+
+        print(f"[MANAGER] Write phase 2 complete: {file_name} is {write_info['file_size']} bytes")
+        return "SUCCESS"
+
+    def handle_write_abort(self, params):
+        """Phase 2: User gives up a write - release the file, keeping its size
+
+        Format: write-abort|user_name|stripes, stripes listing (comma
+        separated) those left with parity the user could not re-sync.
+        """
+        if len(params) not in (1, 2):
+            return "FAILURE|Invalid parameters"
+
+        user_name = params[0]
+        unsynced = params[1] if len(params) == 2 else ''
+
+        with self.lock:
+            write_info = self.pending_write.pop(user_name, None)
+            if write_info is None:
+                return "FAILURE|No pending write for user"
+            lease = self.dss_locks.get(write_info['dss_name'])
+            if lease is not None and lease.holds_write(write_info['file_name'], user_name):
+                lease.release_write(write_info['file_name'])
+
+        print(f"[MANAGER] Write aborted: {write_info['file_name']}")
+        if unsynced:
+            print(f"[MANAGER] Stripes {unsynced} of {write_info['file_name']} on "
+                  f"{write_info['dss_name']} have stale parity and need a re-sync")
+        return "SUCCESS"
+
     def handle_read_phase1(self, params):
-        """Phase 1: User requests to read file - validate and return DSS params"""
+        """Phase 1: User requests to read file - validate and return DSS params
+
+        Format: read|dss_name|file_name|user_name, or read|file_name|user_name
+        to have the DSS found by name (the reply then starts SUCCESS|dss_name|...).
+        """
+        if len(params) == 2:
+            file_name, user_name = params
+            located = self.index.locate(file_name)
+            if not located:
+                return "FAILURE|File not found"
+            owned = [dss_name for dss_name, entry in located.items() if entry['owner'] == user_name]
+            if not owned:
+                return "FAILURE|Not file owner"
+            if len(owned) > 1:
+                return f"FAILURE|File is on several DSSs: {','.join(sorted(owned))}"
+            response = self.handle_read_phase1([owned[0], file_name, user_name])
+            if response.startswith("SUCCESS|"):
+                response = f"SUCCESS|{owned[0]}|{response[8:]}"
+            return response
+
         if len(params) != 3:
             return "FAILURE|Invalid parameters"
         
@@ -289,39 +782,73 @@ class DSSManager:
             return "FAILURE|Not file owner"
         
         with self.lock:
-            # Checking for critical section
-            if self.critical_section and self.critical_section != dss_name:
+            # Reading alongside other readers, but not during a copy of the file or a DSS-wide operation
+            now = time.monotonic()
+            if not self.lease(dss_name, now).try_read(file_name, user_name, now + self.lease_timeout):
                 return "FAILURE|DSS in critical operation"
-            
-            # Tracking the read operation
-            self.read_operations[dss_name].add(user_name)
         
+            watermark = self.rebuild_watermark(dss_name, file_name, file_info['size'])
+
         # Building response with the DSS parameters
         dss = self.dsss[dss_name]
         response = f"SUCCESS|{dss['n']}|{dss['striping_unit']}|{file_info['size']}"
         for disk_name in dss['disks']:
             disk = self.disks[disk_name]
             response += f"|{disk_name}|{disk['ip']}|{disk['c_port']}"
+        if watermark is not None:
+            # Stripes from the watermark on are degraded - the disk being rebuilt lacks them
+            response += f"|{watermark[0]}|{watermark[1]}"
         
         print(f"[MANAGER] Read phase 1: {user_name} reading {file_name} from {dss_name}")
         return response
     
     def handle_read_complete(self, params):
-        """Phase 2: User completes read - clean up tracking"""
-        if len(params) != 2:
+        """Phase 2: User completes read - give back its lease on the file
+
+        Format: read-complete|user_name|dss_name|file_name
+        """
+        if len(params) != 3:
             return "FAILURE|Invalid parameters"
         
-        user_name, dss_name = params
+        user_name, dss_name, file_name = params
         
         with self.lock:
-            if dss_name in self.read_operations:
-                self.read_operations[dss_name].discard(user_name)
+            if dss_name in self.dss_locks:
+                self.dss_locks[dss_name].release_read(file_name, user_name)
         
-        print(f"[MANAGER] Read complete: {user_name} on {dss_name}")
+        print(f"[MANAGER] Read complete: {user_name} on {dss_name}/{file_name}")
+        return "SUCCESS"
+
+    def handle_renew(self, params):
+        """A client still copying, writing or reading a file extends its lease on it
+
+        Format: renew|dss_name|file_name|user_name. Clients send it
+        periodically for as long as their block I/O runs, so only a client
+        that stopped doing so loses its lease after lease_timeout.
+        """
+        if len(params) != 3:
+            return "FAILURE|Invalid parameters"
+
+        dss_name, file_name, user_name = params
+        if dss_name not in self.dsss:
+            return "FAILURE|DSS not found"
+
+        with self.lock:
+            now = time.monotonic()
+            if not self.lease(dss_name, now).renew(file_name, user_name, now + self.lease_timeout):
+                return "FAILURE|Lease expired"
         return "SUCCESS"
     
     def handle_disk_failure_phase1(self, params):
-        """Phase 1: User triggers disk failure - return DSS params"""
+        """Phase 1: User triggers disk failure - pick the disk and return DSS params
+
+        The reply is SUCCESS|n|striping_unit|disk_idx|disks, disk_idx being
+        the disk to fail: a random one, unless an earlier rebuild of the
+        DSS did not finish, in which case its disk is failed again. The
+        rebuild that follows runs in the background on the failed disk,
+        so reads carry on (degraded until their stripes are rebuilt); only
+        copies and decommission wait for it.
+        """
         if len(params) != 1:
             return "FAILURE|Invalid parameters"
         
@@ -331,39 +858,138 @@ class DSSManager:
             return "FAILURE|DSS not found"
         
         with self.lock:
-            # Checking for the read operations in progress
-            if dss_name in self.read_operations and len(self.read_operations[dss_name]) > 0:
-                return "FAILURE|Read operations in progress"
-            
-            # Entering hte critical section
-            self.critical_section = dss_name
-            self.pending_failure[dss_name] = True
+            now = time.monotonic()
+            if not self.lease(dss_name, now).try_rebuild(now + self.lease_timeout):
+                return "FAILURE|DSS in critical operation"
+            # A disk left part rebuilt still lacks blocks - failing another would lose stripes
+            dss = self.dsss[dss_name]
+            previous = self.rebuilds.get(dss_name)
+            if previous is not None and previous['disk_idx'] is not None:
+                disk_idx = previous['disk_idx']
+            else:
+                disk_idx = random.randrange(dss['n'])
+            self.rebuilds[dss_name] = {'disk_idx': disk_idx, 'file': '', 'stripe': 0, 'done': 0, 'total': 0,
+                                       'bytes': 0, 'started': now, 'rate': 0}
         
         # Returning the DSS parameters
-        dss = self.dsss[dss_name]
-        response = f"SUCCESS|{dss['n']}|{dss['striping_unit']}"
+        response = f"SUCCESS|{dss['n']}|{dss['striping_unit']}|{disk_idx}"
         for disk_name in dss['disks']:
             disk = self.disks[disk_name]
             response += f"|{disk_name}|{disk['ip']}|{disk['c_port']}"
         
-        print(f"[MANAGER] Disk failure phase 1: {dss_name}")
+        print(f"[MANAGER] Disk failure phase 1: {dss_name}, failing disk {disk_idx}")
         return response
     
-    def handle_recovery_complete(self, params):
-        """Phase 2: User completes recovery - update state"""
+    def handle_rebuild_progress(self, params):
+        """The rebuilding disk reports how far it got
+
+        Format: rebuild-progress|dss_name|disk_idx|file|stripe|done|total|bytes|rate
+        Every stripe of files sorted before file, and stripes below stripe
+        of file itself, are rebuilt. Each report renews the rebuild lease.
+        """
+        if len(params) != 8:
+            return "FAILURE|Invalid parameters"
+
+        dss_name, disk_idx, file_name, stripe, done, total, size, rate = params
+        if dss_name not in self.dsss:
+            return "FAILURE|DSS not found"
+
+        with self.lock:
+            now = time.monotonic()
+            lease = self.lease(dss_name, now)
+            if lease.rebuild is None and not lease.try_rebuild(now):
+                return "FAILURE|DSS in critical operation"
+            lease.rebuild = now + self.lease_timeout
+            progress = self.rebuilds.setdefault(dss_name, {'started': now})
+            progress.update({'disk_idx': int(disk_idx), 'file': file_name, 'stripe': int(stripe),
+                             'done': int(done), 'total': int(total), 'bytes': int(size),
+                             'rate': float(rate)})
+        return "SUCCESS"
+
+    def handle_rebuild_status(self, params):
+        """Report a DSS's background rebuild
+
+        Format: rebuild-status|dss_name - the reply is SUCCESS|none,
+        SUCCESS|disk_name|done|total|bytes|seconds|rate (bytes/s), or
+        SUCCESS|failed|disk_name|done|total|reason once a rebuild failed
+        """
         if len(params) != 1:
             return "FAILURE|Invalid parameters"
-        
+
         dss_name = params[0]
+        if dss_name not in self.dsss:
+            return "FAILURE|DSS not found"
+
+        with self.lock:
+            progress = self.rebuilds.get(dss_name)
+            if progress is None:
+                return "SUCCESS|none"
+            disk_idx = progress['disk_idx']
+            disk_name = self.dsss[dss_name]['disks'][disk_idx] if disk_idx is not None else '?'
+            if 'failed' in progress:
+                return f"SUCCESS|failed|{disk_name}|{progress['done']}|{progress['total']}|{progress['failed']}"
+            seconds = time.monotonic() - progress['started']
+            return (f"SUCCESS|{disk_name}|{progress['done']}|{progress['total']}|{progress['bytes']}|"
+                    f"{seconds:.1f}|{progress['rate']:.0f}")
+
+    def rebuild_watermark(self, dss_name, file_name, size):
+        """Return (disk_idx, first stripe of a file not yet rebuilt), or None when no rebuild runs"""
+        progress = self.rebuilds.get(dss_name)
+        if progress is None or progress['disk_idx'] is None:
+            return None
+        if file_name < progress['file']:
+            dss = self.dsss[dss_name]
+            watermark = -(-size // ((dss['n'] - 1) * dss['striping_unit']))
+        elif file_name == progress['file']:
+            watermark = progress['stripe']
+        else:
+            watermark = 0
+        return progress['disk_idx'], watermark
+
+    def handle_recovery_complete(self, params):
+        """Phase 2: The rebuilding disk reports it has every block back
+
+        Format: recovery-complete|dss_name[|summary]
+        """
+        if len(params) not in (1, 2):
+            return "FAILURE|Invalid parameters"
         
-        if dss_name not in self.pending_failure:
-            return "FAILURE|No pending failure for DSS"
+        dss_name = params[0]
         
         with self.lock:
-            del self.pending_failure[dss_name]
-            self.critical_section = None
+            lease = self.dss_locks.get(dss_name)
+            if lease is None or lease.rebuild is None:
+                return "FAILURE|No pending failure for DSS"
+            lease.release_rebuild()
+            self.rebuilds.pop(dss_name, None)
         
-        print(f"[MANAGER] Recovery complete: {dss_name}")
+        summary = f" ({params[1]})" if len(params) == 2 else ""
+        print(f"[MANAGER] Recovery complete: {dss_name}{summary}")
+        return "SUCCESS"
+
+    def handle_recovery_failed(self, params):
+        """Phase 2: The rebuild failed (reported by the disk) or never started (by the user)
+
+        Format: recovery-failed|dss_name|reason. The rebuild lease is
+        released, but the DSS stays degraded: reads keep rebuilding the
+        failed disk's blocks past the last stripe it got back, and the
+        next disk-failure fails that disk again.
+        """
+        if len(params) != 2:
+            return "FAILURE|Invalid parameters"
+
+        dss_name, reason = params
+
+        with self.lock:
+            lease = self.dss_locks.get(dss_name)
+            if lease is None or lease.rebuild is None:
+                return "FAILURE|No pending failure for DSS"
+            lease.release_rebuild()
+            progress = self.rebuilds.get(dss_name)
+            if progress is not None:
+                progress['failed'] = reason
+
+        print(f"[MANAGER] Recovery failed: {dss_name} ({reason}), DSS stays degraded")
         return "SUCCESS"
     
     def handle_decommission_phase1(self, params):
@@ -377,8 +1003,10 @@ class DSSManager:
             return "FAILURE|DSS not found"
         
         with self.lock:
-            # Entering hte critical section
-            self.critical_section = dss_name
+            # Taking the whole DSS once no other operation is in progress
+            now = time.monotonic()
+            if not self.lease(dss_name, now).try_exclusive('decommission', now + self.lease_timeout):
+                return "FAILURE|DSS in critical operation"
         
         # Returning the DSS parameters
         dss = self.dsss[dss_name]
@@ -401,21 +1029,27 @@ class DSSManager:
             return "FAILURE|DSS not found"
         
         with self.lock:
-            dss = self.dsss[dss_name]
-            
-            # Releasing all the disks back to Free status
-            for disk_name in dss['disks']:
-                self.disks[disk_name]['status'] = 'Free'
-            
-            # Removing the DSS
-            del self.dsss[dss_name]
-            
-            # Exiting the critical section
-            self.critical_section = None
+            if not self.dss_locks[dss_name].holds_exclusive('decommission'):
+                return "FAILURE|No pending decommission for DSS"
+            self.commit(['decommission', dss_name])
         
         print(f"[MANAGER] Decommission complete: {dss_name}")
         return "SUCCESS"
     
+    def lease(self, dss_name, now):
+        """Return a DSS's leases with the expired ones dropped (caller holds the lock)"""
+        lease = self.dss_locks[dss_name]
+        for file_name, user_name in lease.expire(now):
+            # A copy abandoned by its client no longer counts as load
+            pending = self.pending_copy.get(user_name)
+            if pending and pending['dss_name'] == dss_name and pending['file_name'] == file_name:
+                del self.pending_copy[user_name]
+                self.placement.end(dss_name, pending['file_size'])
+            pending = self.pending_write.get(user_name)
+            if pending and pending['dss_name'] == dss_name and pending['file_name'] == file_name:
+                del self.pending_write[user_name]
+        return lease
+
     def deregister_user(self, params):
         """Handle deregister-user command"""
         if len(params) != 1:
@@ -425,7 +1059,7 @@ class DSSManager:
         if username not in self.users:
             return "FAILURE|User not found"
         
-        del self.users[username]
+        self.commit(['deregister-user', username])
         print(f"[MANAGER] User {username} deregistered")
         return "SUCCESS"
     
@@ -441,21 +1075,101 @@ class DSSManager:
         if self.disks[diskname]['status'] == 'InDSS':
             return "FAILURE|Disk is in use"
         
-        del self.disks[diskname]
+        self.commit(['deregister-disk', diskname])
         print(f"[MANAGER] Disk {diskname} deregistered")
         return "SUCCESS"
 
+def benchmark(clients=16, requests=2000):
+    """Print manager requests/sec for a number of concurrent clients sending ls"""
+    manager = DSSManager(0)
+    port = manager.socket.getsockname()[1]
+
+    def client():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(5)
+        for _ in range(requests):
+            sock.sendto(b'ls', ('127.0.0.1', port))
+            sock.recvfrom(4096)
+        sock.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    manager.close()
+    print(f"{clients} clients x {requests} requests: "
+          f"{clients * requests / elapsed:.0f} requests/sec")
+
+
+def benchmark_recovery(files=1000000):
+    """Print manager restart time for a namespace of files, from the log alone and from a snapshot"""
+    import os
+    import shutil
+    import tempfile
+    import contextlib
+    import io
+    directory = tempfile.mkdtemp(prefix='dss-journal-')
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            manager = DSSManager(0, data_dir=directory, fsync=False, snapshot_every=files * 10)
+            with manager.lock:
+                for i in range(8):
+                    manager.commit(['register-disk', f'disk{i}', '127.0.0.1', 6000 + i, 7000 + i])
+                manager.commit(['configure-dss', 'dss1', 4, 4096, [f'disk{i}' for i in range(4)]])
+                manager.commit(['configure-dss', 'dss2', 4, 4096, [f'disk{i}' for i in range(4, 8)]])
+                for i in range(files):
+                    manager.commit(['copy-complete', f'dss{i % 2 + 1}', f'file{i:07d}.bin', 4096 + i, f'user{i % 100}'])
+            # Leaving the log unsnapshotted, as after a crash
+            manager.journal.sync()
+        log_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        def restart():
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                restarted = DSSManager(0, data_dir=directory, fsync=False)
+                elapsed = time.perf_counter() - start
+                restarted.close()  # Takes a snapshot
+            return elapsed
+
+        replay = restart()
+        snapshot_bytes = os.path.getsize(os.path.join(directory, 'snapshot.json'))
+        snapshot = restart()
+        print(f"Manager restart with {files} files")
+        print(f"  log replay     {replay:>7.2f}s  ({log_bytes / 2**20:.0f} MiB of log)")
+        print(f"  snapshot load  {snapshot:>7.2f}s  ({snapshot_bytes / 2**20:.0f} MiB snapshot)")
+    finally:
+        shutil.rmtree(directory)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python manager.py <port>")
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark-recovery":
+        benchmark_recovery(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+        sys.exit(0)
+    args = [arg for arg in sys.argv[1:] if arg != "-v"]
+    options = {'--placement': 'least-loaded', '--data-dir': None, '--lease-timeout': '600'}
+    for name in options:
+        if name in args[:-1]:
+            i = args.index(name)
+            options[name] = args.pop(i + 1)
+            args.pop(i)
+    if len(args) != 1 or options['--placement'] not in PLACEMENT_POLICIES:
+        print("Usage: python manager.py <port> [-v] "
+              f"[--placement {'|'.join(PLACEMENT_POLICIES)}] [--data-dir DIR] [--lease-timeout SECONDS]")
         sys.exit(1)
     
-    port = int(sys.argv[1])
-    manager = DSSManager(port)
+    port = int(args[0])
+    manager = DSSManager(port, verbose="-v" in sys.argv, lease_timeout=float(options['--lease-timeout']),
+                         placement=options['--placement'], data_dir=options['--data-dir'])
     
-    # Keep the manager running
+    # Keep the manager running - the main thread sleeps until Ctrl+C
     try:
-        while True:
-            pass
+        manager.stopped.wait()
     except KeyboardInterrupt:
-        print("\n[MANAGER] Shutting down...")
\ No newline at end of file
+        print("\n[MANAGER] Shutting down...")
+        manager.close()
\ No newline at end of file
@@ -0,0 +1,88 @@
+# metaindex.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import bisect
+from collections import defaultdict
+
+
+class MetadataIndex:
+    """Secondary indexes over the files in every DSS.
+
+    by_name maps a file name to the DSSs holding it and their file entries
+    (the same dicts as in dsss[dss]['files']), by_owner keeps each owner's
+    file names sorted per DSS so ls can page through them with a cursor,
+    and totals holds each DSS's stored bytes and file count. All of them
+    are updated when a file is added or replaced and when a DSS goes away,
+    so lookups never scan the namespace.
+    """
+
+    def __init__(self):
+        self.by_name = defaultdict(dict)  # of the format {file_name: {dss_name: {size, owner}}}
+        self.by_owner = defaultdict(dict)  # of the format {owner: {dss_name: [file names, sorted]}}
+        self.totals = {}  # of the format {dss_name: [bytes, files]}
+
+    def add_dss(self, dss_name):
+        """Start indexing an empty DSS"""
+        self.totals[dss_name] = [0, 0]
+
+    def add(self, dss_name, file_name, entry, replaced=None):
+        """Index a file entry, replacing the one of the same name on the DSS if given"""
+        totals = self.totals[dss_name]
+        if replaced is not None:
+            totals[0] -= replaced['size']
+            if replaced['owner'] != entry['owner']:
+                self.unlink_owner(replaced['owner'], dss_name, file_name)
+                self.link_owner(entry['owner'], dss_name, file_name)
+        else:
+            totals[1] += 1
+            self.link_owner(entry['owner'], dss_name, file_name)
+        totals[0] += entry['size']
+        self.by_name[file_name][dss_name] = entry
+
+    def add_many(self, dss_name, files):
+        """Index every entry of a DSS's {file_name: entry} dict at once (after recovery)"""
+        owned = defaultdict(list)
+        size = 0
+        for file_name, entry in files.items():
+            self.by_name[file_name][dss_name] = entry
+            owned[entry['owner']].append(file_name)
+            size += entry['size']
+        for owner, names in owned.items():
+            names.sort()
+            self.by_owner[owner][dss_name] = names
+        self.totals[dss_name] = [size, len(files)]
+
+    def resize(self, dss_name, delta):
+        """Add delta bytes to a DSS's stored bytes (a file grew in place)"""
+        self.totals[dss_name][0] += delta
+
+    def drop_dss(self, dss_name, files):
+        """Forget a DSS and its {file_name: entry} dict"""
+        for file_name, entry in files.items():
+            dsss = self.by_name.get(file_name)
+            if dsss is not None and dsss.pop(dss_name, None) is not None and not dsss:
+                del self.by_name[file_name]
+            owned = self.by_owner.get(entry['owner'])
+            if owned is not None and owned.pop(dss_name, None) is not None and not owned:
+                del self.by_owner[entry['owner']]
+        self.totals.pop(dss_name, None)
+
+    def link_owner(self, owner, dss_name, file_name):
+        """Add a name to an owner's sorted list for a DSS"""
+        bisect.insort(self.by_owner[owner].setdefault(dss_name, []), file_name)
+
+    def unlink_owner(self, owner, dss_name, file_name):
+        """Remove a name from an owner's sorted list for a DSS"""
+        names = self.by_owner[owner][dss_name]
+        del names[bisect.bisect_left(names, file_name)]
+        if not names:
+            del self.by_owner[owner][dss_name]
+            if not self.by_owner[owner]:
+                del self.by_owner[owner]
+
+    def locate(self, file_name):
+        """Return {dss_name: entry} for every DSS holding a file name"""
+        return self.by_name.get(file_name, {})
+
+    def owned(self, owner):
+        """Return {dss_name: [file names, sorted]} for an owner"""
+        return self.by_owner.get(owner, {})
@@ -0,0 +1,253 @@
+# parity.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import sys
+import time
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# NumPy is optional - the pure Python engines are used when it is missing
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ParityEngine:
+    """Base class for whole-buffer XOR parity engines"""
+    name = None
+
+    def compute(self, blocks):
+        """XOR all blocks together and return the parity as bytes"""
+        raise NotImplementedError
+
+    def compute_into(self, blocks, out):
+        """XOR all blocks together into the writable buffer out"""
+        parity = self.compute(blocks)
+        out[:len(parity)] = parity
+        return out
+
+
+class LoopParity(ParityEngine):
+    """Byte-at-a-time XOR (the original implementation, kept as a baseline)"""
+    name = 'loop'
+
+    def compute(self, blocks):
+        parity = bytearray(max(len(b) for b in blocks))
+        for block in blocks:
+            for i in range(len(block)):
+                parity[i] ^= block[i]
+        return bytes(parity)
+
+
+class BigIntParity(ParityEngine):
+    """XOR whole blocks as arbitrary precision integers"""
+    name = 'bigint'
+
+    def compute(self, blocks):
+        size = max(len(b) for b in blocks)
+        acc = 0
+        for block in blocks:
+            # Little-endian so shorter blocks behave as if zero padded at the end
+            acc ^= int.from_bytes(block, 'little')
+        return acc.to_bytes(size, 'little')
+
+
+class NumpyParity(ParityEngine):
+    """XOR blocks with numpy.bitwise_xor.reduce"""
+    name = 'numpy'
+
+    def compute(self, blocks):
+        size = max(len(b) for b in blocks)
+        # Using 8-byte lanes when the blocks allow it
+        dtype = np.uint64 if size % 8 == 0 else np.uint8
+        matrix = np.zeros((len(blocks), size // np.dtype(dtype).itemsize), dtype=dtype)
+        raw = matrix.view(np.uint8)
+        for row, block in enumerate(blocks):
+            raw[row, :len(block)] = np.frombuffer(block, dtype=np.uint8)
+        return np.bitwise_xor.reduce(matrix, axis=0).tobytes()
+
+
+class InplaceParity(ParityEngine):
+    """Accumulate parity in place into a reusable bytearray"""
+    name = 'inplace'
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def compute(self, blocks):
+        size = max(len(b) for b in blocks)
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        view = memoryview(self.buffer)[:size]
+        self.compute_into(blocks, view)
+        return bytes(view)
+
+    def compute_into(self, blocks, out):
+        size = max(len(b) for b in blocks)
+        if np is not None:
+            acc = np.frombuffer(out, dtype=np.uint8, count=size)
+            acc[:] = 0
+            for block in blocks:
+                data = np.frombuffer(block, dtype=np.uint8)
+                np.bitwise_xor(acc[:len(data)], data, out=acc[:len(data)])
+        else:
+            acc = 0
+            for block in blocks:
+                acc ^= int.from_bytes(block, 'little')
+            out[:size] = acc.to_bytes(size, 'little')
+        return out
+
+
+PARITY_ENGINES = {
+    'loop': LoopParity,
+    'bigint': BigIntParity,
+    'inplace': InplaceParity,
+}
+if np is not None:
+    PARITY_ENGINES['numpy'] = NumpyParity
+
+
+def get_parity_engine(name='auto'):
+    """Return a parity engine by name ('auto' picks the fastest available)"""
+    if name == 'auto':
+        name = 'numpy' if np is not None else 'bigint'
+    if name not in PARITY_ENGINES:
+        raise ValueError(f"Unknown parity engine: {name}")
+    return PARITY_ENGINES[name]()
+
+
+def _parity_worker(shm_name, n, striping_unit, first, count, engine_name):
+    """Compute parity for stripes [first, first + count) of a shared batch"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        engine = get_parity_engine(engine_name)
+        slot = n * striping_unit
+        data_len = (n - 1) * striping_unit
+        with shm.buf[first * slot:(first + count) * slot] as view:
+            for stripe in range(count):
+                base = stripe * slot
+                blocks = [view[base + i * striping_unit:base + (i + 1) * striping_unit]
+                          for i in range(n - 1)]
+                out = view[base + data_len:base + slot]
+                engine.compute_into(blocks, out)
+                # Releasing the views so the segment can be closed
+                for block in blocks:
+                    block.release()
+                out.release()
+    finally:
+        shm.close()
+    return count
+
+
+class ParallelParity:
+    """Compute stripe parity on a process pool over shared memory batches.
+
+    Each batch lives in a shared memory segment laid out as consecutive
+    stripe slots of n-1 data blocks followed by the parity block, so the
+    workers read and write it in place without pickling any block data.
+    Two segments are used so the next batch is read from the file while
+    the workers are busy with the current one.
+    """
+
+    def __init__(self, workers, n, striping_unit, batch_stripes=None, engine='auto'):
+        self.workers = workers
+        self.n = n
+        self.striping_unit = striping_unit
+        self.engine = engine
+        self.slot = n * striping_unit
+        if batch_stripes is None:
+            # Roughly 4 MiB of stripes per worker per batch
+            batch_stripes = workers * max(1, (4 * 1024 * 1024) // self.slot)
+        self.batch_stripes = batch_stripes
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.segments = [shared_memory.SharedMemory(create=True, size=batch_stripes * self.slot)
+                         for _ in range(2)]
+
+    def close(self):
+        """Shut down the pool and release the shared memory segments"""
+        self.pool.shutdown()
+        for shm in self.segments:
+            shm.close()
+            shm.unlink()
+
+    def _fill(self, f, shm):
+        """Read up to one batch of stripes from f into shm, return stripe count"""
+        unit = self.striping_unit
+        view = shm.buf
+        for stripe in range(self.batch_stripes):
+            base = stripe * self.slot
+            for i in range(self.n - 1):
+                start = base + i * unit
+                filled = 0
+                while filled < unit:
+                    got = f.readinto(view[start + filled:start + unit])
+                    if not got:
+                        break
+                    filled += got
+                if filled == 0 and i == 0:
+                    return stripe  # EOF
+                # Zero padding short or missing blocks
+                view[start + filled:start + unit] = bytes(unit - filled)
+        return self.batch_stripes
+
+    def _submit(self, shm, count):
+        """Split a filled batch across the workers"""
+        chunk = -(-count // self.workers)
+        return [self.pool.submit(_parity_worker, shm.name, self.n, self.striping_unit,
+                                 first, min(chunk, count - first), self.engine)
+                for first in range(0, count, chunk)]
+
+    def stripes(self, f):
+        """Yield (data_blocks, parity) for every stripe of f in stripe order"""
+        unit = self.striping_unit
+        data_len = (self.n - 1) * unit
+        current = 0
+        count = self._fill(f, self.segments[current])
+        futures = self._submit(self.segments[current], count) if count else []
+
+        while count:
+            # Reading the next batch while the workers compute this one
+            nxt = 1 - current
+            next_count = self._fill(f, self.segments[nxt]) if count == self.batch_stripes else 0
+
+            for future in futures:
+                future.result()
+            next_futures = self._submit(self.segments[nxt], next_count) if next_count else []
+
+            view = self.segments[current].buf
+            for stripe in range(count):
+                base = stripe * self.slot
+                data_blocks = [bytes(view[base + i * unit:base + (i + 1) * unit])
+                               for i in range(self.n - 1)]
+                parity = bytes(view[base + data_len:base + self.slot])
+                yield data_blocks, parity
+
+            current, count, futures = nxt, next_count, next_futures
+
+
+def benchmark(n=8, target_bytes=64 * 1024 * 1024):
+    """Print parity throughput in GB/s for each engine and striping unit"""
+    units = [128 << shift for shift in range(14)]  # 128 B .. 1 MiB
+    names = list(PARITY_ENGINES)
+    print(f"Parity throughput, n={n} (n-1 data blocks per stripe), GB/s of data XORed")
+    print(f"{'unit':>9}" + "".join(f"{name:>10}" for name in names))
+
+    for unit in units:
+        blocks = [os.urandom(unit) for _ in range(n - 1)]
+        row = f"{unit:>9}"
+        for name in names:
+            engine = get_parity_engine(name)
+            # The byte loop is far too slow to push the full target through
+            budget = target_bytes // 64 if name == 'loop' else target_bytes
+            rounds = max(1, budget // (unit * (n - 1)))
+            start = time.perf_counter()
+            for _ in range(rounds):
+                engine.compute(blocks)
+            elapsed = time.perf_counter() - start
+            row += f"{rounds * unit * (n - 1) / elapsed / 1e9:>10.3f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 8)
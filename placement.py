@@ -0,0 +1,134 @@
+# placement.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import heapq
+import random
+
+PLACEMENT_POLICIES = ('least-loaded', 'widest', 'two-choices', 'random')
+
+
+class Placement:
+    """Chooses the DSS a copy goes to.
+
+    Tracks each DSS's stored bytes, bytes and operations in flight and width
+    n. Policies:
+      least-loaded - fewest bytes (stored plus in flight) per data disk
+      widest       - largest n, so the most disks share the stripes
+      two-choices  - the less loaded of two DSSs picked at random
+      random       - any DSS (the original behaviour)
+
+    least-loaded and widest keep a heap keyed by the policy's score. An
+    update pushes a fresh entry and bumps the DSS's version, and stale
+    entries are skipped when popped, so choosing and updating are
+    O(log D).
+    """
+
+    def __init__(self, policy='least-loaded'):
+        if policy not in PLACEMENT_POLICIES:
+            raise ValueError(f"Unknown placement policy: {policy}")
+        self.policy = policy
+        self.stats = {}  # of the format {dss_name: {'n', 'bytes', 'pending', 'inflight'}}
+        self.versions = {}  # of the format {dss_name: version of its live heap entry}
+        self.clock = 0  # Last version handed out (never reused, even for a re-added name)
+        self.heap = []  # of the format [(score, version, dss_name)]
+        self.names = []  # DSS names, for picking at random in O(1)
+        self.positions = {}  # of the format {dss_name: index in names}
+
+    def load(self, dss_name):
+        """Return the bytes stored and in flight per data disk of a DSS"""
+        info = self.stats[dss_name]
+        return (info['bytes'] + info['pending']) / (info['n'] - 1)
+
+    def score(self, dss_name):
+        """Return a DSS's heap key under the policy (lower is better)"""
+        info = self.stats[dss_name]
+        if self.policy == 'widest':
+            return (-info['n'], info['inflight'], self.load(dss_name))
+        return (self.load(dss_name), info['inflight'])
+
+    def update(self, dss_name):
+        """Re-key a DSS in the heap after its stats changed"""
+        self.clock += 1
+        version = self.versions[dss_name] = self.clock
+        heapq.heappush(self.heap, (self.score(dss_name), version, dss_name))
+        # Rebuilding once stale entries outnumber live ones keeps the heap O(D)
+        if len(self.heap) > 2 * len(self.stats) + 16:
+            self.heap = [(self.score(name), self.versions[name], name) for name in self.stats]
+            heapq.heapify(self.heap)
+
+    def add(self, dss_name, n, stored_bytes=0):
+        """Start tracking a DSS"""
+        self.stats[dss_name] = {'n': n, 'bytes': stored_bytes, 'pending': 0, 'inflight': 0}
+        self.versions[dss_name] = None
+        self.positions[dss_name] = len(self.names)
+        self.names.append(dss_name)
+        self.update(dss_name)
+
+    def remove(self, dss_name):
+        """Stop tracking a DSS (its heap entries go stale)"""
+        del self.stats[dss_name]
+        del self.versions[dss_name]
+        # Swapping the last name into the removed slot keeps removal O(1)
+        index = self.positions.pop(dss_name)
+        last = self.names.pop()
+        if last != dss_name:
+            self.names[index] = last
+            self.positions[last] = index
+
+    def begin(self, dss_name, size):
+        """Count a copy of size bytes that is now in flight to a DSS"""
+        info = self.stats[dss_name]
+        info['pending'] += size
+        info['inflight'] += 1
+        self.update(dss_name)
+
+    def end(self, dss_name, size):
+        """Stop counting an in-flight copy of size bytes (stored or abandoned)"""
+        info = self.stats.get(dss_name)
+        if info is None:
+            return
+        info['pending'] -= size
+        info['inflight'] -= 1
+        self.update(dss_name)
+
+    def resize(self, dss_name, delta):
+        """Add delta bytes to what a DSS stores"""
+        self.stats[dss_name]['bytes'] += delta
+        self.update(dss_name)
+
+    def choose(self, accept):
+        """Return the best DSS for which accept(dss_name) is true, or None"""
+        if not self.stats:
+            return None
+        if self.policy == 'random':
+            names = self.names[:]
+            random.shuffle(names)
+            return next((name for name in names if accept(name)), None)
+        if self.policy == 'two-choices':
+            picks = random.sample(self.names, min(2, len(self.names)))
+            picks.sort(key=self.score)
+            for name in picks:
+                if accept(name):
+                    return name
+            # Both picks are busy - falling back to the least loaded that is free
+
+        # Popping the best live entries until one is accepted, then putting the rest back
+        rejected = []
+        chosen = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            _, version, name = entry
+            if self.versions.get(name) != version:
+                continue  # Stale
+            rejected.append(entry)
+            if accept(name):
+                chosen = name
+                break
+        for entry in rejected:
+            heapq.heappush(self.heap, entry)
+        return chosen
+
+    def describe(self, dss_name):
+        """Return a one-line summary of a DSS's load"""
+        info = self.stats[dss_name]
+        return (f"{info['bytes']} bytes stored, {info['pending']} bytes in "
+                f"{info['inflight']} copies, n={info['n']}")
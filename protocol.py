@@ -0,0 +1,608 @@
+# protocol.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import random
+import struct
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+# Largest payload carried by one datagram (the UDP limit is 65507 bytes)
+MAX_FRAGMENT = 60000
+
+# Socket buffer size asked for on c-port sockets so fragment trains fit
+SOCKET_BUFFER = 4 * 1024 * 1024
+
+
+def tune_socket(sock):
+    """Enlarge a c-port socket's buffers (the kernel may cap the request)"""
+    for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+        except OSError:
+            pass
+
+
+class Fragmenter:
+    """Split large c-port messages into FRAG datagrams.
+
+    Format: FRAG|msg_id|index|count|[chunk]. Fragment trains that were sent
+    recently are cached (bounded by bytes) so a receiver's FRAG_NACK can be
+    answered by resending only the missing fragments.
+    """
+
+    def __init__(self, max_fragment=MAX_FRAGMENT, cache_bytes=32 * 1024 * 1024):
+        self.max_fragment = max_fragment
+        self.cache_bytes = cache_bytes
+        self.cached_bytes = 0
+        self.sent = OrderedDict()  # of the format {msg_id: [fragment datagrams]}
+        self.next_id = random.randrange(1 << 30)
+        self.lock = threading.Lock()
+        self.retransmitted = 0
+
+    def fragments(self, message):
+        """Return the datagrams that carry message, each as a list of buffers.
+
+        message is either one buffer or a list of buffers; the list is cut
+        into fragments as memoryview slices without being joined first.
+        """
+        parts = [message] if isinstance(message, (bytes, bytearray, memoryview)) else message
+        total = sum(len(part) for part in parts)
+        if total <= self.max_fragment:
+            return [parts]
+
+        with self.lock:
+            msg_id = self.next_id
+            self.next_id += 1
+
+        count = -(-total // self.max_fragment)
+        datagrams = [[f"FRAG|{msg_id}|0|{count}|".encode('utf-8')]]
+        room = self.max_fragment
+        for part in parts:
+            view = memoryview(part)
+            while len(view):
+                if room == 0:
+                    datagrams.append([f"FRAG|{msg_id}|{len(datagrams)}|{count}|".encode('utf-8')])
+                    room = self.max_fragment
+                chunk = view[:room]
+                datagrams[-1].append(chunk)
+                view = view[len(chunk):]
+                room -= len(chunk)
+
+        with self.lock:
+            self.sent[msg_id] = datagrams
+            self.cached_bytes += sum(len(b) for d in datagrams for b in d)
+            # Dropping the oldest trains once over budget
+            while self.cached_bytes > self.cache_bytes and len(self.sent) > 1:
+                _, old = self.sent.popitem(last=False)
+                self.cached_bytes -= sum(len(b) for d in old for b in d)
+        return datagrams
+
+    def send(self, sock, message, addr):
+        """Send message (a buffer or list of buffers) to addr, fragmenting it if needed"""
+        for datagram in self.fragments(message):
+            send_gathered(sock, datagram, addr)
+
+    def handle_nack(self, sock, data, addr):
+        """Resend the fragments listed in a FRAG_NACK|msg_id|i,j,k message"""
+        parts = str(data, 'utf-8').split('|')
+        msg_id = int(parts[1])
+        with self.lock:
+            datagrams = self.sent.get(msg_id)
+        if not datagrams:
+            return  # Evicted - the request level timeout takes over
+        for index in parts[2].split(','):
+            if index:
+                send_gathered(sock, datagrams[int(index)], addr)
+                self.retransmitted += 1
+
+
+def send_gathered(sock, buffers, addr):
+    """Send a list of buffers as one datagram, scatter-gather where supported"""
+    if len(buffers) == 1:
+        sock.sendto(buffers[0], addr)
+    elif hasattr(sock, 'sendmsg'):
+        sock.sendmsg(buffers, (), 0, addr)
+    else:
+        sock.sendto(b''.join(buffers), addr)
+
+
+class BufferPool:
+    """Preallocated receive buffers reused across datagrams.
+
+    acquire() hands out a free bytearray (allocating only when none is
+    free) and release() returns it; at most max_free idle buffers are kept.
+    """
+
+    def __init__(self, buffer_size=65536, max_free=64):
+        self.buffer_size = buffer_size
+        self.max_free = max_free
+        self.free = []
+        self.lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+        self.in_use = 0
+
+    def acquire(self):
+        """Return a buffer for one receive"""
+        with self.lock:
+            self.in_use += 1
+            if self.free:
+                self.reused += 1
+                return self.free.pop()
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buf):
+        """Give a buffer back once nothing references its contents"""
+        with self.lock:
+            self.in_use -= 1
+            if len(self.free) < self.max_free:
+                self.free.append(buf)
+
+    def stats(self):
+        """Return allocation and reuse counters"""
+        with self.lock:
+            total = self.allocated + self.reused
+            return {'allocated': self.allocated, 'reused': self.reused, 'in_use': self.in_use,
+                    'free': len(self.free),
+                    'reuse_rate': self.reused / total if total else 0.0}
+
+
+class Reassembler:
+    """Bounded reassembly buffers for fragmented c-port messages.
+
+    Partial messages are keyed by (sender address, msg_id). At most
+    max_messages partials and max_bytes of fragment data are held; the
+    least recently active partial is dropped first. A partial that stalls
+    for gap_timeout is reported by stale() so the receiver can NACK just
+    the missing fragments, and one idle for expire_after is discarded.
+    """
+
+    def __init__(self, max_messages=256, max_bytes=64 * 1024 * 1024,
+                 gap_timeout=0.03, expire_after=5.0):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.gap_timeout = gap_timeout
+        self.expire_after = expire_after
+        self.held_bytes = 0
+        self.partials = OrderedDict()  # of the format {(addr, msg_id): partial dict}
+        self.last_scan = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, data, addr):
+        """Store one FRAG datagram; return the whole message once complete"""
+        # Format: FRAG|msg_id|index|count|[chunk]
+        # The header is parsed from a short copy; data may be a pooled buffer view
+        head = bytes(data[:64])
+        header_end = 0
+        for _ in range(4):
+            header_end = head.index(b'|', header_end) + 1
+        _, msg_id, index, count = head[:header_end - 1].decode('utf-8').split('|')
+        index, count = int(index), int(count)
+        key = (addr, int(msg_id))
+        chunk = bytes(data[header_end:])
+
+        with self.lock:
+            partial = self.partials.get(key)
+            if partial is None:
+                partial = {'chunks': [None] * count, 'received': 0, 'bytes': 0,
+                           'last_seen': 0.0, 'last_nack': 0.0}
+                self.partials[key] = partial
+            else:
+                self.partials.move_to_end(key)
+            partial['last_seen'] = time.monotonic()
+
+            if index >= len(partial['chunks']) or partial['chunks'][index] is not None:
+                return None  # Duplicate or malformed fragment
+            partial['chunks'][index] = chunk
+            partial['received'] += 1
+            partial['bytes'] += len(chunk)
+            self.held_bytes += len(chunk)
+
+            if partial['received'] == len(partial['chunks']):
+                del self.partials[key]
+                self.held_bytes -= partial['bytes']
+                return b''.join(partial['chunks'])
+
+            # Keeping the buffers bounded
+            while (len(self.partials) > self.max_messages or self.held_bytes > self.max_bytes) \
+                    and len(self.partials) > 1:
+                _, dropped = self.partials.popitem(last=False)
+                self.held_bytes -= dropped['bytes']
+        return None
+
+    def stale(self):
+        """Return [(addr, FRAG_NACK message)] for partials missing fragments"""
+        now = time.monotonic()
+        nacks = []
+        with self.lock:
+            if not self.partials or now - self.last_scan < self.gap_timeout / 2:
+                return nacks
+            self.last_scan = now
+            for key in list(self.partials):
+                partial = self.partials[key]
+                if now - partial['last_seen'] > self.expire_after:
+                    del self.partials[key]
+                    self.held_bytes -= partial['bytes']
+                    continue
+                if now - max(partial['last_seen'], partial['last_nack']) < self.gap_timeout:
+                    continue
+                partial['last_nack'] = now
+                addr, msg_id = key
+                missing = [str(i) for i, c in enumerate(partial['chunks']) if c is None]
+                nacks.append((addr, f"FRAG_NACK|{msg_id}|{','.join(missing)}".encode('utf-8')))
+        return nacks
+
+
+class AckBatcher:
+    """Collect write sequence numbers per sender into batched acknowledgements.
+
+    Text senders get SACK|seq,seq,... and binary senders an OP_ACK message.
+    No ACK is held back longer than max_delay (see due), so a sender with
+    few writes in flight is not left waiting while another keeps the
+    socket busy.
+    """
+
+    def __init__(self, max_batch=64, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = {}  # of the format {addr: [seq, ...]}
+        self.binary = set()  # Senders using the binary wire format
+        self.since = None  # When the oldest pending seq was added
+        self.lock = threading.Lock()
+
+    def add(self, addr, seq, binary=False):
+        """Record a sequence number to acknowledge; return True once a batch is full"""
+        with self.lock:
+            if self.since is None:
+                self.since = time.monotonic()
+            seqs = self.pending.setdefault(addr, [])
+            seqs.append(int(seq))
+            if binary:
+                self.binary.add(addr)
+            return len(seqs) >= self.max_batch
+
+    def due(self):
+        """Return whether the oldest pending seq has waited max_delay"""
+        since = self.since
+        return since is not None and time.monotonic() - since >= self.max_delay
+
+    def flush(self, sock):
+        """Send every pending batch"""
+        with self.lock:
+            batches = self.pending
+            self.pending = {}
+            self.since = None
+        for addr, seqs in batches.items():
+            if addr in self.binary:
+                sock.sendto(encode_binary_ack(seqs), addr)
+            else:
+                sock.sendto(("SACK|" + ",".join(map(str, seqs))).encode('utf-8'), addr)
+
+
+# Binary c-port wire format, version 1. Every block message starts with
+# HEADER: magic, version, opcode, flags, seq, dss_id, file_id, stripe,
+# block_idx, count, length. DSS and file names are interned per sender as
+# small ids; a sender includes the names (FLAG_NAMES) until the disk has
+# acknowledged a message that carried them. Batches (FLAG_BATCH) follow
+# the header with count ENTRY records and then the payloads back to back.
+# Read replies (OP_DATA) set FLAG_CHECKSUM and put a CHECKSUM per block,
+# the crc32 the disk stored with it, before the payloads.
+WIRE_MAGIC = 0xD5
+WIRE_VERSION = 1
+HEADER = struct.Struct('!BBBBIIIIHHI')
+ENTRY = struct.Struct('!IHBxI')  # stripe, block_idx, flags, length
+NAMES = struct.Struct('!HH')     # DSS name length, file name length
+CHECKSUM = struct.Struct('!I')   # crc32 of a block
+
+OP_WRITE = 1
+OP_READ = 2
+OP_ACK = 3
+OP_DATA = 4
+OP_ERROR = 5
+
+FLAG_NAMES = 0x01
+FLAG_BATCH = 0x02
+FLAG_PARITY = 0x04  # Single block messages - the block is a parity block
+FLAG_CHECKSUM = 0x08  # Read replies - block checksums precede the payloads
+ENTRY_PARITY = 0x01
+
+ERR_UNKNOWN_ID = 1
+
+
+class UnknownIdError(Exception):
+    """A binary message used a DSS or file id the disk has not learned"""
+
+    def __init__(self, seq):
+        super().__init__(f"unknown id in message {seq}")
+        self.seq = seq
+
+
+class BlockMessage:
+    """A decoded block read or write request, from either wire format.
+
+    entries holds (stripe, block_idx, block_type, payload) tuples; write
+    payloads are memoryviews into the received datagram and reads carry
+    None. seq is None for requests sent without the reliable transport.
+    """
+    __slots__ = ('op', 'wire', 'batch', 'seq', 'dss_name', 'file_name', 'dss_id', 'file_id', 'entries')
+
+    def __init__(self, op, wire, batch, seq, dss_name, file_name, entries, dss_id=0, file_id=0):
+        self.op = op
+        self.wire = wire
+        self.batch = batch
+        self.seq = seq
+        self.dss_name = dss_name
+        self.file_name = file_name
+        self.entries = entries
+        self.dss_id = dss_id
+        self.file_id = file_id
+
+
+def encode_text_request(op, dss_name, file_name, entries):
+    """Build a text WRITE_BLOCK(S)/READ_BLOCK(S) message"""
+    if op == OP_WRITE:
+        if len(entries) == 1:
+            # Format: WRITE_BLOCK|dss|file|stripe|block_idx|type|size|[data]
+            stripe, block_idx, block_type, data = entries[0]
+            header = f"WRITE_BLOCK|{dss_name}|{file_name}|{stripe}|{block_idx}|{block_type}|{len(data)}|"
+            return header.encode('utf-8') + data
+        # Format: WRITE_BLOCKS|dss|file|count|stripe:block_idx:type:size,...|[data][data]...
+        table = ",".join(f"{s}:{b}:{t}:{len(d)}" for s, b, t, d in entries)
+        header = f"WRITE_BLOCKS|{dss_name}|{file_name}|{len(entries)}|{table}|"
+        return header.encode('utf-8') + b''.join(d for _, _, _, d in entries)
+
+    if len(entries) == 1:
+        # Format: READ_BLOCK|dss|file|stripe|block_idx
+        stripe, block_idx = entries[0][:2]
+        return f"READ_BLOCK|{dss_name}|{file_name}|{stripe}|{block_idx}".encode('utf-8')
+    # Format: READ_BLOCKS|dss|file|count|stripe:block_idx,...
+    table = ",".join(f"{s}:{b}" for s, b, _, _ in entries)
+    return f"READ_BLOCKS|{dss_name}|{file_name}|{len(entries)}|{table}".encode('utf-8')
+
+
+def decode_text_request(data):
+    """Decode a text block request, or return None for any other message"""
+    if isinstance(data, memoryview):
+        data = bytes(data)  # The text format needs bytes methods to find its fields
+    view = memoryview(data)
+    if data.startswith(b'WRITE_BLOCK|'):
+        # Format: WRITE_BLOCK|dss|file|stripe|block_idx|type|size|[data]
+        header_end = 0
+        for _ in range(7):
+            header_end = data.index(b'|', header_end) + 1
+        _, dss_name, file_name, stripe, block_idx, block_type, size = \
+            bytes(view[:header_end - 1]).decode('utf-8').split('|')
+        payload = view[header_end:header_end + int(size)]
+        return BlockMessage(OP_WRITE, 'text', False, None, dss_name, file_name,
+                            [(int(stripe), int(block_idx), block_type, payload)])
+
+    if data.startswith(b'WRITE_BLOCKS|'):
+        # Format: WRITE_BLOCKS|dss|file|count|stripe:block_idx:type:size,...|[data]...
+        header_end = 0
+        for _ in range(5):
+            header_end = data.index(b'|', header_end) + 1
+        _, dss_name, file_name, _, table = bytes(view[:header_end - 1]).decode('utf-8').split('|')
+        entries = []
+        offset = header_end
+        for entry in table.split(','):
+            stripe, block_idx, block_type, size = entry.split(':')
+            size = int(size)
+            entries.append((int(stripe), int(block_idx), block_type, view[offset:offset + size]))
+            offset += size
+        return BlockMessage(OP_WRITE, 'text', True, None, dss_name, file_name, entries)
+
+    if data.startswith(b'READ_BLOCK|'):
+        # Format: READ_BLOCK|dss|file|stripe|block_idx
+        _, dss_name, file_name, stripe, block_idx = data.decode('utf-8').split('|')
+        return BlockMessage(OP_READ, 'text', False, None, dss_name, file_name,
+                            [(int(stripe), int(block_idx), None, None)])
+
+    if data.startswith(b'READ_BLOCKS|'):
+        # Format: READ_BLOCKS|dss|file|count|stripe:block_idx,...
+        _, dss_name, file_name, _, table = data.decode('utf-8').split('|')
+        entries = []
+        for entry in table.split(','):
+            stripe, block_idx = entry.split(':')
+            entries.append((int(stripe), int(block_idx), None, None))
+        return BlockMessage(OP_READ, 'text', True, None, dss_name, file_name, entries)
+    return None
+
+
+def encode_binary_request(op, seq, dss_id, file_id, entries, names=None):
+    """Build a binary block request; names=(dss_name, file_name) teaches the ids"""
+    flags = 0
+    parts = []
+    if names:
+        flags |= FLAG_NAMES
+        dss_bytes, file_bytes = names[0].encode('utf-8'), names[1].encode('utf-8')
+        parts += [NAMES.pack(len(dss_bytes), len(file_bytes)), dss_bytes, file_bytes]
+
+    if len(entries) == 1:
+        stripe, block_idx, block_type, data = entries[0]
+        if block_type == 'parity':
+            flags |= FLAG_PARITY
+        length = len(data) if op == OP_WRITE else 0
+        header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, op, flags, seq, dss_id, file_id,
+                             stripe, block_idx, 1, length)
+        if op == OP_WRITE:
+            parts.append(data)
+        return header + b''.join(parts)
+
+    flags |= FLAG_BATCH
+    for stripe, block_idx, block_type, data in entries:
+        parts.append(ENTRY.pack(stripe, block_idx, ENTRY_PARITY if block_type == 'parity' else 0,
+                                len(data) if op == OP_WRITE else 0))
+    if op == OP_WRITE:
+        parts += [data for _, _, _, data in entries]
+    header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, op, flags, seq, dss_id, file_id,
+                         0, 0, len(entries), 0)
+    return header + b''.join(parts)
+
+
+def decode_binary_request(data, dss_names, file_names):
+    """Decode a binary block request using (and teaching) a sender's id tables"""
+    magic, version, op, flags, seq, dss_id, file_id, stripe, block_idx, count, length = \
+        HEADER.unpack_from(data, 0)
+    if magic != WIRE_MAGIC or version != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire version {version}")
+    view = memoryview(data)
+    offset = HEADER.size
+
+    if flags & FLAG_NAMES:
+        dss_len, file_len = NAMES.unpack_from(data, offset)
+        offset += NAMES.size
+        dss_names[dss_id] = bytes(view[offset:offset + dss_len]).decode('utf-8')
+        offset += dss_len
+        file_names[file_id] = bytes(view[offset:offset + file_len]).decode('utf-8')
+        offset += file_len
+    dss_name = dss_names.get(dss_id)
+    file_name = file_names.get(file_id)
+    if dss_name is None or file_name is None:
+        raise UnknownIdError(seq)
+
+    writing = op == OP_WRITE
+    if not flags & FLAG_BATCH:
+        block_type = 'parity' if flags & FLAG_PARITY else 'data'
+        payload = view[offset:offset + length] if writing else None
+        entries = [(stripe, block_idx, block_type, payload)]
+    else:
+        entries = []
+        payload_offset = offset + count * ENTRY.size
+        for i in range(count):
+            e_stripe, e_block, e_flags, e_length = ENTRY.unpack_from(data, offset + i * ENTRY.size)
+            payload = view[payload_offset:payload_offset + e_length] if writing else None
+            payload_offset += e_length
+            entries.append((e_stripe, e_block, 'parity' if e_flags & ENTRY_PARITY else 'data', payload))
+    return BlockMessage(op, 'binary', bool(flags & FLAG_BATCH), seq, dss_name, file_name,
+                        entries, dss_id, file_id)
+
+
+def encode_binary_ack(seqs):
+    """Build a binary ACK for a list of sequence numbers"""
+    header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, OP_ACK, 0, 0, 0, 0, 0, 0,
+                         len(seqs), 4 * len(seqs))
+    return header + struct.pack(f'!{len(seqs)}I', *seqs)
+
+
+def encode_binary_error(seq, code):
+    """Build a binary error reply for message seq"""
+    return HEADER.pack(WIRE_MAGIC, WIRE_VERSION, OP_ERROR, 0, seq, 0, 0, code, 0, 0, 0)
+
+
+def read_reply_parts(msg, blocks, checksums):
+    """Return the reply to a read request as a list of buffers, in the request's wire format.
+
+    checksums holds the crc32 stored with each block, in the same order.
+    """
+    if msg.wire == 'binary':
+        crcs = b''.join(CHECKSUM.pack(crc) for crc in checksums)
+        if not msg.batch:
+            stripe, block_idx = msg.entries[0][:2]
+            header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, OP_DATA, FLAG_CHECKSUM, msg.seq, msg.dss_id,
+                                 msg.file_id, stripe, block_idx, 1, len(blocks[0]))
+            return [header, crcs, blocks[0]]
+        header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, OP_DATA, FLAG_BATCH | FLAG_CHECKSUM, msg.seq,
+                             msg.dss_id, msg.file_id, 0, 0, len(blocks), 0)
+        table = b''.join(ENTRY.pack(stripe, block_idx, 0, len(block))
+                         for (stripe, block_idx, _, _), block in zip(msg.entries, blocks))
+        return [header, table, crcs] + blocks
+
+    prefix = f"SEQ|{msg.seq}|" if msg.seq is not None else ''
+    if not msg.batch:
+        # Format: READ_DATA|dss|file|stripe|block_idx|crc|[size][data]
+        stripe, block_idx = msg.entries[0][:2]
+        header = f"{prefix}READ_DATA|{msg.dss_name}|{msg.file_name}|{stripe}|{block_idx}|{checksums[0]}|"
+        return [header.encode('utf-8') + struct.pack('>I', len(blocks[0])), blocks[0]]
+    # Format: BLOCKS|dss|file|stripe:block_idx:size:crc,...|[data][data]...
+    table = ",".join(f"{stripe}:{block_idx}:{len(block)}:{crc}"
+                     for (stripe, block_idx, _, _), block, crc in zip(msg.entries, blocks, checksums))
+    header = f"{prefix}BLOCKS|{msg.dss_name}|{msg.file_name}|{table}|".encode('utf-8')
+    return [header] + blocks
+
+
+def encode_read_reply(msg, blocks, checksums):
+    """Build the reply to a read request as one bytes object"""
+    return b''.join(read_reply_parts(msg, blocks, checksums))
+
+
+def decode_read_reply(data):
+    """Return {(stripe, block_idx): (block, crc32 or None)} from a read reply in either format"""
+    if data[0] == WIRE_MAGIC:
+        _, _, _, flags, _, _, _, stripe, block_idx, count, length = HEADER.unpack_from(data, 0)
+        offset = HEADER.size
+        if flags & FLAG_BATCH:
+            offset += count * ENTRY.size
+        checksums = [None] * count
+        if flags & FLAG_CHECKSUM:
+            checksums = [crc for crc, in CHECKSUM.iter_unpack(data[offset:offset + count * CHECKSUM.size])]
+            offset += count * CHECKSUM.size
+        if not flags & FLAG_BATCH:
+            return {(stripe, block_idx): (data[offset:offset + length], checksums[0])}
+        blocks = {}
+        payload_offset = offset
+        for i in range(count):
+            e_stripe, e_block, _, e_length = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+            blocks[(e_stripe, e_block)] = (data[payload_offset:payload_offset + e_length], checksums[i])
+            payload_offset += e_length
+        return blocks
+
+    if data.startswith(b'BLOCKS|'):
+        # Format: BLOCKS|dss|file|stripe:block_idx:size:crc,...|[data][data]...
+        _, _, _, table, body = data.split(b'|', 4)
+        blocks = {}
+        offset = 0
+        for entry in table.decode('utf-8').split(','):
+            stripe, block_idx, size, crc = map(int, entry.split(':'))
+            blocks[(stripe, block_idx)] = (body[offset:offset + size], crc)
+            offset += size
+        return blocks
+
+    # Format: READ_DATA|dss|file|stripe|block_idx|crc|[size][data]
+    header_end = 0
+    for _ in range(6):
+        header_end = data.index(b'|', header_end) + 1
+    if len(data) < header_end + 4:
+        raise ValueError("Short READ_DATA reply")
+    _, _, _, stripe, block_idx, crc = data[:header_end - 1].decode('utf-8').split('|')
+    size = struct.unpack('>I', data[header_end:header_end + 4])[0]
+    return {(int(stripe), int(block_idx)): (data[header_end + 4:header_end + 4 + size], int(crc))}
+
+
+def benchmark(block_size=4096, rounds=200000):
+    """Print the per-block cost of parsing text and binary WRITE_BLOCK headers"""
+    import os
+    payload = os.urandom(block_size)
+    entries = [(123456, 3, 'data', payload)]
+    text = encode_text_request(OP_WRITE, 'dss1', 'nightly-build.tar', entries)
+    binary = encode_binary_request(OP_WRITE, 42, 1, 1, entries)
+    dss_names, file_names = {1: 'dss1'}, {1: 'nightly-build.tar'}
+
+    def legacy(data):
+        # The original listen_c_port parse - chained index() calls and copies
+        header_end = data.index(b'|', data.index(b'|', data.index(b'|') + 1) + 1)
+        for _ in range(4):
+            header_end = data.index(b'|', header_end + 1)
+        parts = data[:header_end].decode('utf-8', errors='ignore').split('|')
+        body = data[header_end + 1:]
+        return parts, body[:int(parts[6])]
+
+    cases = [
+        ('text (original chain)', legacy, text),
+        ('text (decode_text_request)', decode_text_request, text),
+        ('binary (decode_binary_request)',
+         lambda data: decode_binary_request(data, dss_names, file_names), binary),
+    ]
+    print(f"Parse cost per WRITE_BLOCK, {block_size} byte payload, {rounds} rounds")
+    for name, parse, data in cases:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            parse(data)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<32} {elapsed / rounds * 1e9:>8.0f} ns/block")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 4096)
@@ -0,0 +1,130 @@
+# rebuild.py
+# Rishith Cheduluri (1225443687) and Sebastian Bejaoui (122)
+import time
+import zlib
+from collections import deque
+from parity import get_parity_engine
+
+# Stripes whose survivor reads are kept outstanding during a rebuild
+REBUILD_WINDOW = 64
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 0.5
+
+
+class DiskRebuild:
+    """Rebuild the blocks one disk holds for a DSS from the other n-1 disks.
+
+    The disk being rebuilt reads each stripe's surviving blocks (data and
+    parity alike) straight from their disks over its own BlockIOEngine and
+    XORs them into its missing block. Up to window stripes have their reads
+    outstanding at once; they are retired in order. A survivor block that
+    fails its checksum is read again once before the rebuild gives up.
+
+    Files are rebuilt in name order, so (file, stripe) of the next stripe
+    to retire is a watermark: everything before it is rebuilt. report() is
+    called with it every PROGRESS_INTERVAL seconds. With rate set, survivor
+    reads are paced to at most rate bytes per second so that the rebuild
+    leaves bandwidth to the reads served alongside it.
+    """
+
+    def __init__(self, dss_name, n, striping_unit, failed_idx, disk_triples, files, io, put,
+                 window=REBUILD_WINDOW, rate=0, report=None):
+        self.dss_name = dss_name
+        self.n = n
+        self.striping_unit = striping_unit
+        self.failed_idx = failed_idx
+        self.disk_triples = disk_triples  # of the format [(disk_name, ip, c_port)] in DSS order
+        self.files = sorted(files)  # of the format [(file_name, size)]
+        self.io = io
+        self.put = put  # put(file_name, stripe, block) stores one rebuilt block
+        self.window = window
+        self.rate = rate  # Survivor bytes read per second at most (0 for no cap)
+        self.report = report  # report(rebuild, file_name, stripe) publishes the watermark
+        self.engine = get_parity_engine()
+        self.stripes_done = 0
+        self.bytes_rebuilt = 0
+        self.bytes_read = 0
+        self.reread = 0
+        self.start = None
+
+    def stripe_count(self, size):
+        """Return the number of stripes a file of size bytes spans"""
+        return (size + (self.n - 1) * self.striping_unit - 1) // ((self.n - 1) * self.striping_unit)
+
+    def total_stripes(self):
+        """Return the number of stripes to rebuild"""
+        return sum(self.stripe_count(size) for _, size in self.files)
+
+    def stripes(self):
+        """Yield every (file_name, stripe) to rebuild, file by file"""
+        for file_name, size in self.files:
+            for stripe in range(self.stripe_count(size)):
+                yield file_name, stripe
+
+    def read_survivors(self, file_name, stripe):
+        """Start the reads of a stripe's surviving blocks; return {block_idx: future}"""
+        return {i: self.io.read_block(self.disk_triples[i], self.dss_name, file_name, stripe, i)
+                for i in range(self.n) if i != self.failed_idx}
+
+    def survivor_block(self, file_name, stripe, block_idx, future):
+        """Return a survivor's block once it checks out, reading it again once if it does not"""
+        for attempt in range(2):
+            block, checksum = future.result()
+            if len(block) == self.striping_unit and (checksum is None or zlib.crc32(block) == checksum):
+                return block
+            if attempt == 0:
+                self.reread += 1
+                future = self.io.read_block(self.disk_triples[block_idx], self.dss_name, file_name,
+                                            stripe, block_idx)
+        raise IOError(f"{file_name} stripe {stripe}: block {block_idx} "
+                      f"({self.disk_triples[block_idx][0]}) is missing or corrupt")
+
+    def throughput(self):
+        """Return the bytes rebuilt per second so far"""
+        elapsed = time.monotonic() - self.start if self.start else 0
+        return self.bytes_rebuilt / elapsed if elapsed else 0.0
+
+    def delay(self):
+        """Return how long the next survivor reads must wait to stay within the rate cap"""
+        if not self.rate:
+            return 0
+        return self.start + self.bytes_read / self.rate - time.monotonic()
+
+    def run(self):
+        """Rebuild every stripe; return (stripes, bytes rebuilt, seconds)"""
+        self.start = last_report = time.monotonic()
+        if self.report and self.files:
+            self.report(self, self.files[0][0], 0)
+        in_flight = deque()  # of the format (file_name, stripe, {block_idx: future})
+        pending = self.stripes()
+        exhausted = False
+        while True:
+            # Keeping the window full of outstanding survivor reads, as the rate cap allows
+            while not exhausted and len(in_flight) < self.window:
+                delay = self.delay()
+                if delay > 0:
+                    if in_flight:
+                        break  # Retiring what is outstanding in the meantime
+                    time.sleep(delay)
+                item = next(pending, None)
+                if item is None:
+                    exhausted = True
+                    break
+                file_name, stripe = item
+                in_flight.append((file_name, stripe, self.read_survivors(file_name, stripe)))
+                self.bytes_read += (self.n - 1) * self.striping_unit
+            if not in_flight:
+                break
+
+            file_name, stripe, futures = in_flight.popleft()
+            blocks = [self.survivor_block(file_name, stripe, i, future) for i, future in futures.items()]
+            self.put(file_name, stripe, self.engine.compute(blocks))
+            self.stripes_done += 1
+            self.bytes_rebuilt += self.striping_unit
+
+            now = time.monotonic()
+            if self.report and now - last_report >= PROGRESS_INTERVAL:
+                self.report(self, file_name, stripe + 1)
+                last_report = now
+        return self.stripes_done, self.bytes_rebuilt, time.monotonic() - self.start
@@ -6,8 +6,61 @@ import threading
 import os
 import subprocess
 import random
+import hashlib
+import io
 import struct
 import time
+import zlib
+from collections import defaultdict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import wait, FIRST_COMPLETED, ThreadPoolExecutor
+from itertools import islice
+from parity import get_parity_engine, ParallelParity
+from blockio import BlockIOEngine, StripeWindow, staged
+from protocol import MAX_FRAGMENT, Fragmenter
+
+# Stripes kept in flight by the pipelined copy and read paths
+DEFAULT_WINDOW = 8
+
+# A data block this much later than the rest of its stripe (at least) gets the parity block fetched
+MIN_HEDGE_DELAY = 0.02
+
+# A disk late or timing out this many times in a row is suspect: for SUSPECT_TIME seconds
+# its blocks are rebuilt from the rest of their stripes instead of being asked for
+SUSPECT_AFTER = 3
+SUSPECT_TIME = 2.0
+
+# Times a block failing its checksum is read again (parity may already be spoken for)
+MAX_REREADS = 3
+
+# Seconds between renewals of the lease on a file being copied, written or read
+# (the manager's lease timeout has to be well above it)
+LEASE_RENEW_INTERVAL = 5.0
+
+# Stripes whose block hashes go to the disks in one DEDUP message, and how long to wait for the answer
+DEDUP_BATCH = 256
+DEDUP_TIMEOUT = 2.0
+
+
+def default_window(striping_unit):
+    """Stripes to keep in flight - at least enough to fill one batched datagram per disk"""
+    return max(DEFAULT_WINDOW, MAX_FRAGMENT // striping_unit)
+
+def parse_options(text):
+    """Split trailing --name [value] options off a command's arguments"""
+    args, sep, rest = text.partition(' --')
+    options = {}
+    tokens = (sep.strip() + rest).split() if sep else []
+    i = 0
+    while i < len(tokens):
+        name = tokens[i].lstrip('-')
+        if i + 1 < len(tokens) and not tokens[i + 1].startswith('--'):
+            options[name] = tokens[i + 1]
+            i += 2
+        else:
+            options[name] = True
+            i += 1
+    return args.strip(), options
 
 class DSSUser:
     def __init__(self, username, manager_ip, manager_port, m_port, c_port):
@@ -23,6 +76,14 @@ class DSSUser:
 
         self.c_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.c_socket.bind(('', c_port))
+
+        # Whole-buffer XOR engine shared by copy and read
+        self.parity_engine = get_parity_engine()
+        self.strikes = defaultdict(int)  # of the format {disk_name: late or failed reads in a row}
+        self.suspects = {}  # of the format {disk_name: time its suspicion runs out}
+
+        # Persistent per-disk block I/O workers
+        self.io = BlockIOEngine()
         
         print(f"[USER {username}] Started on ports {m_port}, {c_port}")
         self.register()
@@ -49,22 +110,89 @@ class DSSUser:
             sock.close()
             return "FAILURE|Manager timeout"
     
+    @contextmanager
+    def renewing(self, dss_name, file_name):
+        """Renew this user's lease on a file every LEASE_RENEW_INTERVAL while the body runs.
+
+        Yields an Event that is set if the manager no longer knows the lease.
+        """
+        done = threading.Event()
+        lost = threading.Event()
+
+        def renew():
+            while not done.wait(LEASE_RENEW_INTERVAL):
+                response = self.send_to_manager(f"renew|{dss_name}|{file_name}|{self.username}")
+                if response.startswith("FAILURE") and response != "FAILURE|Manager timeout":
+                    print(f"[USER {self.username}] Lost the lease on {file_name}: {response}")
+                    lost.set()
+                    return
+
+        threading.Thread(target=renew, daemon=True).start()
+        try:
+            yield lost
+        finally:
+            done.set()
+
     def send_to_peer(self, peer_ip, peer_port, data):
         """Send data to peer (can be binary)"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.sendto(data, (peer_ip, peer_port))
         sock.close()
     
-    def handle_ls(self):
-        """Handle ls command"""
-        response = self.send_to_manager("ls")
+    def request_peer(self, disk_triple, message, timeout):
+        """Send a c-port message (fragmented if large) to a disk and return its reply, or None"""
+        addr = (disk_triple[1], disk_triple[2])
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(timeout)
+        fragmenter = Fragmenter()
+        try:
+            fragmenter.send(sock, message, addr)
+            while True:
+                data, _ = sock.recvfrom(65536)
+                if data.startswith(b'FRAG_NACK|'):
+                    fragmenter.handle_nack(sock, data, addr)
+                    continue
+                return data.decode('utf-8')
+        except socket.timeout:
+            return None
+        finally:
+            sock.close()
+
+    def list_files(self, filters):
+        """Yield ls records page by page, fetching the next page only when needed"""
+        cursor = ''
+        while True:
+            command = "|".join(["ls", cursor] + [f"{name}={value}" for name, value in filters.items()])
+            response = self.send_to_manager(command)
+            if not response.startswith("SUCCESS"):
+                raise RuntimeError(response)
+            parts = response.split('|')
+            cursor = parts[1]
+            yield from parts[2:]
+            if not cursor:
+                return
+
+    def handle_ls(self, filters=None):
+        """Handle ls command, optionally filtered by dss, owner or name prefix"""
         print(f"\n[USER {self.username}] File Listing:")
-        if response.startswith("SUCCESS"):
-            parts = response.split('|')[1:]
-            for part in parts:
-                print(f"  {part}")
-        else:
-            print(f"  {response}")
+        empty = False  # The last DSS printed has no (matching) files yet
+        try:
+            for record in self.list_files(filters or {}):
+                if record.startswith("D:"):
+                    if empty:
+                        print("  FILES:none")
+                    n, striping_unit, disks, dss_name = record[2:].split(':', 3)
+                    print(f"  DSS:{dss_name}|n={n}|striping_unit={striping_unit}|disks={disks}")
+                    empty = True
+                elif record.startswith("F:"):
+                    size, owner, file_name = record[2:].split(':', 2)
+                    print(f"  FILE:{file_name}|size={size}|owner={owner}")
+                    empty = False
+        except RuntimeError as e:
+            print(f"  {e}")
+            return
+        if empty:
+            print("  FILES:none")
     
     def handle_configure_dss(self, dss_name, n, striping_unit):
         """Handle configure-dss command"""
@@ -74,14 +202,10 @@ class DSSUser:
     
     def compute_parity(self, data_blocks):
         """XOR all data blocks to compute parity"""
-        parity = bytearray(len(data_blocks[0]))
-        for block in data_blocks:
-            for i in range(len(block)):
-                parity[i] ^= block[i]
-        return bytes(parity)
+        return self.parity_engine.compute(data_blocks)
    
-    def handle_copy(self, file_path):
-        """Handle copy command - two phase operation"""
+    def handle_copy(self, file_path, workers=1, window=None, dedup=False):
+        """Handle copy command - two phase operation (only sending blocks the disks lack if dedup)"""
         if not os.path.exists(file_path):
             print(f"[USER {self.username}] File not found: {file_path}")
             return
@@ -115,225 +239,722 @@ class DSSUser:
         print(f"[USER {self.username}] Copy phase 1: {file_name} -> {dss_name}")
         
         # Phase 2: Actually copy file
-        self.copy_file_to_dss(file_path, dss_name, n, striping_unit, disk_triples)
+        with self.renewing(dss_name, file_name):
+            self.copy_file_to_dss(file_path, dss_name, n, striping_unit, disk_triples, workers, window, dedup)
         
         # Phase 3: Notify manager copy is complete
         complete_cmd = f"copy-complete|{self.username}"
         response = self.send_to_manager(complete_cmd)
         print(f"[USER {self.username}] Copy complete: {response}")
     
-    def copy_file_to_dss(self, file_path, dss_name, n, striping_unit, disk_triples):
-        """Read file and stripe it across disks with parity"""
+    def read_stripes(self, f, n, striping_unit):
+        """Yield the n-1 padded data blocks of each stripe of an open file"""
+        while True:
+            # Read n-1 data blocks
+            data_blocks = []
+            for i in range(n - 1):
+                block = f.read(striping_unit)
+                if not block:
+                    if i == 0:
+                        return  # EOF
+                if not block:
+                    block = b'\x00' * striping_unit
+                elif len(block) < striping_unit:
+                    block = block.ljust(striping_unit, b'\x00')
+                data_blocks.append(block)
+            yield data_blocks
+
+    def copy_file_to_dss(self, file_path, dss_name, n, striping_unit, disk_triples,
+                         workers=1, window=None, dedup=False):
+        """Read file and stripe it across disks with parity.
+
+        File reading, parity computation and block sends run as overlapping
+        stages, with up to window stripes waiting on WRITE_ACKs at once.
+        With dedup a further stage asks the disks which blocks they already
+        hold (see dedup_stripes) and only the others are sent.
+        """
         file_name = os.path.basename(file_path)
         print(f"[USER {self.username}] Striping {file_name} across {n} disks...")
-       
-        with open(file_path, 'rb') as f:
-            stripe_num = 0
-            while True:
-                # Read n-1 data blocks
-                data_blocks = []
-                for i in range(n - 1):
-                    block = f.read(striping_unit)
-                    if not block:
-                        if i == 0:
-                            return  # EOF
-                    if not block:
-                        block = b'\x00' * striping_unit
-                    elif len(block) < striping_unit:
-                        block = block.ljust(striping_unit, b'\x00')
-                    data_blocks.append(block)
-                
-                # Compute parity block
-                parity = self.compute_parity(data_blocks)
-                
-                # Determine which disk gets parity for this stripe
-                parity_disk_idx = n - ((stripe_num % n) + 1)
-                
-                print(f"[USER {self.username}] Stripe {stripe_num}: parity on disk {parity_disk_idx}")
-                
-                # Write blocks in parallel
-                threads = []
-                for i in range(n):
-                    if i == parity_disk_idx:
-                        block_data = parity
-                        block_type = 'parity'
-                    else:
-                        # Map data block index (skip parity disk)
-                        data_idx = i if i < parity_disk_idx else i - 1
-                        block_data = data_blocks[data_idx]
-                        block_type = 'data'
-                    
-                    disk_name, disk_ip, disk_port = disk_triples[i]
-                    t = threading.Thread(
-                        target=self.write_block_to_disk,
-                        args=(disk_name, disk_ip, disk_port, dss_name, file_name,
-                              stripe_num, i, block_data, block_type)
-                    )
-                    threads.append(t)
-                    t.start()
-                
-                # Wait for all writes
-                for t in threads:
-                    t.join()
-                
-                stripe_num += 1
-    
-    def write_block_to_disk(self, disk_name, disk_ip, disk_port, dss_name, 
-                           file_name, stripe, block_idx, block_data, block_type):
-        """Send a block to disk with length prefix"""
+
+        # Parity for batches of stripes is computed on a process pool when asked to
+        pool = ParallelParity(workers, n, striping_unit) if workers > 1 else None
+        window = window or default_window(striping_unit)
+        in_flight = StripeWindow(window)
+        dedup_stats = {'blocks': 0, 'held': 0, 'bytes': 0}
         try:
-            file_base = os.path.basename(file_name)
-            block_size = len(block_data)
-            
-            # Format: WRITE_BLOCK|dss|file|stripe|block_idx|type|size|[data]
-            header = f"WRITE_BLOCK|{dss_name}|{file_base}|{stripe}|{block_idx}|{block_type}|{block_size}|"
-           
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            message = header.encode('utf-8') + block_data
-            sock.sendto(message, (disk_ip, disk_port))
-            
-            # Wait for ACK
-            sock.settimeout(2)
-            response, _ = sock.recvfrom(1024)
+            with open(file_path, 'rb') as f:
+                if pool:
+                    stripes = staged(pool.stripes(f), window)
+                else:
+                    data_stripes = staged(self.read_stripes(f, n, striping_unit), window)
+                    stripes = staged(data_stripes, window,
+                                     lambda data_blocks: (data_blocks, self.compute_parity(data_blocks)))
+                if dedup:
+                    stripes = staged(self.dedup_stripes(stripes, dss_name, file_name, n, disk_triples,
+                                                        dedup_stats), window)
+                else:
+                    stripes = ((data_blocks, parity, None) for data_blocks, parity in stripes)
+
+                for stripe_num, (data_blocks, parity, needed) in enumerate(stripes):
+                    in_flight.submit(
+                        lambda: self.write_stripe(dss_name, file_name, n, disk_triples,
+                                                  stripe_num, data_blocks, parity, needed),
+                        lambda i, future, stripe=stripe_num: self.report_block_write(
+                            disk_triples[i][0], stripe, i, future))
+
+                # Wait for the last stripes to be acknowledged
+                in_flight.drain()
+        finally:
+            if pool:
+                pool.close()
+
+        if in_flight.failed_blocks:
+            print(f"[USER {self.username}] {in_flight.failed_blocks} block writes failed")
+        if dedup:
+            held = dedup_stats['held']
+            print(f"[USER {self.username}] Dedup: {held} of {dedup_stats['blocks']} blocks already on the "
+                  f"disks, {dedup_stats['bytes']} bytes not sent "
+                  f"({held / dedup_stats['blocks'] if dedup_stats['blocks'] else 0:.1%})")
+
+    def dedup_stripes(self, stripes, dss_name, file_name, n, disk_triples, stats):
+        """Yield (data_blocks, parity, needed) per stripe, needed being the block indexes to send.
+
+        The blocks of DEDUP_BATCH stripes at a time are hashed (SHA-256)
+        and each disk gets one DEDUP message listing its blocks' digests. A
+        disk links the blocks whose content this user already stored there
+        and answers with the ones it still needs; a disk that does not
+        answer (or does not dedup) gets every block. stats counts the
+        blocks and bytes saved.
+        """
+        stripes = iter(stripes)
+        start = 0
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            while True:
+                batch = list(islice(stripes, DEDUP_BATCH))
+                if not batch:
+                    return
+                layouts = [self.stripe_layout(n, start + k, data_blocks, parity)
+                           for k, (data_blocks, parity) in enumerate(batch)]
+
+                def query(i):
+                    entries = ",".join(f"{start + k}:{i}:{hashlib.sha256(layout[i][0]).hexdigest()}"
+                                       for k, layout in enumerate(layouts))
+                    message = f"DEDUP|{dss_name}|{file_name}|{self.username}|{entries}"
+                    reply = self.request_peer(disk_triples[i], message.encode('utf-8'), DEDUP_TIMEOUT)
+                    if reply is None or not reply.startswith("DEDUP_NEED|"):
+                        return None
+                    # Format: DEDUP_NEED|dss_name|file_name|stripe:block_idx,...
+                    return {int(entry.split(':')[0]) for entry in reply.split('|')[3].split(',') if entry}
+
+                needs = list(pool.map(query, range(n)))
+                for k, (data_blocks, parity) in enumerate(batch):
+                    needed = {i for i in range(n) if needs[i] is None or start + k in needs[i]}
+                    stats['blocks'] += n
+                    stats['held'] += n - len(needed)
+                    stats['bytes'] += sum(len(layouts[k][i][0]) for i in range(n) if i not in needed)
+                    yield data_blocks, parity, needed
+                start += len(batch)
+
+    def stripe_layout(self, n, stripe_num, data_blocks, parity):
+        """Return each disk's (block_data, block_type) for one stripe, in disk order"""
+        parity_disk_idx = n - ((stripe_num % n) + 1)
+        layout = []
+        for i in range(n):
+            if i == parity_disk_idx:
+                layout.append((parity, 'parity'))
+            else:
+                # Map data block index (skip parity disk)
+                data_idx = i if i < parity_disk_idx else i - 1
+                layout.append((data_blocks[data_idx], 'data'))
+        return layout
+
+    def write_stripe(self, dss_name, file_name, n, disk_triples, stripe_num, data_blocks, parity,
+                     needed=None):
+        """Send one stripe's data and parity blocks (those in needed, if given) to the disks.
+
+        Returns {block_idx: Future}.
+        """
+        # Determine which disk gets parity for this stripe
+        parity_disk_idx = n - ((stripe_num % n) + 1)
+        
+        print(f"[USER {self.username}] Stripe {stripe_num}: parity on disk {parity_disk_idx}")
+        
+        # Submit every block to its disk's I/O channel
+        futures = {}
+        for i, (block_data, block_type) in enumerate(self.stripe_layout(n, stripe_num, data_blocks, parity)):
+            if needed is None or i in needed:
+                futures[i] = self.write_block_to_disk(disk_triples[i], dss_name, file_name,
+                                                      stripe_num, i, block_data, block_type)
+        return futures
+
+    def report_block_write(self, disk_name, stripe, block_idx, future):
+        """Print the outcome of one block write once its WRITE_ACK is in"""
+        error = future.exception()
+        if error is None:
             print(f"[USER {self.username}] Block {stripe}:{block_idx} -> {disk_name}")
-            sock.close()
-        except Exception as e:
-            print(f"[USER {self.username}] Error writing block to {disk_name}: {e}")
+        else:
+            print(f"[USER {self.username}] Error writing block to {disk_name}: {error}")
     
-    def handle_read(self, dss_name, file_name):
-        """Handle read command - two phase operation"""
-        # Phase 1: Request file from manager
-        command = f"read|{dss_name}|{file_name}|{self.username}"
+    def write_block_to_disk(self, disk_triple, dss_name, file_name, stripe, block_idx,
+                            block_data, block_type):
+        """Queue a block write on the disk's channel and return its Future"""
+        file_base = os.path.basename(file_name)
+        return self.io.write_block(disk_triple, dss_name, file_base, stripe, block_idx,
+                                   block_data, block_type)
+    
+    def handle_write(self, dss_name, file_name, offset, source_path, window=None):
+        """Handle write command - write a local file's bytes into a stored file at offset"""
+        if not os.path.exists(source_path):
+            print(f"[USER {self.username}] File not found: {source_path}")
+            return
+
+        length = os.path.getsize(source_path)
+        try:
+            with open(source_path, 'rb') as f:
+                file_size = self.write_range(dss_name, file_name, offset, f, window, length)
+        except IOError as e:
+            print(f"[USER {self.username}] Write failed: {e}")
+            return
+        print(f"[USER {self.username}] Wrote {length} bytes at {offset} of {file_name} "
+              f"(now {file_size} bytes)")
+
+    def write_range(self, dss_name, file_name, offset, data, window=None, length=None):
+        """Write data into a stored file at offset in place - two phase operation.
+
+        data is bytes, or a binary file read from its current position for
+        length bytes. Writing past the end grows the file (a gap is filled
+        with zeros). Returns the new size. Raises IOError if the manager
+        refuses the write or a stripe cannot be updated; the write is then
+        aborted and the file keeps its size. Stripes already updated keep
+        their new bytes, with parity re-synced where a block write failed
+        (the abort names any stripe that could not be).
+        """
+        if length is None:
+            data, length = io.BytesIO(data), len(data)
+
+        # Phase 1: Take the file's write lease from the manager
+        command = f"write|{dss_name}|{file_name}|{offset}|{length}|{self.username}"
         response = self.send_to_manager(command)
-        
+
         if response.startswith("FAILURE"):
-            print(f"[USER {self.username}] Read failed: {response}")
-            return
-        
+            raise IOError(response)
+
         # Parse response
         parts = response.split('|')
         n = int(parts[1])
         striping_unit = int(parts[2])
         file_size = int(parts[3])
-        
-        # Extract disk triples
-        disk_triples = []
-        for i in range(n):
-            idx = 4 + i * 3
-            disk_name = parts[idx]
-            disk_ip = parts[idx + 1]
-            disk_port = int(parts[idx + 2])
-            disk_triples.append((disk_name, disk_ip, disk_port))
+        disk_triples = [(parts[idx], parts[idx + 1], int(parts[idx + 2])) for idx in range(4, 4 + 3 * n, 3)]
+
+        print(f"[USER {self.username}] Write phase 1: {length} bytes at {offset} of {file_name} "
+              f"on {dss_name}")
+
+        # Phase 2: Update the stripes the range spans
+        unsynced = []
+        try:
+            with self.renewing(dss_name, file_name):
+                self.write_file_range(dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                                      offset, length, data, window, unsynced)
+        except IOError:
+            self.send_to_manager(f"write-abort|{self.username}|{','.join(map(str, unsynced))}")
+            raise
+
+        # Phase 3: Have the manager commit the new size
+        response = self.send_to_manager(f"write-complete|{self.username}")
+        print(f"[USER {self.username}] Write complete: {response}")
+        if response.startswith("FAILURE"):
+            raise IOError(response)
+        return max(file_size, offset + length)
+
+    def write_file_range(self, dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                         offset, length, source, window=None, unsynced=None):
+        """Write length bytes read from source at offset of a file of file_size bytes, stripe by stripe.
+
+        A stripe whose data blocks are all overwritten, or that lies past
+        the end of the file, is written whole with freshly computed parity
+        and nothing is read. Any other stripe is updated read-modify-write:
+        the blocks it touches and the parity block are read (with the same
+        checksum checks and hedging as reads), and only those are written
+        back, with new parity = old parity ^ old data ^ new data. Up to
+        window stripes are kept in flight, reading or writing, so source is
+        read (and a gap past the end zero-filled) a stripe at a time.
+
+        A stripe of the old file some of whose block writes failed no longer
+        matches its parity; before IOError is raised its parity is re-synced
+        from the data blocks on the disks, and the stripes that could not be
+        are added to unsynced.
+        """
+        stripe_size = (n - 1) * striping_unit
+        start = offset  # Bytes from file_size up to here are the zeros of a gap
+        offset = min(offset, file_size)
+        end = start + length
+        if offset == end:
+            return
+        old_stripes = (file_size + stripe_size - 1) // stripe_size
+        first_stripe, last_stripe = offset // stripe_size, (end - 1) // stripe_size
+        print(f"[USER {self.username}] Updating stripes {first_stripe}-{last_stripe} "
+              f"(bytes {offset}-{end}) of {file_name}...")
+        window = window or default_window(striping_unit)
+
+        def take(lo, hi):
+            # The stripes are taken in order, so source is read straight through
+            gap = max(0, min(hi, start) - lo)
+            chunk = source.read(hi - lo - gap) if hi - lo > gap else b''
+            if len(chunk) != hi - lo - gap:
+                raise IOError(f"source ended {hi - lo - gap - len(chunk)} bytes short")
+            return bytes(gap) + chunk
+
+        full = rmw = written = 0
+        damaged = []  # Stripes of the old file with a failed block write
+        writes = deque()  # of the format (stripe, {block_idx: future})
+        in_flight = deque()  # of the format (stripe, {block_idx: (offset in block, bytes)}, {block_idx: future})
+        next_stripe = first_stripe
+
+        def settle():
+            # Waiting for the oldest stripe's block writes to be acknowledged
+            nonlocal written
+            stripe, futures = writes.popleft()
+            failed = False
+            for i, future in futures.items():
+                if future.exception() is not None:
+                    print(f"[USER {self.username}] Error writing block {stripe}:{i} to "
+                          f"{disk_triples[i][0]}: {future.exception()}")
+                    failed = True
+                written += 1
+            if failed and stripe < old_stripes:
+                damaged.append(stripe)
+
+        try:
+            while in_flight or next_stripe <= last_stripe:
+                # Full stripes go straight out; the others get their old blocks read
+                while next_stripe <= last_stripe and len(in_flight) + len(writes) < window:
+                    stripe = next_stripe
+                    next_stripe += 1
+                    parity_disk_idx = n - ((stripe % n) + 1)
+                    data_disks = [i for i in range(n) if i != parity_disk_idx]
+                    base = stripe * stripe_size
+                    new = {}
+                    for k, i in enumerate(data_disks):
+                        lo, hi = max(offset, base + k * striping_unit), min(end, base + (k + 1) * striping_unit)
+                        if lo < hi:
+                            new[i] = (lo - base - k * striping_unit, take(lo, hi))
+
+                    if stripe >= old_stripes or all(i in new and len(new[i][1]) == striping_unit
+                                                    for i in data_disks):
+                        data_blocks = [bytes(new[i][0]) + new[i][1] if i in new else bytes(striping_unit)
+                                       for i in data_disks]
+                        data_blocks = [block.ljust(striping_unit, b'\x00') for block in data_blocks]
+                        writes.append((stripe, self.write_stripe(dss_name, file_name, n, disk_triples, stripe,
+                                                                 data_blocks, self.compute_parity(data_blocks))))
+                        full += 1
+                        continue
+
+                    futures = {i: self.read_block_from_disk(disk_triples[i], dss_name, file_name, stripe, i)
+                               for i in list(new) + [parity_disk_idx]}
+                    in_flight.append((stripe, new, futures))
+
+                if in_flight:
+                    # Merging the new bytes into the oldest stripe's blocks and patching its parity
+                    stripe, new, futures = in_flight.popleft()
+                    parity_disk_idx = n - ((stripe % n) + 1)
+                    wanted = list(new) + [parity_disk_idx]
+                    blocks, checksums = self.gather_stripe(dss_name, file_name, n, striping_unit,
+                                                           disk_triples, stripe, futures, wanted)
+                    self.rebuild_missing(n, disk_triples, stripe, blocks, checksums, wanted)
+
+                    delta = [blocks[parity_disk_idx]]
+                    futures = {}
+                    for i, (at, chunk) in new.items():
+                        block = blocks[i][:at] + chunk + blocks[i][at + len(chunk):]
+                        delta += [blocks[i], block]
+                        futures[i] = self.write_block_to_disk(disk_triples[i], dss_name, file_name,
+                                                              stripe, i, block, 'data')
+                    futures[parity_disk_idx] = self.write_block_to_disk(
+                        disk_triples[parity_disk_idx], dss_name, file_name, stripe, parity_disk_idx,
+                        self.compute_parity(delta), 'parity')
+                    writes.append((stripe, futures))
+                    rmw += 1
+
+                while writes and (len(in_flight) + len(writes) >= window or not in_flight):
+                    settle()
+        finally:
+            while writes:
+                settle()
+            if damaged:
+                lost = [stripe for stripe in damaged
+                        if not self.resync_stripe(dss_name, file_name, n, striping_unit, disk_triples, stripe)]
+                if unsynced is not None:
+                    unsynced.extend(lost)
+
+        print(f"[USER {self.username}] {full} stripes written whole, {rmw} read-modify-written "
+              f"({written} blocks written)")
+        if damaged:
+            raise IOError(f"block writes failed on stripes {damaged}")
+
+    def resync_stripe(self, dss_name, file_name, n, striping_unit, disk_triples, stripe):
+        """Recompute a stripe's parity from the data blocks on the disks; return whether it was"""
+        parity_disk_idx = n - ((stripe % n) + 1)
+        futures = {i: self.read_block_from_disk(disk_triples[i], dss_name, file_name, stripe, i)
+                   for i in range(n) if i != parity_disk_idx}
+        # The parity block is what is out of date, so nothing is rebuilt from it
+        blocks, _ = self.gather_stripe(dss_name, file_name, n, striping_unit, disk_triples, stripe,
+                                       futures, skip=parity_disk_idx)
+        if len(blocks) < n - 1:
+            print(f"[USER {self.username}] Stripe {stripe}: cannot re-sync parity, "
+                  f"data blocks {[i for i in futures if i not in blocks]} unreadable")
+            return False
+        future = self.write_block_to_disk(disk_triples[parity_disk_idx], dss_name, file_name, stripe,
+                                          parity_disk_idx, self.compute_parity(list(blocks.values())),
+                                          'parity')
+        if future.exception() is not None:
+            print(f"[USER {self.username}] Stripe {stripe}: cannot re-sync parity: {future.exception()}")
+            return False
+        print(f"[USER {self.username}] Stripe {stripe}: parity re-synced")
+        return True
+
+    def handle_read(self, dss_name, file_name, window=None, offset=0, length=None):
+        """Handle read command - two phase operation (the manager finds the DSS if dss_name is None)
+
+        With offset/length only that byte range is fetched and written out.
+        """
+        if offset < 0 or (length is not None and length < 0):
+            print(f"[USER {self.username}] Read failed: Invalid range")
+            return
+
+        # Phase 1: Request file from manager
+        try:
+            dss_name, n, striping_unit, file_size, disk_triples, rebuilding = self.begin_read(dss_name, file_name)
+        except IOError as e:
+            print(f"[USER {self.username}] Read failed: {e}")
+            return
         
         print(f"[USER {self.username}] Read phase 1: {file_name} from {dss_name}")
         
         # Phase 2: Read file from DSS
-        self.read_file_from_dss(dss_name, file_name, file_size, n, striping_unit, disk_triples)
+        try:
+            with self.renewing(dss_name, file_name) as lost:
+                self.read_file_from_dss(dss_name, file_name, file_size, n, striping_unit, disk_triples, window,
+                                        rebuilding, offset, length)
+            if lost.is_set():
+                raise IOError("Read lease lost - the file may have changed during the read")
+        except IOError as e:
+            print(f"[USER {self.username}] Read failed: {e}")
         
         # Phase 3: Notify manager read is complete
-        complete_cmd = f"read-complete|{self.username}|{dss_name}"
-        response = self.send_to_manager(complete_cmd)
-        print(f"[USER {self.username}] Read complete: {response}")
+        self.end_read(dss_name, file_name)
         
-        # Verify with diff
+        # Verify with diff (against the same range of the local copy for ranged reads)
         if os.path.exists(file_name):
             recovered_file = f"{file_name}.recovered"
             try:
-                result = subprocess.run(['diff', file_name, recovered_file], 
-                                      capture_output=True, text=True, timeout=5)
-                if result.returncode == 0:
+                if offset or length is not None:
+                    with open(file_name, 'rb') as f, open(recovered_file, 'rb') as r:
+                        f.seek(offset)
+                        passed = f.read(file_size if length is None else length) == r.read()
+                else:
+                    result = subprocess.run(['diff', file_name, recovered_file], 
+                                          capture_output=True, text=True, timeout=5)
+                    passed = result.returncode == 0
+                if passed:
                     print(f"[USER {self.username}] ✓ File verification PASSED")
                 else:
                     print(f"[USER {self.username}] ✓ File verification FAILED")
             except Exception as e:
                 print(f"[USER {self.username}] Could not verify: {e}")
-    
-    def read_file_from_dss(self, dss_name, file_name, file_size, n, striping_unit, disk_triples):
-        """Read file from DSS with parity verification"""
-        num_stripes = (file_size + (n-1)*striping_unit - 1) // ((n-1)*striping_unit)
-        print(f"[USER {self.username}] Reading {num_stripes} stripes...")
 
-        bytes_written = 0
+    def begin_read(self, dss_name, file_name):
+        """Take a read lease on a file from the manager.
+
+        Returns (dss_name, n, striping_unit, file_size, disk_triples,
+        rebuilding), rebuilding being (disk_idx, watermark) while one of the
+        DSS's disks is rebuilt, or None. Raises IOError if the manager refuses.
+        """
+        if dss_name is None:
+            command = f"read|{file_name}|{self.username}"
+        else:
+            command = f"read|{dss_name}|{file_name}|{self.username}"
+        response = self.send_to_manager(command)
+        
+        if response.startswith("FAILURE"):
+            raise IOError(response)
+        
+        # Parse response
+        parts = response.split('|')
+        if dss_name is None:
+            dss_name = parts.pop(1)
+        n = int(parts[1])
+        striping_unit = int(parts[2])
+        file_size = int(parts[3])
+        
+        # Extract disk triples
+        disk_triples = []
+        for i in range(n):
+            idx = 4 + i * 3
+            disk_name = parts[idx]
+            disk_ip = parts[idx + 1]
+            disk_port = int(parts[idx + 2])
+            disk_triples.append((disk_name, disk_ip, disk_port))
+
+        # While a disk is being rebuilt the reply ends with its index and the file's watermark
+        rebuilding = None
+        if len(parts) >= 6 + 3 * n:
+            rebuilding = (int(parts[4 + 3 * n]), int(parts[5 + 3 * n]))
+            print(f"[USER {self.username}] Disk {rebuilding[0]} is being rebuilt "
+                  f"(stripes from {rebuilding[1]} on are read from parity)")
+        return dss_name, n, striping_unit, file_size, disk_triples, rebuilding
+
+    def end_read(self, dss_name, file_name):
+        """Give the read lease on a file back to the manager"""
+        complete_cmd = f"read-complete|{self.username}|{dss_name}|{file_name}"
+        response = self.send_to_manager(complete_cmd)
+        print(f"[USER {self.username}] Read complete: {response}")
+
+    def read_range(self, dss_name, file_name, offset, length, window=None):
+        """Return length bytes of a file from offset (fewer past its end), fetching only the blocks they span"""
+        return b"".join(self.stream_file(dss_name, file_name, offset, length, window))
+
+    def stream_file(self, dss_name, file_name, offset=0, length=None, window=None):
+        """Yield a file's bytes (from offset, length of them if given) in order, a stripe at a time.
+
+        The read lease is held (and renewed) until the generator is exhausted
+        or closed. Raises IOError if the manager refuses the read, the lease
+        is lost or a stripe is lost, and ValueError for a negative offset or length.
+        """
+        if offset < 0 or (length is not None and length < 0):
+            raise ValueError("Invalid range")
+        dss_name, n, striping_unit, file_size, disk_triples, rebuilding = self.begin_read(dss_name, file_name)
+        try:
+            with self.renewing(dss_name, file_name) as lost, \
+                    closing(self.stream_from_dss(dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                                                 offset, length, window, rebuilding)) as chunks:
+                for chunk in chunks:
+                    if lost.is_set():
+                        raise IOError("Read lease lost - the file may have changed during the read")
+                    yield chunk
+        finally:
+            self.end_read(dss_name, file_name)
+
+    def read_file_from_dss(self, dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                           window=None, rebuilding=None, offset=0, length=None):
+        """Read a file (or the byte range from offset) from DSS into <file_name>.recovered"""
         with open(f"{file_name}.recovered", 'wb') as out:
-            for stripe in range(num_stripes):
-                # Read all blocks of this stripe in parallel
-                blocks = [None] * n
-                threads = []
-                
-                for i in range(n):
-                    disk_name, disk_ip, disk_port = disk_triples[i]
-                    t = threading.Thread(
-                        target=self.read_block_from_disk,
-                        args=(disk_name, disk_ip, disk_port, dss_name, file_name,
-                            stripe, i, blocks)
-                    )
-                    threads.append(t)
-                    t.start()
-                
-                # Wait for all reads
-                for t in threads:
-                    t.join()
-                
-                # Introduce bit error with small probability
-                p = 5  # 5% error rate
-                for i in range(n):
-                    if blocks[i] and random.randint(0, 100) < p:
-                        block_arr = bytearray(blocks[i])
-                        bit_pos = random.randint(0, len(block_arr) * 8 - 1)
-                        byte_idx = bit_pos // 8
-                        bit_idx = bit_pos % 8
-                        block_arr[byte_idx] ^= (1 << bit_idx)
-                        blocks[i] = bytes(block_arr)
-                
-                # Verify parity
+            for chunk in self.stream_from_dss(dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                                              offset, length, window, rebuilding):
+                out.write(chunk)
+
+    def stream_from_dss(self, dss_name, file_name, file_size, n, striping_unit, disk_triples,
+                        offset=0, length=None, window=None, rebuilding=None):
+        """Yield the bytes of a file from offset on, stripe by stripe, rebuilding missing or late blocks from parity.
+
+        Only the stripes the range spans are read, and of its first and
+        last stripe only the data blocks it overlaps. Block reads for up to
+        window stripes are kept outstanding; stripes are yielded strictly in
+        order as they complete. Each block is checked against the crc32 its
+        disk stored with it. When a block fails, comes back empty (its disk
+        was FAILed) or corrupt, or is late, the rest of the stripe (parity
+        included) is fetched as a hedge and the missing block is rebuilt
+        from the other n-1. rebuilding=(disk_idx, watermark) names a disk
+        under rebuild: from the watermark stripe on, its blocks are not
+        asked for and are rebuilt from the rest of the stripe instead. The
+        same goes for a disk gone suspect (see strike) while it stays so.
+        """
+        stripe_size = (n - 1) * striping_unit
+        end = file_size if length is None else min(file_size, offset + length)
+        if offset >= end:
+            return
+        first_stripe, last_stripe = offset // stripe_size, (end - 1) // stripe_size
+        print(f"[USER {self.username}] Reading {last_stripe - first_stripe + 1} stripes "
+              f"(bytes {offset}-{end} of {file_size})...")
+        window = window or default_window(striping_unit)
+
+        rebuilt = 0
+        in_flight = deque()  # of the format (stripe, [wanted block indexes], skip, {block_idx: future})
+        next_stripe = first_stripe
+        try:
+            while in_flight or next_stripe <= last_stripe:
+                # Keeping the window full of outstanding stripe reads
+                while next_stripe <= last_stripe and len(in_flight) < window:
+                    stripe = next_stripe
+                    parity_disk_idx = n - ((stripe % n) + 1)
+                    data_disks = [i for i in range(n) if i != parity_disk_idx]
+                    base = stripe * stripe_size
+                    wanted = data_disks[max(0, (offset - base) // striping_unit):
+                                        min(n - 1, (end - 1 - base) // striping_unit + 1)]
+
+                    # A disk under rebuild lacks the stripe's block, which then comes from the other n-1
+                    skip = None
+                    if rebuilding and stripe >= rebuilding[1]:
+                        skip = rebuilding[0]
+                    else:
+                        # Nor are a suspect disk's blocks asked for, rather than queued behind its stalled reads
+                        suspect = [i for i in wanted if self.is_suspect(disk_triples[i][0])]
+                        if suspect:
+                            skip = suspect[0]
+                    fetch = [i for i in range(n) if i != skip] if skip in wanted else wanted
+                    futures = {i: self.read_block_from_disk(disk_triples[i], dss_name, file_name, stripe, i)
+                               for i in fetch}
+                    in_flight.append((stripe, wanted, skip, futures))
+                    next_stripe += 1
+
+                # Reassembling the oldest stripe
+                stripe, wanted, skip, futures = in_flight.popleft()
+                blocks, checksums = self.gather_stripe(dss_name, file_name, n, striping_unit, disk_triples,
+                                                       stripe, futures, wanted, skip)
+
+                if self.rebuild_missing(n, disk_triples, stripe, blocks, checksums, wanted):
+                    rebuilt += 1
+
+                # Yielding the wanted data blocks, clipped to the range
                 parity_disk_idx = n - ((stripe % n) + 1)
-                data_blocks = [blocks[i] for i in range(n) if i != parity_disk_idx]
-                
-                computed_parity = self.compute_parity(data_blocks)
-                if computed_parity == blocks[parity_disk_idx]:
-                    print(f"[USER {self.username}] Stripe {stripe}: parity verified ✓")
-                    # Write data blocks to output
-                    for i in range(n):
-                        if i != parity_disk_idx:
-                            to_write = min(len(blocks[i]), file_size - bytes_written)
-                            out.write(blocks[i][:to_write])
-                            bytes_written += to_write
+                data_disks = [i for i in range(n) if i != parity_disk_idx]
+                start = stripe * stripe_size + data_disks.index(wanted[0]) * striping_unit
+                data = b"".join(blocks[i] for i in wanted)
+                yield data[max(0, offset - start):end - start]
+        finally:
+            # A generator closed early (or a lost stripe) leaves reads queued for the stripes ahead
+            for _, _, _, futures in in_flight:
+                for future in futures.values():
+                    future.cancel()
+
+        if rebuilt:
+            print(f"[USER {self.username}] {rebuilt} of {last_stripe - first_stripe + 1} stripes "
+                  f"read in degraded mode")
+
+    def rebuild_missing(self, n, disk_triples, stripe, blocks, checksums, wanted):
+        """Rebuild the one wanted block gather_stripe could not get; return whether there was one"""
+        missing = [i for i in wanted if i not in blocks]
+        if not missing:
+            return False
+        lost = [i for i in range(n) if i not in blocks]
+        if len(lost) > 1:
+            raise IOError(f"stripe {stripe}: blocks {lost} lost, cannot rebuild from parity")
+        # Degraded stripe - the lost block is the XOR of the other n-1 blocks
+        i = missing[0]
+        blocks[i] = self.compute_parity(list(blocks.values()))
+        if i in checksums and zlib.crc32(blocks[i]) != checksums[i]:
+            raise IOError(f"stripe {stripe}: block {i} rebuilt from parity fails its checksum")
+        print(f"[USER {self.username}] Stripe {stripe}: rebuilt block {i} "
+              f"({disk_triples[i][0]}) from parity")
+        return True
+
+    def gather_stripe(self, dss_name, file_name, n, striping_unit, disk_triples, stripe, futures,
+                      wanted=None, skip=None):
+        """Wait for a stripe's wanted data blocks, hedging with the rest of the stripe.
+
+        futures maps the block indexes asked for to their read Futures;
+        wanted (every data block by default) are the ones needed. Returns
+        ({block_idx: block}, {block_idx: crc32}): the blocks are either
+        every wanted block, or n-1 blocks of the stripe (parity included)
+        from which the missing one can be rebuilt. The blocks not asked for
+        yet (other than skip's) are fetched once one fails or is late. A
+        block that failed, came back short or does not match its checksum
+        counts as missing; one that did not match is also read again (up
+        to MAX_REREADS times), in case it was damaged in transit.
+        """
+        parity_disk_idx = n - ((stripe % n) + 1)
+        if wanted is None:
+            wanted = [i for i in range(n) if i != parity_disk_idx]
+        rest = [i for i in range(n) if i not in futures and i != skip]  # Fetched as the hedge
+        blocks = {}
+        checksums = {}
+        failed = 0
+        rereads = defaultdict(int)  # of the format {block_idx: times read again after failing its checksum}
+        hedge_at = None  # When the rest of the stripe is fetched if a wanted block is still late
+        pending = set(futures.values())
+        index_of = {future: i for i, future in futures.items()}
+
+        while len(blocks) < n - 1 and not all(i in blocks for i in wanted):
+            if not pending:
+                break  # Too many blocks lost - the caller reports it
+            timeout = None if hedge_at is None or not rest else max(0, hedge_at - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = index_of[future]
+                try:
+                    block, checksum = future.result()
+                except Exception as e:
+                    print(f"[USER {self.username}] Error reading from {disk_triples[i][0]}: {e}")
+                    block = checksum = None
+                    self.strike(disk_triples[i][0])
                 else:
-                    print(f"[USER {self.username}] Stripe {stripe}: mismatch (writing anyway)")
-                    for i in range(n):
-                        if i != parity_disk_idx:
-                            to_write = min(len(blocks[i]), file_size - bytes_written)
-                            out.write(blocks[i][:to_write])
-                            bytes_written += to_write
-        
-        with open(f"{file_name}.recovered", 'r+b') as f:
-            f.truncate(file_size)
-        print(f"[USER {self.username}] Trimmed recovered file to {file_size} bytes")
-   
-    def read_block_from_disk(self, disk_name, disk_ip, disk_port, dss_name, 
-                            file_name, stripe, block_idx, blocks_array):
-        """Read a block from disk"""
-        try:
-            file_base = os.path.basename(file_name)
-            msg = f"READ_BLOCK|{dss_name}|{file_base}|{stripe}|{block_idx}"
-            
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.sendto(msg.encode('utf-8'), (disk_ip, disk_port))
-            
-            sock.settimeout(2)
-            data, _ = sock.recvfrom(65536)
-            
-            # Parse size prefix (first 4 bytes, big-endian)
-            if len(data) >= 4:
-                size = struct.unpack('>I', data[:4])[0]
-                block_data = data[4:4+size]
-                blocks_array[block_idx] = block_data
-            sock.close()
-        except Exception as e:
-            print(f"[USER {self.username}] Error reading from {disk_name}: {e}")
+                    self.strikes.pop(disk_triples[i][0], None)
+                    self.suspects.pop(disk_triples[i][0], None)
+                if block is not None and len(block) == striping_unit:
+                    checksums[i] = checksum
+                    block = self.inject_bit_error(block)
+                    if checksum is None or zlib.crc32(block) == checksum:
+                        blocks[i] = block
+                        continue
+                    print(f"[USER {self.username}] Stripe {stripe}: block {i} "
+                          f"({disk_triples[i][0]}) fails its checksum")
+                    if rereads[i] < MAX_REREADS:
+                        rereads[i] += 1
+                        retry = self.read_block_from_disk(disk_triples[i], dss_name, file_name, stripe, i)
+                        index_of[retry] = i
+                        pending.add(retry)
+                failed += 1
+
+            # The rest of the stripe goes out once a block is lost, or late against the others
+            if rest:
+                if blocks and hedge_at is None:
+                    hedge_at = time.monotonic() + self.hedge_delay(disk_triples, blocks)
+                if failed or (hedge_at is not None and time.monotonic() >= hedge_at):
+                    if not failed:
+                        for future in pending:
+                            self.strike(disk_triples[index_of[future]][0])
+                    for i in rest:
+                        future = self.read_block_from_disk(disk_triples[i], dss_name, file_name, stripe, i)
+                        futures[i] = future
+                        index_of[future] = i
+                        pending.add(future)
+                    rest = []
+        return blocks, checksums
+
+    def inject_bit_error(self, block):
+        """Flip one random bit of a received block with small probability"""
+        p = 5  # 5% error rate
+        if random.randint(0, 100) >= p:
+            return block
+        block_arr = bytearray(block)
+        bit_pos = random.randint(0, len(block_arr) * 8 - 1)
+        byte_idx = bit_pos // 8
+        bit_idx = bit_pos % 8
+        block_arr[byte_idx] ^= (1 << bit_idx)
+        return bytes(block_arr)
+
+    def hedge_delay(self, disk_triples, replied):
+        """How long the other blocks may lag the ones in before the rest of the stripe is fetched.
+
+        Only the disks that replied set it, so a disk that stopped answering
+        (its RTO backed off to the cap) does not hold every stripe up.
+        """
+        rtos = [self.io.channel(*disk_triples[i]).rtt.rto for i in replied]
+        return max([MIN_HEDGE_DELAY] + rtos)
+
+    def strike(self, disk_name):
+        """Count a late or failed read against a disk, making it suspect after SUSPECT_AFTER in a row"""
+        self.strikes[disk_name] += 1
+        if self.strikes[disk_name] >= SUSPECT_AFTER and not self.is_suspect(disk_name):
+            print(f"[USER {self.username}] {disk_name} is not answering - rebuilding its blocks "
+                  f"from parity for {SUSPECT_TIME:.0f}s")
+            self.suspects[disk_name] = time.monotonic() + SUSPECT_TIME
+
+    def is_suspect(self, disk_name):
+        """Return whether a disk's blocks are currently rebuilt instead of read"""
+        return self.suspects.get(disk_name, 0) > time.monotonic()
+
+    def read_block_from_disk(self, disk_triple, dss_name, file_name, stripe, block_idx):
+        """Queue a block read on the disk's channel and return its Future"""
+        file_base = os.path.basename(file_name)
+        return self.io.read_block(disk_triple, dss_name, file_base, stripe, block_idx)
     
-    def handle_disk_failure(self, dss_name):
-        """Handle disk-failure command - two phase operation"""
+    def handle_disk_failure(self, dss_name, rate=0):
+        """Handle disk-failure command - two phase operation
+
+        The failed disk rebuilds itself in the background (at up to rate
+        bytes/s if given) and reports recovery-complete to the manager
+        itself; reads of the DSS keep working meanwhile.
+        """
         # Phase 1: Get DSS parameters
         command = f"disk-failure|{dss_name}"
         response = self.send_to_manager(command)
@@ -346,11 +967,12 @@ class DSSUser:
         parts = response.split('|')
         n = int(parts[1])
         striping_unit = int(parts[2])
+        failed_disk_idx = int(parts[3])  # The manager picks the disk, so reads know to avoid it
         
         # Extract disk triples
         disk_triples = []
         for i in range(n):
-            idx = 3 + i * 3
+            idx = 4 + i * 3
             disk_name = parts[idx]
             disk_ip = parts[idx + 1]
             disk_port = int(parts[idx + 2])
@@ -358,28 +980,70 @@ class DSSUser:
         
         print(f"[USER {self.username}] Disk failure phase 1: {dss_name}")
         
-        # Phase 2: Simulate failure and recover
-        self.simulate_failure_and_recover(dss_name, n, striping_unit, disk_triples)
-        
-        # Phase 3: Notify manager recovery complete
-        complete_cmd = f"recovery-complete|{dss_name}"
-        response = self.send_to_manager(complete_cmd)
-        print(f"[USER {self.username}] Recovery complete: {response}")
+        # Phase 2: Simulate failure and start the rebuild
+        if self.simulate_failure_and_recover(dss_name, n, striping_unit, disk_triples, failed_disk_idx, rate):
+            print(f"[USER {self.username}] Rebuild running in the background "
+                  f"(rebuild-status {dss_name} shows progress)")
+            return
+
+        # Phase 3: No rebuild started - releasing the DSS, which stays degraded
+        response = self.send_to_manager(f"recovery-failed|{dss_name}|rebuild did not start")
+        print(f"[USER {self.username}] Recovery failed: {response}")
     
-    def simulate_failure_and_recover(self, dss_name, n, striping_unit, disk_triples):
-        """Simulate disk failure and recovery"""
-        # Randomly select failed disk
-        failed_disk_idx = random.randint(0, n - 1)
+    def simulate_failure_and_recover(self, dss_name, n, striping_unit, disk_triples, failed_disk_idx,
+                                     rate=0):
+        """Simulate the failure of disk failed_disk_idx, then have it rebuild itself from the others.
+
+        Returns whether the disk started the rebuild.
+        """
         failed_disk = disk_triples[failed_disk_idx]
         
         print(f"[USER {self.username}] Failing disk {failed_disk_idx}: {failed_disk[0]}")
         
         # Send fail message to failed disk
         fail_msg = f"FAIL|{dss_name}"
-        self.send_to_peer(failed_disk[1], failed_disk[2], fail_msg.encode('utf-8'))
-         
-        time.sleep(0.5)
-        print(f"[USER {self.username}] Recovering disk {failed_disk_idx}...")
+        if self.request_peer(failed_disk, fail_msg.encode('utf-8'), 5.0) is None:
+            print(f"[USER {self.username}] No FAIL_COMPLETE from {failed_disk[0]}")
+            return False
+
+        # The disk reads the surviving blocks itself; it only needs the DSS layout and its files
+        files = []
+        for record in self.list_files({'dss': dss_name}):
+            if record.startswith("F:"):
+                size, _, file_name = record[2:].split(':', 2)
+                files.append(f"{size}:{file_name}")
+        disks = ",".join(f"{name}:{ip}:{port}" for name, ip, port in disk_triples)
+        recover_msg = (f"RECOVER|{dss_name}|{n}|{striping_unit}|{failed_disk_idx}|{rate:.0f}|{disks}|"
+                       f"{'/'.join(files)}")
+
+        print(f"[USER {self.username}] Recovering disk {failed_disk_idx} ({len(files)} files)...")
+        reply = self.request_peer(failed_disk, recover_msg.encode('utf-8'), 5.0)
+        if reply is None or not reply.startswith("RECOVER_STARTED|"):
+            print(f"[USER {self.username}] Rebuild did not start: {reply or 'no reply from ' + failed_disk[0]}")
+            return False
+        return True
+
+    def handle_rebuild_status(self, dss_name):
+        """Handle rebuild-status command - print a DSS's background rebuild progress"""
+        response = self.send_to_manager(f"rebuild-status|{dss_name}")
+        if not response.startswith("SUCCESS"):
+            print(f"[USER {self.username}] Rebuild status failed: {response}")
+            return
+        parts = response.split('|')
+        if parts[1] == "none":
+            print(f"[USER {self.username}] No rebuild running on {dss_name}")
+            return
+        if parts[1] == "failed":
+            # Format: SUCCESS|failed|disk_name|done|total|reason
+            disk_name, done, total, reason = parts[2:6]
+            print(f"[USER {self.username}] {dss_name}: rebuild of {disk_name} failed after {done}/{total} "
+                  f"stripes ({reason}); the DSS is degraded until disk-failure {dss_name} is run again")
+            return
+        # Format: SUCCESS|disk_name|done|total|bytes|seconds|rate
+        disk_name, done, total, size, seconds, rate = parts[1:7]
+        percent = 100 * int(done) / int(total) if int(total) else 0.0
+        print(f"[USER {self.username}] {dss_name}: rebuilding {disk_name}, {done}/{total} stripes "
+              f"({percent:.1f}%), {size} bytes in {seconds}s ({int(rate) / 1e6:.1f} MB/s)")
      
     def handle_decommission_dss(self, dss_name):
         """Handle decommission-dss command - two phase operation"""
@@ -398,7 +1062,7 @@ class DSSUser:
         # Extract disk triples
         disk_triples = []
         for i in range(n):
-            idx = 2 + i * 3
+            idx = 3 + i * 3
             disk_name = parts[idx]
             disk_ip = parts[idx + 1]
             disk_port = int(parts[idx + 2])
@@ -420,10 +1084,12 @@ class DSSUser:
         """Interactive command loop"""
         print(f"\n[USER {self.username}] Available commands:")
         print("  configure-dss <name> <n> <striping_unit>")
-        print("  copy <file_path>")
-        print("  read <dss_name> <file_name>")
-        print("  ls")
-        print("  disk-failure <dss_name>")
+        print("  copy <file_path> [--workers N] [--window W] [--dedup]")
+        print("  read [dss_name] <file_name> [--window W] [--offset O] [--length L]")
+        print("  write <dss_name> <file_name> <offset> <source_path> [--window W]")
+        print("  ls [--dss D] [--owner U] [--prefix P]")
+        print("  disk-failure <dss_name> [--rate MBps]")
+        print("  rebuild-status <dss_name>")
         print("  decommission-dss <dss_name>")
         print("  deregister-user")
         print("  quit\n")
@@ -438,8 +1104,10 @@ class DSSUser:
                 if cmd == "quit":
                     self.send_to_manager(f"deregister-user|{self.username}")
                     break
-                elif cmd == "ls":
-                    self.handle_ls()
+                elif cmd == "ls" or cmd.startswith("ls "):
+                    _, options = parse_options(cmd[2:])
+                    self.handle_ls({name: value for name, value in options.items()
+                                    if name in ('dss', 'owner', 'prefix') and value is not True})
                 elif cmd.startswith("configure-dss "):
                     parts = cmd.split()
                     if len(parts) == 4:
@@ -447,17 +1115,32 @@ class DSSUser:
                     else:
                         print("Usage: configure-dss <name> <n> <striping_unit>")
                 elif cmd.startswith("copy "):
-                    file_path = cmd[5:].strip()
-                    self.handle_copy(file_path)
+                    file_path, options = parse_options(cmd[5:])
+                    self.handle_copy(file_path, int(options.get('workers', 1)),
+                                     int(options.get('window', 0)) or None, bool(options.get('dedup')))
                 elif cmd.startswith("read "):
-                    parts = cmd.split()
-                    if len(parts) == 3:
-                        self.handle_read(parts[1], parts[2])
+                    args, options = parse_options(cmd[5:])
+                    parts = args.split()
+                    if len(parts) in (1, 2):
+                        length = options.get('length')
+                        self.handle_read(parts[0] if len(parts) == 2 else None, parts[-1],
+                                         int(options.get('window', 0)) or None, int(options.get('offset', 0)),
+                                         int(length) if length is not None else None)
+                    else:
+                        print("Usage: read [dss_name] <file_name> [--window W] [--offset O] [--length L]")
+                elif cmd.startswith("write "):
+                    args, options = parse_options(cmd[6:])
+                    parts = args.split()
+                    if len(parts) == 4:
+                        self.handle_write(parts[0], parts[1], int(parts[2]), parts[3],
+                                          int(options.get('window', 0)) or None)
                     else:
-                        print("Usage: read <dss_name> <file_name>")
+                        print("Usage: write <dss_name> <file_name> <offset> <source_path> [--window W]")
                 elif cmd.startswith("disk-failure "):
-                    dss_name = cmd[13:].strip()
-                    self.handle_disk_failure(dss_name)
+                    dss_name, options = parse_options(cmd[13:])
+                    self.handle_disk_failure(dss_name.strip(), float(options.get('rate', 0)) * 1e6)
+                elif cmd.startswith("rebuild-status "):
+                    self.handle_rebuild_status(cmd[15:].strip())
                 elif cmd.startswith("decommission-dss "):
                     dss_name = cmd[17:].strip()
                     self.handle_decommission_dss(dss_name)
@@ -470,6 +1153,7 @@ class DSSUser:
             except KeyboardInterrupt:
                 break
         
+        self.io.close()
         print(f"[USER {self.username}] Exiting...")
 
 if __name__ == "__main__":